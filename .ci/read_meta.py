@@ -4,7 +4,7 @@
 # ///
 """Read fields from a recipe's meta.yaml, rendered the way forge renders it.
 
-Two modes:
+Three modes:
 
   read_meta.py <meta.yaml>
       Print the build-matrix summary line — tab-separated:
@@ -22,8 +22,19 @@ Two modes:
       The optional platform (default `android`) selects the SDK used to render
       Jinja, so platform-dependent fields (like before_all) resolve correctly.
 
-Used by build-wheels.yml: the matrix step reads the summary line (to skip
-platforms a recipe opts out of, and to label jobs); the build step reads
+  read_meta.py --all [<recipes dir>]
+      Print one JSON document describing every recipe (default `recipes`),
+      keyed by recipe directory name:
+          {"numpy": {"version": "2.4.6", "build_number": 1, "build_sh": false,
+                     "platforms": [], "excluded_arches": [],
+                     "before_all": {"android": [], "ios": []},
+                     "test_requires": [], "extract_packages": []}, ...}
+      Each recipe is rendered once per platform; before_all is taken from the
+      render for its platform, everything else from the android render (as in
+      the other modes).
+
+Used by build-wheels.yml: the matrix step reads the --all document once (to
+skip platforms a recipe opts out of, and to label jobs); the build step reads
 `build.before_all` per platform (each recipe's own host build-tool setup),
 instead of hardcoding installs in the workflow.
 
@@ -32,10 +43,14 @@ any failure (missing file, bad template/YAML, absent field) it prints a
 blank-but-valid result and exits 0, so the bash callers don't blow up: the
 summary line stays tab-aligned, and a field with no value prints empty."""
 
+import json
 import sys
+from pathlib import Path
 
-import jinja2
-import yaml
+# Render with forge's own (jinja2 + pyyaml only) meta module, which shares compiled
+# templates and rendered metas with forge and with other invocations of this script.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from forge.meta import render_meta  # noqa: E402
 
 
 def _render(path: str, platform: str) -> dict:
@@ -44,11 +59,7 @@ def _render(path: str, platform: str) -> dict:
         ctx = dict(sdk="iphonesimulator", sdk_version="13.0", arch="arm64")
     else:
         ctx = dict(sdk="android", sdk_version=24, arch="arm64-v8a")
-    with open(path) as f:
-        rendered = jinja2.Template(f.read()).render(
-            version=None, py_version=sys.version_info, **ctx
-        )
-    return yaml.safe_load(rendered) or {}
+    return render_meta(path, version=None, py_version=sys.version_info, **ctx)
 
 
 def _dig(meta: dict, dotted: str):
@@ -95,11 +106,65 @@ def field_value(path: str, field: str, platform: str) -> str:
     return "" if val is None else str(val)
 
 
+def _as_list(val) -> list[str]:
+    """Normalize a string-or-list field to a list of non-blank strings."""
+    if val is None:
+        return []
+    if not isinstance(val, (list, tuple)):
+        val = [val]
+    return [str(v) for v in val if str(v).strip()]
+
+
+def recipe_summary(path: str) -> dict:
+    """Return the --all entry for one recipe. Any failure to render yields the
+    blank-but-valid entry (plus an `error`), mirroring the single-recipe modes."""
+    summary = {
+        "version": "",
+        "build_number": 1,
+        "build_sh": (Path(path).parent / "build.sh").is_file(),
+        "platforms": [],
+        "excluded_arches": [],
+        "before_all": {"android": [], "ios": []},
+        "test_requires": [],
+        "extract_packages": [],
+    }
+    try:
+        metas = {platform: _render(path, platform) for platform in ("android", "ios")}
+        meta = metas["android"]
+        pkg = meta.get("package") or {}
+        summary.update(
+            version=str(pkg.get("version", "")),
+            build_number=(meta.get("build") or {}).get("number", 1),
+            platforms=_as_list(pkg.get("platforms")),
+            excluded_arches=_as_list(pkg.get("excluded_arches")),
+            before_all={
+                platform: _as_list(_dig(meta, "build.before_all"))
+                for platform, meta in metas.items()
+            },
+            test_requires=_as_list(_dig(meta, "test.requires")),
+            extract_packages=_as_list(meta.get("extract_packages")),
+        )
+    except Exception as e:
+        summary["error"] = str(e)
+    return summary
+
+
+def all_recipes(recipes_dir: str) -> dict:
+    """Return the --all document: the summary of every recipe in a directory."""
+    return {
+        meta.parent.name: recipe_summary(str(meta))
+        for meta in sorted(Path(recipes_dir).glob("*/meta.yaml"))
+    }
+
+
 def main(argv: list[str]) -> int:
     """CLI dispatch: `<meta.yaml>` alone prints the summary line; a trailing
-    `<dotted.field> [platform]` prints that single field instead."""
+    `<dotted.field> [platform]` prints that single field instead; `--all`
+    prints the JSON document for every recipe."""
     path = argv[0]
-    if len(argv) == 1:
+    if path == "--all":
+        print(json.dumps(all_recipes(argv[1] if len(argv) > 1 else "recipes")))
+    elif len(argv) == 1:
         print(summary_line(path))
     else:
         field = argv[1]
@@ -111,7 +176,8 @@ def main(argv: list[str]) -> int:
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print(
-            "usage: read_meta.py <meta.yaml> [<dotted.field> [android|ios]]",
+            "usage: read_meta.py <meta.yaml> [<dotted.field> [android|ios]]\n"
+            "       read_meta.py --all [<recipes dir>]",
             file=sys.stderr,
         )
         sys.exit(2)
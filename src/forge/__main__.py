@@ -1,17 +1,109 @@
 from __future__ import annotations
 
 import argparse
+import atexit
+import os
 import sys
 from pathlib import Path
 
 from forge.cross import CrossVEnv
+from forge.index import SUBSETS, load_index, select_recipes
+from forge.jobserver import JobServer
 from forge.package import Package
-from forge.pypi import get_pypi_versions
+from forge.patch import check_patches
+from forge.pypi import get_all_pypi_versions
+from forge.schedule import CACHED, CANCELLED, SUCCESS, build_graph
+from forge.sources import fetch_sources, sync_mirror
+from forge.timing import Trace
+
+
+def positive_int(value: str) -> int:
+    """An argparse type for a count that must be at least 1."""
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {count}")
+    return count
+
+
+def check_patches_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="forge check-patches",
+        description=(
+            "Check that the patches of recipes still apply to their sources, "
+            "without building anything."
+        ),
+    )
+    parser.add_argument(
+        "--host",
+        choices=sorted(CrossVEnv.HOST_SDKS),
+        default="android",
+        help="The host platform to render the recipes for. Defaults to android.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help="The number of recipes to check at the same time. Defaults to the "
+        "number of CPUs.",
+    )
+    parser.add_argument(
+        "recipes",
+        nargs="*",
+        help=(
+            "Name of a package in ./recipes (add ':<version>' to override the "
+            "version), or path to a recipe directory. Defaults to every recipe "
+            "with patches."
+        ),
+    )
+    args = parser.parse_args(argv)
+
+    sdk, arch = CrossVEnv.HOST_SDKS[args.host][0]
+    cross_venv = CrossVEnv(
+        sdk=sdk, sdk_version=CrossVEnv.BASE_VERSION[args.host], arch=arch
+    )
+    targets = args.recipes or sorted(
+        path.parent.name for path in (Path.cwd() / "recipes").glob("*/meta.yaml")
+    )
+
+    builders = []
+    for target in targets:
+        if Path(target).is_dir():
+            name, version = target, None
+        else:
+            name, _, version = target.partition(":")
+        try:
+            package = Package(
+                name,
+                version=version or None,
+                build_number=None,
+                sdk=sdk,
+                sdk_version=cross_venv.sdk_version,
+                arch=arch,
+            )
+        except Exception as e:
+            print(f"Skipping {target}: can't read recipe ({e})")
+            continue
+        builders.append(package.builder(cross_venv))
+
+    sys.exit(0 if check_patches(builders, jobs=args.jobs) else 1)
 
 
 def main():
+    if sys.argv[1:2] == ["check-patches"]:
+        check_patches_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser(
-        description="Build binary wheels for mobile platforms"
+        description="Build binary wheels for mobile platforms",
+        epilog=(
+            "Use 'forge fetch <host> ...' (with the same arguments) to only "
+            "download the sources the builds would need; or 'forge mirror sync "
+            "<host> ...' to copy those sources into the local mirror. Use 'forge "
+            "check-patches [recipes ...]' to check that recipe patches still apply."
+        ),
     )
     parser.add_argument("-v", "--verbose", action="store_true", help="Log more detail")
     parser.add_argument(
@@ -19,32 +111,72 @@ def main():
         action="store_true",
         help="Clean the build folder prior to building.",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help=(
+            "Build packages even if the wheels in dist are up to date with the "
+            "recipe, sources and host Python."
+        ),
+    )
     parser.add_argument(
         "--all-versions",
         action="store_true",
         help="Build all appropriate versions of each package.",
     )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help=(
+            "Build every recipe in ./recipes that supports the host platform, in "
+            "dependency order. Equivalent to '--subset all'."
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=1,
+        help=(
+            "The number of builds to run at the same time, each in a separate "
+            "worker process. Builds are started as soon as the builds producing "
+            "their host requirements have completed. Defaults to 1 (build one "
+            "after the other)."
+        ),
+    )
+    parser.add_argument(
+        "--jobserver",
+        type=positive_int,
+        metavar="N",
+        default=None,
+        help=(
+            "Limit the total number of compile jobs across all running builds to "
+            "N, using a GNU make jobserver shared by make (4.4+), ninja (1.13+) "
+            "and cargo."
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=(
+            "Record the time spent in each phase of each build (including builds in "
+            "worker processes), print a summary, and write a Chrome trace to "
+            "logs/forge-trace.json."
+        ),
+    )
     parser.add_argument(
         "-s",
         "--subset",
-        choices=[
-            "non-py",
-            "py-any",
-            "py",
-            "smoke",
-            "smoke-non-py",
-            "smoke-py",
-            "non-smoke",
-            "all",
-        ],
-        default="all",
+        choices=SUBSETS,
+        default=None,
         help=(
-            "The subset of packages to compile. One of: non-py (all non-Python "
-            "packages), py-any (python packages that aren't platform dependent), "
-            "py (all Python packages), smoke (only packages needed "
-            "to do a support testbed check), smoke-non-py (only non-Python "
-            "smoke packages), smoke-py (only Python smoke packages), non-smoke "
-            "(all non-smoke packages), or all. Defaults to all."
+            "The subset of packages to compile, if no build targets are given. One "
+            "of: non-py (all non-Python packages), py-all-platforms (python "
+            "packages whose recipes don't restrict package.platforms), py (all "
+            "Python packages), smoke (only packages needed to do a support testbed "
+            "check), smoke-non-py (only non-Python smoke packages), smoke-py (only "
+            "Python smoke packages), non-smoke (all non-smoke packages), or all. "
+            "Defaults to all."
         ),
     )
 
@@ -68,7 +200,19 @@ def main():
         ),
     )
 
-    args = parser.parse_args()
+    # "forge fetch ..." takes the same arguments as a build, but only downloads the
+    # sources the builds would need; "forge mirror sync ..." also copies them into
+    # the local mirror.
+    argv = sys.argv[1:]
+    sync_mirror_only = argv[:2] == ["mirror", "sync"]
+    fetch_only = sync_mirror_only or argv[:1] == ["fetch"]
+    if sync_mirror_only:
+        argv = argv[2:]
+        parser.prog = f"{parser.prog} mirror sync"
+    elif fetch_only:
+        argv = argv[1:]
+        parser.prog = f"{parser.prog} fetch"
+    args = parser.parse_args(argv)
 
     try:
         platforms = [
@@ -99,10 +243,56 @@ def main():
             print()
             sys.exit(1)
 
-    build_targets = args.build_targets or []
+    if args.all and args.subset not in (None, "all"):
+        parser.error("--all can't be combined with --subset")
+    if args.build_targets:
+        if args.all or args.subset:
+            parser.error("Build targets can't be specified with --all or --subset")
+        build_targets = args.build_targets
+    else:
+        # Select the recipes from the recipe index, rather than rendering every
+        # recipe for every platform.
+        host_os = next(
+            os_name
+            for os_name, sdks in CrossVEnv.HOST_SDKS.items()
+            if platforms[0][0] in {sdk for sdk, _ in sdks}
+        )
+        subset = args.subset or "all"
+        build_targets = select_recipes(load_index(host_os), subset, host_os)
+        print(f"Selected {len(build_targets)} recipes in subset {subset!r}")
+
+    if args.jobserver:
+        jobserver = JobServer(args.jobserver, builds=args.jobs)
+        jobserver.start()
+        atexit.register(jobserver.stop)
+
+    if args.profile:
+        trace = Trace()
+        trace.start()
+
+    # When building a subset of the recipes, or building in parallel, the builds
+    # are collected into a plan, and run in dependency order once every build is
+    # known.
+    scheduled = fetch_only or not args.build_targets or args.jobs > 1
+    scheduled_builds = []
+
+    # Discover the versions of every package that needs them at once, rather than
+    # one package at a time.
+    if args.all_versions:
+        all_versions = get_all_pypi_versions(
+            [
+                build_target.split(":")[0]
+                for build_target in build_targets
+                # Targets that request a specific version don't need discovery.
+                if not Path(build_target).is_dir()
+                and not (build_target.split(":") + [""])[1]
+            ]
+        )
 
     successes = []
+    cached = []
     failures = []
+    cancellations = []
     for build_target in build_targets:
         if Path(build_target).is_dir():
             # If the build target is a directory, just build what it says.
@@ -133,7 +323,7 @@ def main():
                     print("Specific version requested; ignoring --all-versions")
                     target_versions = [requested_version]
                 else:
-                    target_versions = get_pypi_versions(package_name_or_recipe)
+                    target_versions = all_versions[package_name_or_recipe]
             else:
                 target_versions = [requested_version]
 
@@ -155,6 +345,17 @@ def main():
                     arch=arch,
                 )
 
+                cross_venv = CrossVEnv(sdk=sdk, sdk_version=sdk_version, arch=arch)
+
+                # Skip platforms the recipe declares it doesn't support.
+                host_os = cross_venv.host_os.lower()
+                if host_os not in package.meta["package"].get("platforms", [host_os]):
+                    print(
+                        f"Skipping {sdk}: {package.name} doesn't list {host_os} in "
+                        f"package.platforms"
+                    )
+                    continue
+
                 # Skip arches the recipe declares it can't build (e.g. a library
                 # with no 32-bit support listing [armeabi-v7a, x86]). Other arches
                 # of the same platform still build.
@@ -165,17 +366,64 @@ def main():
                     )
                     continue
 
-                cross_venv = CrossVEnv(sdk=sdk, sdk_version=sdk_version, arch=arch)
+                # Parallel builds can't share a source tree, so each one gets an
+                # isolated builder.
+                if scheduled:
+                    scheduled_builds.append(
+                        (
+                            package.builder(cross_venv, isolated=args.jobs > 1),
+                            (package_name_or_recipe, version, cross_venv.tag),
+                        )
+                    )
+                    continue
+
                 builder = package.builder(cross_venv)
-                success = builder.build(clean=first)
+                success = builder.build(clean=first, force=args.force)
 
                 # If the build was successful, subsequent passes don't need to be clean.
                 if success:
                     first = False
-                    successes.append((package_name_or_recipe, version, cross_venv.tag))
+                    if builder.cached:
+                        cached.append((package_name_or_recipe, version, cross_venv.tag))
+                    else:
+                        successes.append(
+                            (package_name_or_recipe, version, cross_venv.tag)
+                        )
                 else:
                     failures.append((package_name_or_recipe, version, cross_venv.tag))
 
+    if sync_mirror_only:
+        sys.exit(0 if sync_mirror([builder for builder, _ in scheduled_builds]) else 1)
+    if fetch_only:
+        sys.exit(
+            0 if fetch_sources([builder for builder, _ in scheduled_builds]) else 1
+        )
+
+    # Download every source the plan needs up front, so the builds don't wait on
+    # the network (unless download caching is disabled, in which case every build
+    # downloads its own source anyway).
+    if len(scheduled_builds) > 1 and not os.getenv("MOBILE_FORGE_CACHE_DOWNLOADS_OFF"):
+        fetch_sources([builder for builder, _ in scheduled_builds])
+
+    if scheduled_builds:
+        results = build_graph(
+            [builder for builder, _ in scheduled_builds],
+            jobs=args.jobs,
+            force=args.force,
+        )
+        for (_, entry), result in zip(scheduled_builds, results):
+            if result == SUCCESS:
+                successes.append(entry)
+            elif result == CACHED:
+                cached.append(entry)
+            elif result == CANCELLED:
+                cancellations.append(entry)
+            else:
+                failures.append(entry)
+
+    if args.profile:
+        trace.finish(Path.cwd() / "logs" / "forge-trace.json")
+
     if successes:
         print()
         print("Successful builds for:")
@@ -183,12 +431,28 @@ def main():
             print(f" * {name} {version if version else '(default version)'} ({tag})")
         print()
 
+    if cached:
+        print()
+        print("Up-to-date builds (cached) for:")
+        for name, version, tag in cached:
+            print(f" * {name} {version if version else '(default version)'} ({tag})")
+        print()
+
     if failures:
         print()
         print("Failed builds for:")
         for name, version, tag in failures:
             print(f" * {name} {version if version else '(default version)'} ({tag})")
         print()
+
+    if cancellations:
+        print()
+        print("Cancelled builds (a dependency failed) for:")
+        for name, version, tag in cancellations:
+            print(f" * {name} {version if version else '(default version)'} ({tag})")
+        print()
+
+    if failures or cancellations:
         sys.exit(1)
 
 
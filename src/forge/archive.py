@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# The maximum number of downloaded chunks buffered for a streaming extraction.
+MAX_BUFFERED_CHUNKS = 64
+
+# The number of threads used to extract a zip archive.
+ZIP_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def _strip(name: str, strip: int) -> str | None:
+    # This is the equivalent of tar's --strip-components=<strip>. Returns None for
+    # the members (e.g., the top level folder) that are stripped entirely.
+    if not strip:
+        return name
+    parts = name.split("/", strip)
+    try:
+        return parts[strip] or None
+    except IndexError:
+        return None
+
+
+def extract_tar(fileobj, path: Path, strip: int = 1):
+    """Extract a tar archive as a stream.
+
+    Each member is written as soon as it has been read, so the archive can be
+    extracted while it is still being downloaded, and memory use doesn't grow with
+    the size of the archive.
+
+    :param fileobj: A file-like object to read the (possibly compressed) archive
+        from.
+    :param path: The folder to extract into.
+    :param strip: The number of leading path components to strip from each member.
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+        for member in tf:
+            name = _strip(member.name, strip)
+            if name is not None:
+                member.name = name
+                if member.islnk():
+                    member.linkname = _strip(member.linkname, strip) or ""
+                    _extract_hard_link(member, path)
+                else:
+                    tf.extract(member, path=path)
+            # Hard links are made from the extracted files, so a stream doesn't
+            # need the members it has already passed.
+            tf.members = []
+
+
+def _extract_hard_link(member: tarfile.TarInfo, path: Path):
+    # A hard link always refers to a member earlier in the archive, which has
+    # already been extracted. tarfile would look that member up in the list of
+    # members, and read it from the archive again if the file system can't make
+    # hard links; a stream can't be read again, so link (or copy) the extracted
+    # file instead.
+    target = path / member.linkname
+    link = path / member.name
+    link.parent.mkdir(parents=True, exist_ok=True)
+    link.unlink(missing_ok=True)
+    try:
+        os.link(target, link)
+    except OSError:
+        shutil.copy2(target, link)
+
+
+def extract_zip(archive_path: Path, path: Path, strip: int = 1):
+    """Extract a zip archive, using several threads.
+
+    :param archive_path: The archive.
+    :param path: The folder to extract into.
+    :param strip: The number of leading path components to strip from each member.
+    """
+    with zipfile.ZipFile(archive_path) as zf:
+        members = []
+        for member in zf.infolist():
+            name = _strip(member.filename, strip)
+            if name is not None:
+                member.filename = name
+                members.append(member)
+
+        # Create the folders first, so the threads don't race to create them.
+        for member in members:
+            target = path / member.filename
+            (target if member.is_dir() else target.parent).mkdir(
+                parents=True, exist_ok=True
+            )
+
+    files = [member for member in members if not member.is_dir()]
+
+    def extract(batch):
+        # Each thread reads the archive through a handle of its own.
+        with zipfile.ZipFile(archive_path) as zf:
+            for member in batch:
+                zf.extract(member, path=path)
+
+    batches = [files[i::ZIP_WORKERS] for i in range(ZIP_WORKERS)]
+    with ThreadPoolExecutor(max_workers=ZIP_WORKERS) as executor:
+        # Consume the results, so that any error is raised.
+        list(executor.map(extract, [batch for batch in batches if batch]))
+
+
+def extract(archive_path: Path, path: Path, strip: int = 1):
+    """Extract an archive.
+
+    :param archive_path: The archive; a tar archive (compressed or not), or a zip
+        file. The type is determined by the content, not the file name, since some
+        packages (e.g., brotli) have uploaded a .tar.gz file... that is actually a
+        zipfile (!).
+    :param path: The folder to extract into.
+    :param strip: The number of leading path components to strip from each member.
+    :raises: ``RuntimeError`` if the type of archive can't be identified.
+    """
+    if tarfile.is_tarfile(archive_path):
+        with archive_path.open("rb") as f:
+            extract_tar(f, path, strip=strip)
+    elif zipfile.is_zipfile(archive_path):
+        extract_zip(archive_path, path, strip=strip)
+    else:
+        raise RuntimeError(f"Can't identify archive type of {archive_path}")
+
+
+class StreamingExtractor:
+    """Extract a tar archive in a background thread, as it is downloaded.
+
+    The content of the archive is passed to :meth:`feed`, as it is received. If the
+    content turns out not to be a tar archive, or the download doesn't deliver the
+    archive from start to finish in one pass (e.g., it resumes a download from an
+    earlier run), the extraction is abandoned, and the archive must be extracted
+    once it has been downloaded.
+    """
+
+    def __init__(self, path: Path, strip: int = 1):
+        """
+        :param path: The folder to extract into.
+        :param strip: The number of leading path components to strip from each
+            member.
+        """
+        self.path = path
+        self.strip = strip
+        self.received = 0
+        self.failed = False
+        self._chunks = queue.Queue(maxsize=MAX_BUFFERED_CHUNKS)
+        self._buffer = b""
+        self._thread = threading.Thread(target=self._extract, daemon=True)
+        self._thread.start()
+
+    def _extract(self):
+        try:
+            extract_tar(self, self.path, strip=self.strip)
+        except Exception:
+            self.failed = True
+
+    def read(self, size=-1) -> bytes:
+        # The file-like interface used by tarfile, in the extraction thread.
+        while not self._buffer:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return b""
+            if chunk is False:
+                raise RuntimeError("The download was interrupted.")
+            self._buffer = chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _put(self, item):
+        # Don't wait on an extraction that has stopped reading.
+        while self._thread.is_alive():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def feed(self, offset: int, data: bytes):
+        """Pass the next part of the archive to the extraction.
+
+        :param offset: The offset of the data in the archive.
+        :param data: The content of the archive at that offset.
+        """
+        if self.failed:
+            return
+        if offset != self.received:
+            self.failed = True
+            self._put(False)
+            return
+        self.received += len(data)
+        self._put(data)
+
+    def abort(self):
+        """Abandon the extraction (e.g., because the download failed)."""
+        if not self.failed:
+            self.failed = True
+            self._put(False)
+        self._thread.join()
+
+    def close(self) -> bool:
+        """Wait for the extraction to finish.
+
+        :returns: True if the whole archive was extracted.
+        """
+        if not self.failed:
+            self._put(None)
+        self._thread.join()
+        return not self.failed
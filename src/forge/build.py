@@ -1,24 +1,37 @@
 from __future__ import annotations
 
-import multiprocessing
+import hashlib
+import itertools
+import json
 import os
 import re
 import shutil
 import struct
 import sys
-import tarfile
-import zipfile
 from abc import ABC, abstractmethod, abstractproperty
 from email import generator, message, parser
+from importlib import metadata
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import httpx
 from packaging.utils import canonicalize_name, canonicalize_version
-
-from forge import subprocess
+from packaging.version import InvalidVersion, Version
+
+from forge import (
+    archive,
+    git,
+    jobserver,
+    optstore,
+    pristine,
+    sources,
+    store,
+    subprocess,
+    wheelhouse,
+)
 from forge.logger import log, log_exception
-from forge.pypi import get_pypi_source_urls
+from forge.patch import apply_patch
+from forge.pypi import get_pypi_source_sha256, get_pypi_source_urls
+from forge.timing import phase
 from forge.utils import merge_dicts
 
 try:
@@ -33,9 +46,19 @@ if TYPE_CHECKING:
 
 
 class Builder(ABC):
-    def __init__(self, cross_venv: CrossVEnv, package: Package):
+    def __init__(self, cross_venv: CrossVEnv, package: Package, isolated=False):
+        """
+        :param cross_venv: The cross-platform environment to build in.
+        :param package: The package to build.
+        :param isolated: Should the build use a source tree that isn't shared with
+            any other architecture? Required when several architectures of the
+            same package are built at the same time.
+        """
         self.cross_venv = cross_venv
         self.package = package
+        self.isolated = isolated
+        # Set if the most recent call to build() found the build up to date.
+        self.cached = False
 
     @property
     @abstractmethod
@@ -56,14 +79,73 @@ class Builder(ABC):
         return self.log_file_path.parent.parent / "errors" / self.log_file_path.name
 
     @property
-    @abstractmethod
-    def source_archive_path(self) -> Path:
-        """The source archive file for the package."""
-        ...
+    def source_type(self) -> str | None:
+        """The kind of source the recipe builds from: ``archive`` (a URL or PyPI
+        sdist), ``git`` or ``path``; or None if the recipe has no source."""
+        source = self.package.meta.get("source")
+        if source is None:
+            return None
+        if isinstance(source, dict) and "git_url" in source:
+            return "git"
+        if isinstance(source, dict) and "path" in source:
+            return "path"
+        return "archive"
+
+    def source_sha256(self) -> str | None:
+        """The expected SHA256 hash of the source archive, if it is known.
+
+        This is the ``sha256`` of the recipe's source; or, for an sdist from PyPI,
+        the hash published by the package index.
+        """
+        source = self.package.meta.get("source")
+        if isinstance(source, dict) and "sha256" in source:
+            # The schema allows either case; the store uses lowercase.
+            return source["sha256"].lower()
+        return get_pypi_source_sha256(self.download_source_url())
+
+    @property
+    def source_archive_path(self) -> Path | None:
+        """The source archive file for the package, in the download store; or None
+        if it hasn't been downloaded."""
+        return store.lookup(self.download_source_url(), self.source_sha256())
+
+    def extra_requirements(self, target) -> list[str]:
+        """The requirements that forge itself needs to build the package, in
+        addition to those listed by the recipe.
+
+        :param target: The environment the requirements are installed in: ``host``
+            (the cross environment) or ``build``.
+        """
+        return []
+
+    def updated_requirements(self, target) -> list[str]:
+        """The tools that must be updated to their most recent version, rather than
+        just satisfied by what is already installed in an environment.
+
+        :param target: The environment the requirements are installed in: ``host``
+            (the cross environment) or ``build``.
+        """
+        return []
 
     def install_requirements(self, target):
+        """Install every requirement of an environment in a single pass of pip.
+
+        Installing them together means they are resolved together, so no
+        requirement can upgrade (or downgrade) what another has installed. Any
+        tools that must be updated (see :meth:`updated_requirements`) are updated
+        first, so the update doesn't apply to the recipe's requirements.
+
+        :param target: The environment to install in: ``host`` (the cross
+            environment) or ``build``.
+        """
+        # host_build deps install into the cross env like host deps (so the build
+        # can link them), but are NOT promoted to the wheel's Requires-Dist
+        # (fix_wheel only promotes "host"). For statically-linked native libs.
+        sections = ["host", "host_build"] if target == "host" else [target]
         requirements = []
-        for requirement in self.package.meta["requirements"][target]:
+        for requirement in itertools.chain(
+            *(self.package.meta["requirements"][section] for section in sections)
+        ):
             try:
                 package, version = requirement.split(maxsplit=1)
                 if version.startswith((">=", "<=", "!=", "==", "~=", ">", "<")):
@@ -77,7 +159,31 @@ class Builder(ABC):
             except ValueError:
                 specifier = requirement
             requirements.append(specifier)
+        requirements += self.extra_requirements(target)
+        if not requirements:
+            log(self.log_file, f"No {target} requirements.")
+            return
 
+        if target == "host" and not os.getenv("MOBILE_FORGE_OPT_STORE_OFF"):
+            # Native library wheels are linked from a shared store, rather than
+            # being unpacked into every environment.
+            requirements = optstore.link_requirements(
+                self.log_file,
+                requirements,
+                tag=self.cross_venv.tag,
+                site_packages=self.cross_venv.install_root.parent,
+                paths=[Path.cwd() / "dist", wheelhouse.cache_path()],
+            )
+
+        updated = self.updated_requirements(target)
+        if updated:
+            self.cross_venv.pip_install(
+                self.log_file,
+                updated,
+                update=True,
+                paths=[Path.cwd() / "dist"],
+                build=target == "build",
+            )
         if requirements:
             self.cross_venv.pip_install(
                 self.log_file,
@@ -85,8 +191,16 @@ class Builder(ABC):
                 paths=[Path.cwd() / "dist"],
                 build=target == "build",
             )
-        else:
-            log(self.log_file, f"No {target} requirements.")
+
+    def _write_shim(self, shim: Path, lines: list[str]):
+        # The shim may be hardlinked into the environment from an installer's
+        # cache (see forge.installers), so a new file replaces it, rather than
+        # the shared file being modified.
+        tmp_path = shim.with_name(f"{shim.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.writelines(lines)
+        shutil.copymode(shim, tmp_path)
+        os.replace(tmp_path, shim)
 
     def fix_host_tool_shims(self):
         python_path = (
@@ -95,20 +209,20 @@ class Builder(ABC):
             / "bin"
             / f"python3.{sys.version_info.minor}"
         )
-        for shim in (self.cross_venv.venv_path / "cross" / "bin").iterdir():
+        for shim in list((self.cross_venv.venv_path / "cross" / "bin").iterdir()):
             with open(shim, "r") as f:
                 lines = f.readlines()
             if len(lines) > 0 and lines[0].strip() == f"#!{python_path}":
                 log(self.log_file, f"Fixing host shim: {shim}")
-                with open(shim, "w") as f:
-                    f.writelines(
-                        [
-                            "#!/bin/sh\n",
-                            "'''exec' {} \"$0\" \"$@\"\n".format(python_path),
-                            "' '''\n\n",
-                        ]
-                        + lines[1:]
-                    )
+                self._write_shim(
+                    shim,
+                    [
+                        "#!/bin/sh\n",
+                        "'''exec' {} \"$0\" \"$@\"\n".format(python_path),
+                        "' '''\n\n",
+                    ]
+                    + lines[1:],
+                )
             elif (
                 len(lines) > 2
                 and lines[0].strip() == "#!/bin/sh"
@@ -124,80 +238,99 @@ class Builder(ABC):
                 if suffix:
                     repaired.append(suffix)
                 repaired += lines[3:]
-                with open(shim, "w") as f:
-                    f.writelines(repaired)
+                self._write_shim(shim, repaired)
 
     @abstractmethod
     def download_source_url(self): ...
 
-    def download_source(self):
-        """Download the source tarball."""
+    def download_source(self, unpack_path: Path | None = None) -> bool:
+        """Download the source tarball.
+
+        :param unpack_path: A folder to extract the archive into while it is being
+            downloaded, if possible.
+        :returns: True if the archive was extracted into ``unpack_path``. If it
+            wasn't, ``unpack_path`` may hold part of the archive.
+        """
         url = self.download_source_url()
         log(self.log_file, f"Downloading {url}...", end="", flush=True)
-        self.source_archive_path.parent.mkdir(parents=True, exist_ok=True)
-        with httpx.stream("GET", url, follow_redirects=True) as response:
-            with self.source_archive_path.open("wb") as f:
-                for i, chunk in enumerate(response.iter_bytes()):
-                    if i % 100 == 0:
-                        log(self.log_file, ".", end="", flush=True)
-                    f.write(chunk)
-        log(self.log_file, " done.")
-
-    def unpack_source(self):
+        # The store only makes the archive visible once it is complete (and
+        # verified). Concurrent builds of other architectures may be downloading (or
+        # unpacking) the same archive.
+        chunks = itertools.count()
+
+        def progress(size, length):
+            if next(chunks) % 100 == 0:
+                log(self.log_file, ".", end="", flush=True)
+
+        if unpack_path is None:
+            extractor = None
+        else:
+            extractor = archive.StreamingExtractor(unpack_path, self.source_strip)
+
+        try:
+            path = sources.download_archive(
+                url,
+                self.source_sha256(),
+                progress=progress,
+                sink=extractor.feed if extractor else None,
+            )
+        except BaseException:
+            if extractor:
+                extractor.abort()
+            raise
+        log(self.log_file, f" done (sha256 {path.name}).")
+
+        if extractor is None:
+            return False
+        if extractor.close():
+            log(self.log_file, "Unpacked while downloading.")
+            return True
+        return False
+
+    def checkout_source(self):
+        """Check out a Git source, or copy a local source, into the build folder."""
+        source = self.package.meta["source"]
+        if self.source_type == "git":
+            log(
+                self.log_file,
+                f"Checking out {source['git_url']} at {source['git_rev']}...",
+            )
+            commit = git.checkout(
+                self.log_file, source["git_url"], source["git_rev"], self.build_path
+            )
+            log(self.log_file, f"Checked out {commit}.")
+        else:
+            path = self.package.recipe_path / source["path"]
+            log(self.log_file, f"Copying {path}...")
+            shutil.copytree(path, self.build_path, symlinks=True)
+
+    @property
+    def source_strip(self) -> int:
+        """The number of leading path components to strip when unpacking the
+        source archive."""
+        # By default, this is 1; but some source types can override.
+        try:
+            return self.package.meta["source"]["strip"]
+        except (TypeError, KeyError):
+            return 1
+
+    def unpack_source(self, path: Path | None = None):
+        """Unpack the source archive.
+
+        :param path: The folder to unpack into. Defaults to the build folder.
+        """
+        path = path or self.build_path
         log(
             self.log_file,
             f"Unpacking {self.source_archive_path.relative_to(Path.cwd())}...",
         )
-        # Determine the stripping level. By default, this is 1;
-        # but some source types can override.
-        try:
-            strip = self.package.meta["source"]["strip"]
-        except (TypeError, KeyError):
-            strip = 1
-
-        # Some packages (e.g., brotli) have uploaded a .tar.gz file... that is
-        # actually a zipfile (!).
-        if tarfile.is_tarfile(self.source_archive_path):
-            # This is the equivalent of --strip-components=<strip>
-            def members(tf: tarfile.TarFile, strip=1):
-                for member in tf.getmembers():
-                    parts = member.path.split("/", strip)
-                    try:
-                        if parts[strip]:
-                            member.path = parts[strip]
-                            yield member
-                    except IndexError:
-                        pass
-
-            with tarfile.open(self.source_archive_path) as tf:
-                tf.extractall(
-                    path=self.build_path,
-                    members=members(tf, strip=strip) if strip else None,
-                )
-        elif zipfile.is_zipfile(self.source_archive_path):
-            # Strip the top level folder.
-            zf = zipfile.ZipFile(self.source_archive_path)
-
-            def members(zf, strip=1):
-                for member in zf.infolist():
-                    parts = member.filename.split("/", strip)
-                    try:
-                        if parts[strip]:
-                            member.filename = parts[strip]
-                            yield member
-                    except IndexError:
-                        pass
-
-            zf.extractall(
-                path=self.build_path,
-                members=members(zf, strip=strip) if strip else None,
-            )
-        else:
-            raise RuntimeError(
-                f"Can't identify archive type of {self.source_archive_path}"
-            )
+        archive.extract(self.source_archive_path, path, strip=self.source_strip)
 
-    def patch_source(self):
+    def patch_source(self, path: Path | None = None):
+        """Apply the recipe's patches to the source.
+
+        :param path: The source folder to patch. Defaults to the build folder.
+        """
         patched = False
         for patch in self.package.meta["patches"]:
             patchfile = self.package.recipe_path / "patches" / patch
@@ -205,36 +338,54 @@ class Builder(ABC):
                 self.log_file,
                 f"Applying {patchfile.relative_to(self.package.recipe_path)}...",
             )
-            # This can use a raw subprocess.run because it's a system command,
-            # not anything dependent on the Python environment.
-            subprocess.run(
-                self.log_file,
-                [
-                    "patch",
-                    "-p1",
-                    "--ignore-whitespace",
-                    "--quiet",
-                    "--input",
-                    str(patchfile),
-                ],
-                cwd=self.build_path,
-            )
+            results = apply_patch(patchfile, path or self.build_path)
+            # Report the hunks that didn't apply exactly as written, so that
+            # patches can be refreshed before they stop applying.
+            for result in results:
+                if not result.clean:
+                    log(self.log_file, f"    {result}")
+            if not all(result.applied for result in results):
+                raise RuntimeError(f"Patch {patch} doesn't apply.")
             patched = True
 
         if not patched:
             log(self.log_file, "No patches to apply.")
 
-    def prepare(self, clean=True):
-        if clean and self.build_path.is_dir():
-            if clean:
-                log(self.log_file, f"\n[{self.cross_venv}] Clean up old builds")
-                log(
-                    self.log_file,
-                    f"Removing {self.build_path.relative_to(Path.cwd())}...",
-                )
-                shutil.rmtree(self.build_path)
+    def materialize_source(self, unpacked: Path | None = None):
+        """Create the build folder from the cache of unpacked and patched source
+        trees, unpacking and patching the source archive first if it isn't cached.
+
+        :param unpacked: A folder the source archive has already been unpacked into,
+            if there is one. It is used (or removed) in place.
+        """
 
-        if self.package.meta.get("source") is None:
+        def populate(path):
+            if unpacked is None:
+                self.unpack_source(path)
+            else:
+                path.rmdir()
+                os.replace(unpacked, path)
+            with phase("patch"):
+                self.patch_source(path)
+
+        key = pristine.source_key(
+            self.source_archive_path.name,
+            self.source_strip,
+            [
+                self.package.recipe_path / "patches" / patch
+                for patch in self.package.meta["patches"]
+            ],
+        )
+        pristine.materialize(self.log_file, key, self.build_path, populate)
+        if unpacked is not None and unpacked.is_dir():
+            # The cache already held the source tree.
+            shutil.rmtree(unpacked)
+
+    def prepare_source(self):
+        """Create the source tree in the build folder, unless it exists: the
+        recipe's source is downloaded (if it isn't in the store), unpacked and
+        patched."""
+        if self.source_type is None:
             # A `source: null` recipe has no upstream archive to download: its build.sh
             # produces its own sources (e.g. copying a library out of the NDK, or
             # generating one inline). Skip the download/unpack and just create an empty
@@ -248,41 +399,77 @@ class Builder(ABC):
                 self.build_path.mkdir(parents=True, exist_ok=True)
         else:
             # Re-download sources if caching is disabled or no cached tarball exists.
-            # By default, the cached tarball is reused across arch builds to avoid downloading
-            # the same source multiple times. Disable caching when testing source-tarball patches,
-            # since each arch reuses and re-unpacks the same cached archive.
-            if (
+            # By default, the tarball is downloaded once, and unpacked and patched
+            # once into a source tree that is cloned for every architecture.
+            cache_tree = self.source_type == "archive" and not os.getenv(
+                "MOBILE_FORGE_CACHE_DOWNLOADS_OFF"
+            )
+            unpacked = None
+            if self.source_type == "archive" and (
                 os.getenv("MOBILE_FORGE_CACHE_DOWNLOADS_OFF")
-                or not self.source_archive_path.is_file()
+                or self.source_archive_path is None
             ):
                 log(self.log_file, f"\n[{self.cross_venv}] Download package sources")
-                self.download_source()
+                with phase("download"):
+                    if cache_tree and not self.build_path.is_dir():
+                        # Unpack the archive as it arrives, rather than waiting
+                        # for the download to finish.
+                        unpacked = pristine.cache_path() / f"download.{os.getpid()}.tmp"
+                        shutil.rmtree(unpacked, ignore_errors=True)
+                        unpacked.mkdir(parents=True)
+                        if not self.download_source(unpack_path=unpacked):
+                            shutil.rmtree(unpacked)
+                            unpacked = None
+                    else:
+                        self.download_source()
 
             if not self.build_path.is_dir():
-                log(self.log_file, f"\n[{self.cross_venv}] Unpack sources")
-                self.unpack_source()
+                if cache_tree:
+                    # Every architecture builds from the same patched source, so
+                    # it is only unpacked and patched once, then cloned.
+                    log(self.log_file, f"\n[{self.cross_venv}] Prepare sources")
+                    with phase("unpack"):
+                        self.materialize_source(unpacked)
+                else:
+                    if self.source_type == "archive":
+                        log(self.log_file, f"\n[{self.cross_venv}] Unpack sources")
+                        with phase("unpack"):
+                            self.unpack_source()
+                    else:
+                        log(self.log_file, f"\n[{self.cross_venv}] Check out sources")
+                        with phase("checkout"):
+                            self.checkout_source()
 
-                log(self.log_file, f"\n[{self.cross_venv}] Apply patches")
-                self.patch_source()
+                    log(self.log_file, f"\n[{self.cross_venv}] Apply patches")
+                    with phase("patch"):
+                        self.patch_source()
+
+    def prepare(self, clean=True):
+        if clean and self.build_path.is_dir():
+            if clean:
+                log(self.log_file, f"\n[{self.cross_venv}] Clean up old builds")
+                log(
+                    self.log_file,
+                    f"Removing {self.build_path.relative_to(Path.cwd())}...",
+                )
+                with phase("clean"):
+                    shutil.rmtree(self.build_path)
+
+        self.prepare_source()
 
         # Create a clean cross environment.
         log(self.log_file, f"\n[{self.cross_venv}] Create clean build environment")
-        self.cross_venv.create(location=self.build_path, clean=True)
+        with phase("create venv"):
+            self.cross_venv.create(location=self.build_path, clean=True)
 
         log(self.log_file, f"\n[{self.cross_venv}] Install forge host requirements")
-        self.install_requirements("host")
-        # host_build deps install into the cross env like host deps (so the build
-        # can link them), but are NOT promoted to the wheel's Requires-Dist (that
-        # loop below only walks "host"). For statically-linked native libs.
-        log(
-            self.log_file,
-            f"\n[{self.cross_venv}] Install forge host_build requirements",
-        )
-        self.install_requirements("host_build")
+        with phase("install host requirements"):
+            self.install_requirements("host")
         self.fix_host_tool_shims()
 
         log(self.log_file, f"\n[{self.cross_venv}] Install forge build requirements")
-        self.install_requirements("build")
+        with phase("install build requirements"):
+            self.install_requirements("build")
 
     def compile_env(self, **kwargs) -> dict[str, str]:
         sysconfig_data = self.cross_venv.sysconfig_data
@@ -553,6 +740,9 @@ class Builder(ABC):
                 / f"python{self.cross_venv.sysconfig_data['py_version_short']}"
             ),
         }
+        # If forge is sharing a jobserver between builds, make/ninja/cargo need to
+        # be told where to get their job tokens.
+        env.update(jobserver.client_env())
         env.update(kwargs)
 
         if self.cross_venv.sdk == "android":
@@ -611,7 +801,149 @@ class Builder(ABC):
 
         return env
 
-    def build(self, clean):
+    @property
+    def fingerprint_path(self) -> Path:
+        """The file recording the fingerprint of the build that produced the wheels
+        for this package in dist."""
+        return (
+            Path.cwd()
+            / "dist"
+            / (
+                f"{canonicalize_name(self.package.name)}-{self.package.version}-"
+                f"{self.wheel_tag}.fingerprint"
+            )
+        )
+
+    def wheel_paths(self) -> list[Path]:
+        """The wheels in dist for this package, version and platform tag."""
+        try:
+            version = Version(self.package.version)
+        except InvalidVersion:
+            version = self.package.version
+
+        wheels = []
+        for wheel in (Path.cwd() / "dist").glob(f"*-{self.wheel_tag}.whl"):
+            wheel_name, wheel_version = wheel.name.split("-")[:2]
+            try:
+                wheel_version = Version(wheel_version)
+            except InvalidVersion:
+                pass
+            if (
+                canonicalize_name(wheel_name) == canonicalize_name(self.package.name)
+                and wheel_version == version
+            ):
+                wheels.append(wheel)
+        return sorted(wheels)
+
+    def fingerprint(self) -> str:
+        """Compute a fingerprint of every input to the build.
+
+        The fingerprint covers the rendered recipe metadata, the patches and build
+        script of the recipe, the source (the archive, the Git commit, or the content
+        of a local source), the host Python, and forge itself. A source archive is
+        identified by its expected SHA256; only if that isn't known (and the archive
+        hasn't been downloaded) is the archive downloaded. A Git source is fetched,
+        if it hasn't been.
+
+        :returns: A hex digest identifying the build.
+        """
+        digest = hashlib.sha256()
+
+        def add(label, data: bytes):
+            digest.update(label.encode() + b"\0" + data + b"\0")
+
+        # forge itself: the version, plus the source, since it rarely changes version.
+        try:
+            add("forge", metadata.version("mobile-forge").encode())
+        except metadata.PackageNotFoundError:
+            pass
+        for path in sorted(Path(__file__).parent.glob("**/*.py")) + sorted(
+            Path(__file__).parent.glob("schema/*.yaml")
+        ):
+            add(f"forge:{path.name}", path.read_bytes())
+
+        add("python", sys.version.encode())
+        add("tag", self.wheel_tag.encode())
+        add("meta", json.dumps(self.package.meta, sort_keys=True, default=str).encode())
+        for patch in self.package.meta["patches"]:
+            add(
+                f"patch:{patch}",
+                (self.package.recipe_path / "patches" / patch).read_bytes(),
+            )
+        if (self.package.recipe_path / "build.sh").is_file():
+            add("build.sh", (self.package.recipe_path / "build.sh").read_bytes())
+
+        if self.source_type == "archive":
+            # Archives in the store are named by their SHA256. If the hash is
+            # known, the archive isn't needed yet; a build will download it, and
+            # unpack it as it arrives.
+            sha256 = self.source_sha256()
+            if sha256 is None:
+                if self.source_archive_path is None:
+                    self.download_source()
+                sha256 = self.source_archive_path.name
+            add("source", sha256.encode())
+        elif self.source_type == "git":
+            source = self.package.meta["source"]
+            add(
+                "source",
+                git.resolve(None, source["git_url"], source["git_rev"]).encode(),
+            )
+        elif self.source_type == "path":
+            path = self.package.recipe_path / self.package.meta["source"]["path"]
+            for file in sorted(path.rglob("*")):
+                if file.is_file():
+                    add(f"source:{file.relative_to(path)}", file.read_bytes())
+
+        # The host Python: where it is, and how it was configured.
+        add("host", str(self.cross_venv.host_python_home).encode())
+        add("host:sysconfig", self.cross_venv.find_host_sysconfig().read_bytes())
+
+        return digest.hexdigest()
+
+    def is_up_to_date(self, fingerprint: str) -> bool:
+        """Do the wheels in dist come from a build with the given fingerprint?
+
+        :param fingerprint: The fingerprint of the build to be performed.
+        """
+        try:
+            recorded = json.loads(self.fingerprint_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return False
+
+        return (
+            recorded.get("fingerprint") == fingerprint
+            and bool(recorded.get("wheels"))
+            and all(
+                (Path.cwd() / "dist" / wheel).is_file() for wheel in recorded["wheels"]
+            )
+        )
+
+    def write_fingerprint(self, fingerprint: str):
+        """Record the fingerprint of a successful build next to its wheels.
+
+        :param fingerprint: The fingerprint of the build.
+        """
+        self.fingerprint_path.write_text(
+            json.dumps(
+                {
+                    "fingerprint": fingerprint,
+                    "wheels": [wheel.name for wheel in self.wheel_paths()],
+                },
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+
+    def build(self, clean, force=False):
+        """Build the package, unless the wheels in dist are already up to date.
+
+        :param clean: Should the build start from a clean build folder?
+        :param force: Should the package be built even if it is up to date?
+        :returns: True if the build succeeded (or was up to date).
+        """
+        self.cached = False
+
         # If there's an error log file, remove it.
         # The log file will be overwritten by being re-opened.
         if self.error_log_file_path.exists():
@@ -641,9 +973,21 @@ class Builder(ABC):
                 log(self.log_file, "-" * 80)
 
             try:
-                self.prepare(clean=clean)
-                self._build()
-                success = True
+                with phase("build", build=f"{self.package} ({self.cross_venv.tag})"):
+                    with phase("fingerprint"):
+                        fingerprint = self.fingerprint()
+                    if not force and self.is_up_to_date(fingerprint):
+                        log(
+                            self.log_file,
+                            f"[{self.cross_venv}] {self.package} is up to date "
+                            f"({self.fingerprint_path.name}); skipping build",
+                        )
+                        self.cached = True
+                    else:
+                        self.prepare(clean=clean)
+                        self._build()
+                        self.write_fingerprint(fingerprint)
+                    success = True
             except Exception:
                 log(self.log_file, "*" * 80)
                 log(
@@ -1057,12 +1401,6 @@ class Builder(ABC):
 class SimplePackageBuilder(Builder):
     """A builder for projects that have a build.sh entry point."""
 
-    @property
-    def source_archive_path(self) -> Path:
-        url = self.download_source_url()
-        filename = url.split("/")[-1]
-        return Path.cwd() / "downloads" / filename
-
     @property
     def build_path(self) -> Path:
         # Generate a separate build path for each platform, since we can't guarantee
@@ -1098,8 +1436,9 @@ class SimplePackageBuilder(Builder):
         # Always clean a non-Python build.
         super().prepare(clean=True)
 
-        log(self.log_file, f"\n[{self.cross_venv}] Installing wheel-building tools")
-        self.cross_venv.pip_install(self.log_file, ["wheel"], build=True)
+    def extra_requirements(self, target) -> list[str]:
+        # The wheel-building tools.
+        return ["wheel"] if target == "build" else []
 
     def make_wheel(self):
         build_num = str(self.package.meta["build"]["number"])
@@ -1135,7 +1474,8 @@ class SimplePackageBuilder(Builder):
         )
 
         # fix wheel before packaging
-        self.fix_wheel(self.build_path / "wheel")
+        with phase("fix wheel"):
+            self.fix_wheel(self.build_path / "wheel")
 
         # Re-pack the wheel file
         log(self.log_file, f"\n[{self.cross_venv}] Packing wheel")
@@ -1163,6 +1503,7 @@ class SimplePackageBuilder(Builder):
                 str(self.package.recipe_path / "build.sh"),
             ],
             cwd=self.build_path,
+            pass_fds=jobserver.pass_fds(),
             env=self.compile_env(
                 **{
                     "HOST_TRIPLET": self.cross_venv.platform_triplet,
@@ -1175,7 +1516,7 @@ class SimplePackageBuilder(Builder):
                         else ""
                     ),
                     "BUILD_TRIPLET": f"{os.uname().machine}-apple-darwin",
-                    "CPU_COUNT": str(multiprocessing.cpu_count()),
+                    "CPU_COUNT": str(jobserver.cpu_count()),
                     "PREFIX": str(self.build_path / "wheel" / "opt"),
                     "PYTHON_PREFIX": self.cross_venv.sysconfig_data["prefix"],
                     "PLATLIB": self.cross_venv.scheme_paths["platlib"],
@@ -1184,8 +1525,10 @@ class SimplePackageBuilder(Builder):
         )
 
     def _build(self):
-        self.compile()
-        self.make_wheel()
+        with phase("compile"):
+            self.compile()
+        with phase("make wheel"):
+            self.make_wheel()
 
 
 class CMakePackageBuilder(SimplePackageBuilder):
@@ -1198,26 +1541,24 @@ class CMakePackageBuilder(SimplePackageBuilder):
 class PythonPackageBuilder(Builder):
     """A builder for projects available on PyPI."""
 
-    @property
-    def source_archive_path(self) -> Path:
-        return (
-            Path.cwd()
-            / "downloads"
-            / f"{self.package.name}-{self.package.version}.tar.gz"
-        )
-
     @property
     def build_path(self) -> Path:
         # Generate a separate build path for each Python version to ensure we have a
         # clean build. SDK versions can co-exist because wheel builds are cleanly
-        # separated.
-        return (
+        # separated - as long as they are built one after the other. An isolated
+        # build gets a tree of its own, so that in-place build products of one
+        # architecture can't leak into the wheel of another that is being built at
+        # the same time.
+        path = (
             Path.cwd()
             / "build"
             / f"cp3{sys.version_info.minor}"
             / self.package.name
             / self.package.version
         )
+        if self.isolated:
+            path = path / self.cross_venv.tag
+        return path
 
     @property
     def log_file_path(self) -> Path:
@@ -1246,53 +1587,28 @@ class PythonPackageBuilder(Builder):
             )
         return get_pypi_source_urls(self.package.name)[self.package.version]
 
-    def prepare(self, clean=True):
-        super().prepare(clean=clean)
-
-        # Install any build requirements (PEP517 or otherwise)
+    def extra_requirements(self, target) -> list[str]:
+        # The build requirements of the package (PEP517 or otherwise)
         if (self.build_path / "pyproject.toml").is_file():
-            log(
-                self.log_file,
-                f"\n[{self.cross_venv}] Install pyproject.toml build requirements",
-            )
-
-            # Install the requirements from pyproject.toml
+            # Install the requirements from pyproject.toml in the build environment
+            if target == "host":
+                return []
             with (self.build_path / "pyproject.toml").open("rb") as f:
                 pyproject = tomllib.load(f)
-
-                # Install the build requirements in the cross environment
-                # self.cross_venv.pip_install(
-                #     self.log_file,
-                #     ["build", "wheel"] + pyproject["build-system"]["requires"],
-                #     paths=[Path.cwd() / "dist"],
-                # )
-
-                # Install the build requirements in the build environment
-                self.cross_venv.pip_install(
-                    self.log_file,
-                    ["build", "wheel"]
-                    + (
-                        pyproject["build-system"]["requires"]
-                        if "build-system" in pyproject
-                        else []
-                    ),
-                    paths=[Path.cwd() / "dist"],
-                    build=True,
-                )
-        else:
-            log(
-                self.log_file,
-                f"\n[{self.cross_venv}] Installing non-PEP517 build requirements",
+            return ["build", "wheel"] + (
+                pyproject["build-system"]["requires"]
+                if "build-system" in pyproject
+                else []
             )
-            # Ensure the cross environment has the most recent tools
-            self.cross_venv.pip_install(self.log_file, ["setuptools"], update=True)
-            self.cross_venv.pip_install(self.log_file, ["build", "wheel"])
 
-            # Ensure the build environment has the most recent tools
-            self.cross_venv.pip_install(
-                self.log_file, ["setuptools"], update=True, build=True
-            )
-            self.cross_venv.pip_install(self.log_file, ["build", "wheel"], build=True)
+        # Ensure both environments have the most recent tools
+        return self.updated_requirements(target)
+
+    def updated_requirements(self, target) -> list[str]:
+        # A package without a pyproject.toml is built with the most recent tools.
+        if (self.build_path / "pyproject.toml").is_file():
+            return []
+        return ["setuptools", "build", "wheel"]
 
     def _create_meson_cross(self, env: dict[str, str]):
         cpu_family = {
@@ -1411,21 +1727,23 @@ class PythonPackageBuilder(Builder):
             shutil.rmtree(tmp_dist)
         tmp_dist.mkdir(parents=True, exist_ok=True)
 
-        self.cross_venv.run(
-            self.log_file,
-            [
-                "python",
-                "-m",
-                "build",
-                "--no-isolation",
-                "--wheel",
-                "--outdir",
-                str(tmp_dist),
-            ]
-            + backend_args,
-            cwd=self.build_path,
-            env=env,
-        )
+        with phase("compile"):
+            self.cross_venv.run(
+                self.log_file,
+                [
+                    "python",
+                    "-m",
+                    "build",
+                    "--no-isolation",
+                    "--wheel",
+                    "--outdir",
+                    str(tmp_dist),
+                ]
+                + backend_args,
+                cwd=self.build_path,
+                pass_fds=jobserver.pass_fds(),
+                env=env,
+            )
         tmp_wheel = next(tmp_dist.glob("*.whl"))
 
         # unpack wheel to a temp directory
@@ -1451,7 +1769,8 @@ class PythonPackageBuilder(Builder):
         tmp_wheel_dir = next(tmp_wheel_dir.iterdir())
 
         # fix wheel
-        self.fix_wheel(tmp_wheel_dir)
+        with phase("fix wheel"):
+            self.fix_wheel(tmp_wheel_dir)
 
         # re-pack the wheel to "dist"
         log(self.log_file, f"\n[{self.cross_venv}] Packing wheel to dist")
@@ -1470,7 +1789,8 @@ class PythonPackageBuilder(Builder):
             pack_args.extend(
                 ["--build-number", str(self.package.meta["build"]["number"])]
             )
-        self.cross_venv.run(
-            self.log_file,
-            pack_args,
-        )
+        with phase("pack wheel"):
+            self.cross_venv.run(
+                self.log_file,
+                pack_args,
+            )
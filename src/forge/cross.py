@@ -1,15 +1,76 @@
 from __future__ import annotations
 
 import argparse
+import fcntl
+import hashlib
 import itertools
+import json
 import os
 import shutil
 import sys
 import sysconfig
+from importlib import metadata
 from os.path import abspath
 from pathlib import Path
 
-from forge import subprocess
+from forge import installers, pristine, subprocess
+
+# Bump this whenever the way cross environments are created changes, so that
+# stale templates aren't reused.
+TEMPLATE_VERSION = 1
+
+
+# The script run in an interpreter of a cross environment to describe it.
+PROBE_SCRIPT = """\
+import json, sys, sysconfig
+print(json.dumps({
+    "config_vars": sysconfig.get_config_vars(),
+    "paths": sysconfig.get_paths(),
+    "sys_path": sys.path,
+    "platform": sysconfig.get_platform(),
+    "version": sys.version.split(" ")[0],
+}, default=str))
+"""
+
+
+def probe_cache_path() -> Path:
+    """The folder holding the description of every cross environment."""
+    return Path.cwd() / "build" / "probes"
+
+
+def template_cache_path() -> Path:
+    """The folder holding the template of every cross environment."""
+    return Path.cwd() / "build" / "venv-templates"
+
+
+def relocate(path: Path, old: Path, new: Path):
+    """Update the paths in a copy of a virtual environment.
+
+    A virtual environment records its own location in its scripts, configuration
+    and activation files (and crossenv in its site customizations, and its
+    sysconfig data); every reference to the original location in a text file or
+    a symlink is replaced with the location of the copy.
+
+    :param path: The copy to update.
+    :param old: The location of the original environment.
+    :param new: The location of the copy.
+    """
+    old_bytes = os.fsencode(old)
+    new_bytes = os.fsencode(new)
+    for root, dirnames, filenames in os.walk(path):
+        for name in itertools.chain(dirnames, filenames):
+            file_path = Path(root) / name
+            if file_path.is_symlink():
+                target = os.readlink(file_path)
+                if target.startswith(str(old)):
+                    file_path.unlink()
+                    file_path.symlink_to(str(new) + target[len(str(old)) :])
+            elif name in filenames and not name.endswith(".pyc"):
+                content = file_path.read_bytes()
+                # Binary files (identified by a null byte) can't be edited in
+                # place; none of them need to be.
+                if old_bytes in content and b"\0" not in content:
+                    file_path.write_bytes(content.replace(old_bytes, new_bytes))
 
 
 class CrossVEnv:
@@ -103,8 +164,7 @@ class CrossVEnv:
             self.platform_triplet = f"{self.arch}-{self.PLATFORM_TRIPLET[sdk]}"
 
         # Prime the on-demand variable cache
-        self._sysconfig_data = None
-        self._scheme_paths = None
+        self._probe = None
         self._install_root = None
         self._sdk_root = None
         self.host_sysconfig = None
@@ -145,49 +205,67 @@ class CrossVEnv:
             raise RuntimeError("Cross environment hasn't been created.")
         return self.location / self.venv_name
 
+    def probe(self, interpreter="python", cache=True) -> dict:
+        """Describe an interpreter of the cross environment.
+
+        The description is produced by a single run of the interpreter. If
+        ``cache`` is set, the description of the cross environment's ``python`` is
+        also stored on disk, keyed by the host Python (and its sysconfig data), the
+        version of crossenv and the location of the environment, so it is only
+        produced once for every environment at that location.
+
+        :param interpreter: The interpreter to describe: ``python``,
+            ``cross-python`` or ``build-python``.
+        :param cache: Can the description be retrieved from (and stored in) the
+            cache?
+        :returns: A dictionary containing the ``config_vars`` and install scheme
+            ``paths`` reported by ``sysconfig``; the ``sys_path``; the
+            ``platform``; and the Python ``version`` of the interpreter.
+        """
+        cache = cache and interpreter == "python"
+        if cache and self._probe is not None:
+            return self._probe
+
+        if cache:
+            if self.host_sysconfig is None:
+                self.host_sysconfig = self.find_host_sysconfig()
+            key = hashlib.sha256(
+                f"{self.template_key()} {self.venv_path}".encode()
+            ).hexdigest()
+            probe_path = probe_cache_path() / f"{key}.json"
+            try:
+                self._probe = json.loads(probe_path.read_text(encoding="utf-8"))
+                return self._probe
+            except (OSError, ValueError):
+                pass
+
+        output = self.check_output(
+            [interpreter, "-c", PROBE_SCRIPT],
+            encoding="UTF-8",
+        )
+        try:
+            description = json.loads(output)
+        except ValueError:
+            raise RuntimeError(f"Unable to describe {interpreter} in {self}: {output}")
+
+        if cache:
+            probe_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = probe_path.with_name(f"{probe_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(description), encoding="utf-8")
+            os.replace(tmp_path, probe_path)
+            self._probe = description
+
+        return description
+
     @property
     def sysconfig_data(self) -> dict[str, str]:
         """The sysconfig data for the cross environment."""
-        if self._sysconfig_data is None:
-            # Run a script in the cross-venv that outputs the config variables
-            config_var_repr = self.check_output(
-                [
-                    "python",
-                    "-c",
-                    "import sysconfig; print(sysconfig.get_config_vars())",
-                ],
-                encoding="UTF-8",
-            )
-
-            # Parse the output of the previous command as Python,
-            # turning it back into a dict.
-            config = {}
-            exec(f"data = {config_var_repr}", config, config)
-            self._sysconfig_data = config["data"]
-
-        return self._sysconfig_data
+        return self.probe()["config_vars"]
 
     @property
     def scheme_paths(self) -> dict[str, str]:
         """The install scheme paths for the cross environment."""
-        if self._scheme_paths is None:
-            # Run a script in the cross-venv that outputs the config variables
-            config_var_repr = self.check_output(
-                [
-                    "python",
-                    "-c",
-                    "import sysconfig; print(sysconfig.get_paths())",
-                ],
-                encoding="UTF-8",
-            )
-
-            # Parse the output of the previous command as Python,
-            # turning it back into a dict.
-            config = {}
-            exec(f"data = {config_var_repr}", config, config)
-            self._scheme_paths = config["data"]
-
-        return self._scheme_paths
+        return self.probe()["paths"]
 
     @property
     def install_root(self) -> Path:
@@ -197,16 +275,9 @@ class CrossVEnv:
         that native libraries can be installed as wheels.
         """
         if self._install_root is None:
-            # Run a script to get the last element of the cross-venv's sys.path.
-            # This should be the site-packages folder of the cross environment.
-            cross_site_packages = self.check_output(
-                [
-                    "python",
-                    "-c",
-                    "import sys; print(sys.path[-1])",
-                ],
-                encoding="UTF-8",
-            ).strip()
+            # The last element of the cross-venv's sys.path should be the
+            # site-packages folder of the cross environment.
+            cross_site_packages = self.probe()["sys_path"][-1]
             self._install_root = Path(cross_site_packages) / "opt"
             if self.venv_path not in self._install_root.parents:
                 raise RuntimeError(
@@ -267,24 +338,14 @@ class CrossVEnv:
             return f"{sdk}-{version}-{arch}"
         return self._platform_identifier(sdk, version, arch)
 
-    def create(
-        self,
-        location=None,
-        clean=False,
-    ):
-        """Create a new cross compilation virtual environment.
+    def find_host_sysconfig(self) -> Path:
+        """Find the sysconfigdata file of the host Python.
 
-        :param location: The location in which to create the cross env. Defaults to the
-            current working directory.
-        :param clean: Should a pre-existing environment matching the same descriptor
-            be removed and recreated?
-        :raises: ``RuntimeError`` if an environment matching the requested host already
-            exists, and ``clean=False``.
-        """
-        host_python = self.host_python_home / f"bin/python3.{sys.version_info.minor}"
-        if not host_python.is_file():
-            raise RuntimeError(f"Can't find host python {host_python}")
+        Also sets ``sysconfigdata_name`` to the module name of the file.
 
+        :returns: The path of the host's ``_sysconfigdata_*.py`` file.
+        :raises: ``RuntimeError`` if the file can't be found.
+        """
         if self.host_os == "iOS":
             self.sysconfigdata_name = (
                 f"_sysconfigdata__{self.host_os.lower()}_{self.arch}-{self.sdk}"
@@ -318,19 +379,36 @@ class CrossVEnv:
             )
             self.sysconfigdata_name = host_sysconfig.stem
 
-        self.host_sysconfig = host_sysconfig
+        return host_sysconfig
 
-        if self.host_os != "iOS" and not host_sysconfig.is_file():
-            raise RuntimeError(f"Can't find host sysconfig {host_sysconfig}")
-
-        self.location = Path(location).resolve() if location else Path.cwd()
-        if self.exists():
-            if clean:
-                print(f"Removing old {self} environment...")
-                shutil.rmtree(self.venv_path)
-            else:
-                raise RuntimeError(f"Environment {self} already exists.")
+    def template_key(self) -> str:
+        """The key identifying the template of the cross environment.
 
+        The key covers the build Python, the version of crossenv, and the host
+        Python in the support tree; a template is only reused if none of them has
+        changed.
+        """
+        host_python = self.host_python_home / f"bin/python3.{sys.version_info.minor}"
+        digest = hashlib.sha256(
+            f"{TEMPLATE_VERSION} {sys.version} {sys.executable} "
+            f"{self.venv_name} {self.platform_identifier}".encode()
+        )
+        try:
+            crossenv = metadata.distribution("crossenv")
+            digest.update(crossenv.version.encode())
+            # A crossenv installed from Git is identified by its commit.
+            digest.update((crossenv.read_text("direct_url.json") or "").encode())
+        except metadata.PackageNotFoundError:
+            pass
+
+        stat = host_python.stat()
+        digest.update(f"{host_python} {stat.st_size} {stat.st_mtime_ns}".encode())
+        digest.update(self.host_sysconfig.read_bytes())
+        # The key is kept short, as it is part of the shebang of every script.
+        return digest.hexdigest()[:16]
+
+    def _crossenv(self, host_python: Path):
+        # Run crossenv to create the environment at self.venv_path.
         print(f"Creating {self}...")
         try:
             subprocess.run(
@@ -340,7 +418,7 @@ class CrossVEnv:
                     "-m",
                     "crossenv",
                     "--sysconfigdata-file",
-                    str(host_sysconfig),
+                    str(self.host_sysconfig),
                     str(host_python),
                     self.venv_path,
                 ],
@@ -352,70 +430,105 @@ class CrossVEnv:
         print("Verifying cross-platform environment...")
         self.verify()
         print("done.")
-        print()
-        print(f"Cross platform-environment {self} created.")
 
-    def verify(self):
-        # python returns the cross-platform host tag.
-        output = self.check_output(
-            ["python", "-c", "import sysconfig; print(sysconfig.get_platform())"],
-            encoding="UTF-8",
-        ).strip()
-        if output != self.platform_identifier:
-            raise RuntimeError(
-                f"Cross platform python should be {self.platform_identifier}; got {output}"
-            )
+    def _create_template(self, host_python: Path) -> Path:
+        """Create (and verify) the template of the cross environment, if needed.
 
-        # python is the same version as the local python
-        local_python_version = sys.version.split(" ")[0]
-        python_version = self.check_output(
-            ["python", "-c", "import sys; print(sys.version.split(' ')[0])"],
-            encoding="UTF-8",
-        ).strip()
-        if python_version != local_python_version:
-            raise RuntimeError(
-                f"Cross platform python should be {local_python_version!r}; got {python_version!r}"
-            )
+        :param host_python: The host Python binary.
+        :returns: The location of the template environment.
+        """
+        location = template_cache_path() / self.template_key()
+        template = CrossVEnv(self.sdk, self.sdk_version, self.arch)
+        template.host_sysconfig = self.host_sysconfig
+        template.location = location
+        # The template is marked as complete once it has been verified.
+        marker = location / "complete"
+        if not marker.is_file():
+            location.parent.mkdir(parents=True, exist_ok=True)
+            with open(f"{location}.lock", "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # Another process may have created the template while we waited.
+                if not marker.is_file():
+                    shutil.rmtree(location, ignore_errors=True)
+                    location.mkdir()
+                    template._crossenv(host_python)
+                    marker.touch()
+
+        return template.venv_path
 
-        # build-python returns the build environment tag.
-        output = self.check_output(
-            ["build-python", "-c", "import sysconfig; print(sysconfig.get_platform())"],
-            encoding="UTF-8",
-        ).strip()
-        if output != sysconfig.get_platform():
-            raise RuntimeError(
-                f"Cross platform build-python should be {sysconfig.get_platform()}; got {output}"
-            )
+    def create(
+        self,
+        location=None,
+        clean=False,
+    ):
+        """Create a new cross compilation virtual environment.
 
-        # build-python is the same version as the local python
-        build_python_version = self.check_output(
-            ["build-python", "-c", "import sys; print(sys.version.split(' ')[0])"],
-            encoding="UTF-8",
-        ).strip()
-        if build_python_version != local_python_version:
-            raise RuntimeError(
-                f"Cross platform build-python should be {local_python_version}; got {build_python_version}"
-            )
+        Running crossenv (and verifying the environment it creates) is only done
+        once for each host; the result is kept as a template, and every other
+        environment for the same host is a copy of the template. Set
+        ``MOBILE_FORGE_VENV_TEMPLATES_OFF`` to run crossenv every time.
 
-        # cross-python returns the cross-platform host tag.
-        output = self.check_output(
-            ["cross-python", "-c", "import sysconfig; print(sysconfig.get_platform())"],
-            encoding="UTF-8",
-        ).strip()
-        if output != self.platform_identifier:
-            raise RuntimeError(
-                f"Cross platform cross-python should be {self.platform_identifier}; got {output}"
-            )
+        :param location: The location in which to create the cross env. Defaults to the
+            current working directory.
+        :param clean: Should a pre-existing environment matching the same descriptor
+            be removed and recreated?
+        :raises: ``RuntimeError`` if an environment matching the requested host already
+            exists, and ``clean=False``.
+        """
+        host_python = self.host_python_home / f"bin/python3.{sys.version_info.minor}"
+        if not host_python.is_file():
+            raise RuntimeError(f"Can't find host python {host_python}")
 
-        # cross-python is the same version as the local python
-        cross_python_version = self.check_output(
-            ["cross-python", "-c", "import sys; print(sys.version.split(' ')[0])"],
-            encoding="UTF-8",
-        ).strip()
-        if cross_python_version != local_python_version:
-            raise RuntimeError(
-                f"Cross platform python should be {local_python_version}; got {cross_python_version}"
-            )
+        host_sysconfig = self.find_host_sysconfig()
+        self.host_sysconfig = host_sysconfig
+
+        if self.host_os != "iOS" and not host_sysconfig.is_file():
+            raise RuntimeError(f"Can't find host sysconfig {host_sysconfig}")
+
+        self.location = Path(location).resolve() if location else Path.cwd()
+        # Anything known about an environment at a previous location is stale.
+        self._probe = None
+        self._install_root = None
+        if self.exists():
+            if clean:
+                print(f"Removing old {self} environment...")
+                shutil.rmtree(self.venv_path)
+            else:
+                raise RuntimeError(f"Environment {self} already exists.")
+
+        if os.getenv("MOBILE_FORGE_VENV_TEMPLATES_OFF"):
+            self._crossenv(host_python)
+        else:
+            template_path = self._create_template(host_python)
+            print(f"Copying {self} from template...")
+            pristine.copy_tree(None, template_path, self.venv_path)
+            relocate(self.venv_path, template_path, self.venv_path)
+
+        print()
+        print(f"Cross platform-environment {self} created.")
+
+    def verify(self):
+        local_python_version = sys.version.split(" ")[0]
+        for interpreter, platform in [
+            # python and cross-python return the cross-platform host tag.
+            ("python", self.platform_identifier),
+            ("cross-python", self.platform_identifier),
+            # build-python returns the build environment tag.
+            ("build-python", sysconfig.get_platform()),
+        ]:
+            description = self.probe(interpreter, cache=False)
+            if description["platform"] != platform:
+                raise RuntimeError(
+                    f"Cross platform {interpreter} should be {platform}; "
+                    f"got {description['platform']}"
+                )
+
+            # Every interpreter is the same version as the local python
+            if description["version"] != local_python_version:
+                raise RuntimeError(
+                    f"Cross platform {interpreter} should be "
+                    f"{local_python_version!r}; got {description['version']!r}"
+                )
 
     def cross_kwargs(self, kwargs):
         venv_kwargs = kwargs.copy()
@@ -491,42 +604,22 @@ class CrossVEnv:
     ):
         """Install packages into the cross environment.
 
+        Packages are installed with pip, unless ``MOBILE_FORGE_INSTALLER`` selects
+        another installer (see :mod:`forge.installers`).
+
         :param packages: The list of package names/specifiers to install.
         :param update: Should the package be updated ("-U")
         :param build: Should the package be installed in the build environment? Defaults
             to installing in the host environment.
         :param paths: The paths to search for additional wheels ("--find-links").
         """
-        # build-pip is a script; pip is a shim with a hashbang that points
-        # at a python interpreter, which we can't invoke with subprocess.
-        self.run(
+        installers.installer().install(
+            self,
             logfile,
-            (["build-pip"] if build else ["python", "-m", "pip"])
-            + [
-                "install",
-                "--disable-pip-version-check",
-            ]
-            # If we're doing a host build, require binary packages.
-            # build environment can use non-binary packages.
-            + (
-                []
-                if build
-                else [
-                    "--only-binary",
-                    ":all:",
-                ]
-            )
-            # Update packages if requested
-            + (["-U"] if update else [])
-            # Include the local wheels paths if provided.
-            + (
-                list(itertools.chain(*(["--find-links", str(path)] for path in paths)))
-                if paths
-                else []
-            )
-            + (["--extra-index-url", "https://pypi.flet.dev"])
-            # Finally, the list of packages to install.
-            + packages,
+            packages,
+            update=update,
+            build=build,
+            paths=[Path(path) for path in paths] if paths else [],
         )
 
 
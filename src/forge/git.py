@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import posixpath
+import re
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from forge import mirror, subprocess
+from forge.logger import log
+
+# The number of seconds that the commit a branch or tag resolved to is used
+# without fetching the branch or tag again.
+DEFAULT_REV_TTL = 3600
+
+_COMMIT = re.compile(r"^[0-9a-f]{40}$")
+
+
+def cache_path() -> Path:
+    """The folder holding the cached (bare) clone of every Git source."""
+    return Path.cwd() / "downloads" / "git"
+
+
+def repo_path(url: str) -> Path:
+    """The location of the cached clone of a repository.
+
+    :param url: The URL of the repository.
+    """
+    name = posixpath.basename(urlsplit(url).path.rstrip("/"))
+    name = name[:-4] if name.endswith(".git") else name
+    return cache_path() / f"{name}-{hashlib.sha256(url.encode()).hexdigest()[:16]}.git"
+
+
+@contextmanager
+def _locked(repo: Path):
+    # Builds of other architectures (possibly in other processes) may be using the
+    # same clone.
+    repo.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{repo}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _has_commit(repo: Path, commit: str) -> bool:
+    try:
+        subprocess.check_output(
+            [
+                "git",
+                "-C",
+                str(repo),
+                "rev-parse",
+                "--quiet",
+                "--verify",
+                f"{commit}^{{commit}}",
+            ]
+        )
+    except subprocess.CalledProcessError:
+        return False
+    return True
+
+
+def resolve(logfile, url: str, rev: str) -> str:
+    """Fetch a revision of a repository into its cached clone.
+
+    Only the requested revision is fetched, without any history. A commit that is
+    already in the cache is never fetched again; a branch or tag is only fetched
+    again once the commit it resolved to is older than
+    ``MOBILE_FORGE_GIT_REV_TTL`` seconds (an hour, by default), or never if
+    ``MOBILE_FORGE_OFFLINE`` is set.
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param url: The URL of the repository.
+    :param rev: The branch, tag or commit SHA to fetch.
+    :returns: The SHA of the commit.
+    """
+    rev = str(rev)
+    repo = repo_path(url)
+    with _locked(repo):
+        if not (repo / "HEAD").is_file():
+            subprocess.run(logfile, ["git", "init", "--quiet", "--bare", str(repo)])
+
+        if _COMMIT.match(rev.lower()) and _has_commit(repo, rev):
+            return rev.lower()
+
+        revs_path = repo / "forge-revs.json"
+        try:
+            revs = json.loads(revs_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            revs = {}
+
+        ttl = int(os.getenv("MOBILE_FORGE_GIT_REV_TTL", DEFAULT_REV_TTL))
+        recorded = revs.get(rev)
+        if (
+            recorded
+            and (
+                os.getenv("MOBILE_FORGE_OFFLINE")
+                or time.time() - recorded["fetched"] < ttl
+            )
+            and _has_commit(repo, recorded["commit"])
+        ):
+            return recorded["commit"]
+
+        log(logfile, f"Fetching {rev} from {url}...")
+        subprocess.run(
+            logfile,
+            [
+                "git",
+                "-C",
+                str(repo),
+                "fetch",
+                "--quiet",
+                "--depth",
+                "1",
+                "--no-tags",
+                mirror.rewrite(url),
+                rev,
+            ],
+        )
+        commit = subprocess.check_output(
+            ["git", "-C", str(repo), "rev-parse", "FETCH_HEAD^{commit}"],
+            text=True,
+        ).strip()
+        # Keep the commit from being garbage collected.
+        subprocess.run(
+            logfile,
+            ["git", "-C", str(repo), "update-ref", f"refs/forge/{commit}", commit],
+        )
+
+        revs[rev] = {"commit": commit, "fetched": time.time()}
+        tmp_path = revs_path.with_name(f"{revs_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(revs), encoding="utf-8")
+        os.replace(tmp_path, revs_path)
+
+    return commit
+
+
+def _submodule_url(url: str, submodule_url: str) -> str:
+    # Relative submodule URLs are relative to the URL of the superproject.
+    if not submodule_url.startswith(("./", "../")):
+        return submodule_url
+    if "://" in url:
+        return urljoin(f"{url.rstrip('/')}/", submodule_url)
+    return posixpath.normpath(posixpath.join(url, submodule_url))
+
+
+def _submodules(path: Path) -> list[tuple[str, str]]:
+    """The submodules of a checkout.
+
+    :param path: The checkout.
+    :returns: A list of the path and URL of each submodule.
+    """
+    try:
+        output = subprocess.check_output(
+            [
+                "git",
+                "-C",
+                str(path),
+                "config",
+                "--file",
+                ".gitmodules",
+                "--get-regexp",
+                r"^submodule\..*\.(path|url)$",
+            ],
+            text=True,
+        )
+    except subprocess.CalledProcessError:
+        return []
+
+    submodules = {}
+    for line in output.splitlines():
+        key, _, value = line.partition(" ")
+        name, _, attribute = key[len("submodule.") :].rpartition(".")
+        submodules.setdefault(name, {})[attribute] = value
+
+    return [
+        (submodule["path"], submodule["url"])
+        for submodule in submodules.values()
+        if "path" in submodule and "url" in submodule
+    ]
+
+
+def checkout(logfile, url: str, rev: str, path: Path) -> str:
+    """Check out a revision of a repository.
+
+    The checkout is a worktree of the cached clone of the repository, so it costs
+    no more than writing out the files. Each submodule is checked out in the same
+    way, from its own cached clone.
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param url: The URL of the repository.
+    :param rev: The branch, tag or commit SHA to check out.
+    :param path: The folder to check out into. It must not exist, or be empty.
+    :returns: The SHA of the commit that was checked out.
+    """
+    commit = resolve(logfile, url, rev)
+    repo = repo_path(url)
+    with _locked(repo):
+        # Forget the worktrees of builds that have since been cleaned up.
+        subprocess.run(logfile, ["git", "-C", str(repo), "worktree", "prune"])
+        subprocess.run(
+            logfile,
+            [
+                "git",
+                "-C",
+                str(repo),
+                "worktree",
+                "add",
+                "--quiet",
+                "--detach",
+                "--force",
+                str(path.resolve()),
+                commit,
+            ],
+        )
+
+    if (path / ".gitmodules").is_file():
+        for submodule_path, submodule_url in _submodules(path):
+            # The commit of a submodule is recorded in the tree of the superproject.
+            entry = subprocess.check_output(
+                ["git", "-C", str(path), "ls-tree", "HEAD", submodule_path],
+                text=True,
+            ).split()
+            if len(entry) < 3 or entry[1] != "commit":
+                continue
+            checkout(
+                logfile,
+                _submodule_url(url, submodule_url),
+                entry[2],
+                path / submodule_path,
+            )
+
+    return commit
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+from pathlib import Path
+
+from packaging.utils import canonicalize_name
+
+from forge.cross import CrossVEnv
+from forge.package import Package
+from forge.schedule import requirement_names
+
+# Bump this whenever the content of an index entry changes, so that stale
+# indexes are discarded.
+INDEX_VERSION = 1
+
+# The subsets of recipes that can be selected from the index.
+SUBSETS = (
+    "non-py",
+    "py-all-platforms",
+    "py",
+    "smoke",
+    "smoke-non-py",
+    "smoke-py",
+    "non-smoke",
+    "all",
+)
+
+
+def index_path() -> Path:
+    """The location of the on-disk recipe index."""
+    return Path.cwd() / "build" / "recipe-index.json"
+
+
+def _recipe_mtime(recipe_path: Path) -> int:
+    # Adding or removing a file (e.g., build.sh) changes the mtime of the recipe
+    # directory; editing the recipe changes the mtime of meta.yaml.
+    return max(
+        recipe_path.stat().st_mtime_ns,
+        (recipe_path / "meta.yaml").stat().st_mtime_ns,
+    )
+
+
+def _index_recipe(recipe_path: Path, host_os: str) -> dict:
+    """Render a recipe for a representative platform of a host OS, and extract the
+    details needed to select it.
+
+    :param recipe_path: The recipe directory.
+    :param host_os: The host OS to render the recipe for (e.g., ``iOS``).
+    :returns: The index entry for the recipe on the host OS.
+    """
+    sdk, arch = CrossVEnv.HOST_SDKS[host_os][0]
+    package = Package(
+        str(recipe_path),
+        version=None,
+        build_number=None,
+        sdk=sdk,
+        sdk_version=CrossVEnv.BASE_VERSION[host_os],
+        arch=arch,
+    )
+    meta = package.meta["package"]
+    return {
+        "name": canonicalize_name(package.name),
+        "platforms": meta.get("platforms"),
+        "excluded_arches": meta.get("excluded_arches", []),
+        "smoke": meta.get("smoke", False),
+        "dependencies": sorted(requirement_names(package)),
+    }
+
+
+def load_index(host_os: str, recipes_path: Path | None = None) -> dict[str, dict]:
+    """Load the index of every recipe, as rendered for a host OS.
+
+    The index is cached in the build folder. A recipe is only rendered again if its
+    ``meta.yaml`` (or the content of its directory) has been modified since it was
+    indexed; the whole index is discarded if the schema or Python version changes.
+
+    :param host_os: The host OS to index the recipes for (e.g., ``iOS``).
+    :param recipes_path: The folder containing the recipes. Defaults to
+        ``./recipes``.
+    :returns: A dictionary, keyed by recipe directory name, of index entries. Each
+        entry describes the builder (``simple`` or ``python``), ``platforms``,
+        ``excluded_arches``, ``smoke`` flag, and the canonical names of the host
+        requirement ``dependencies`` of the recipe; or, if the recipe can't be
+        rendered, an ``error``.
+    """
+    recipes_path = recipes_path or Path.cwd() / "recipes"
+    schema_path = Path(__file__).parent / "schema" / "meta-schema.yaml"
+    key = {
+        "version": INDEX_VERSION,
+        "python": f"{sys.version_info.major}.{sys.version_info.minor}",
+        "schema": schema_path.stat().st_mtime_ns,
+    }
+
+    path = index_path()
+    try:
+        cached = json.loads(path.read_text(encoding="utf-8"))
+        cached_recipes = cached["recipes"] if cached["key"] == key else {}
+    except (OSError, ValueError, KeyError):
+        cached_recipes = {}
+
+    recipes = {}
+    changed = False
+    for meta_path in sorted(recipes_path.glob("*/meta.yaml")):
+        recipe_path = meta_path.parent
+        mtime = _recipe_mtime(recipe_path)
+        entry = cached_recipes.get(recipe_path.name)
+        if entry is None or entry["mtime"] != mtime:
+            entry = {
+                "mtime": mtime,
+                "builder": (
+                    "simple" if (recipe_path / "build.sh").exists() else "python"
+                ),
+                "hosts": {},
+            }
+            changed = True
+        if host_os not in entry["hosts"]:
+            try:
+                entry["hosts"][host_os] = _index_recipe(recipe_path, host_os)
+            except Exception as e:
+                entry["hosts"][host_os] = {"error": str(e)}
+            changed = True
+        recipes[recipe_path.name] = entry
+
+    if changed or recipes.keys() != cached_recipes.keys():
+        # Write to a temporary file, so a concurrent forge never reads a partial
+        # index.
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(
+            json.dumps({"key": key, "recipes": recipes}, indent=1), encoding="utf-8"
+        )
+        os.replace(tmp_path, path)
+
+    return {
+        name: {"builder": entry["builder"], **entry["hosts"][host_os]}
+        for name, entry in recipes.items()
+    }
+
+
+def select_recipes(index: dict[str, dict], subset: str, host_os: str) -> list[str]:
+    """Select a subset of the recipes in an index.
+
+    Only recipes that support the host OS are selected. The ``smoke`` subsets
+    include the recipes flagged as ``package.smoke``, plus every recipe they
+    (transitively) require as a host requirement.
+
+    :param index: The recipe index, as returned by :func:`load_index`.
+    :param subset: The name of the subset; one of :data:`SUBSETS`.
+    :param host_os: The host OS being built (e.g., ``iOS``).
+    :returns: The sorted names of the selected recipes.
+    """
+    supported = {}
+    for name, info in index.items():
+        if "error" in info:
+            print(f"Skipping {name}: can't read recipe ({info['error']})")
+        elif info["platforms"] is None or host_os.lower() in info["platforms"]:
+            supported[name] = info
+
+    # The smoke packages, and everything they need to be built.
+    recipe_names = {info["name"]: name for name, info in supported.items()}
+    smoke = set()
+    pending = [name for name, info in supported.items() if info["smoke"]]
+    while pending:
+        name = pending.pop()
+        if name not in smoke:
+            smoke.add(name)
+            pending.extend(
+                recipe_names[dependency]
+                for dependency in supported[name]["dependencies"]
+                if dependency in recipe_names
+            )
+
+    def selected(name, info):
+        python = info["builder"] == "python"
+        return {
+            "non-py": not python,
+            # Every Python wheel is built for a specific platform; this only
+            # records that the recipe doesn't restrict its platforms.
+            "py-all-platforms": python and info["platforms"] is None,
+            "py": python,
+            "smoke": name in smoke,
+            "smoke-non-py": name in smoke and not python,
+            "smoke-py": name in smoke and python,
+            "non-smoke": name not in smoke,
+            "all": True,
+        }[subset]
+
+    return sorted(name for name, info in supported.items() if selected(name, info))
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import itertools
+import os
+import shutil
+import sys
+import sysconfig
+from abc import ABC, abstractmethod
+
+from packaging.requirements import InvalidRequirement, Requirement
+
+from forge import mirror, subprocess, wheelhouse
+from forge.logger import log
+
+
+class Installer(ABC):
+    """A tool that installs packages into a cross environment."""
+
+    @abstractmethod
+    def install(self, cross_venv, logfile, packages, update, build, paths):
+        """Install packages into a cross environment.
+
+        :param cross_venv: The cross environment to install into.
+        :param logfile: An open file handle to which all output will be logged.
+        :param packages: The list of package names/specifiers to install.
+        :param update: Should the packages be updated ("-U")?
+        :param build: Should the packages be installed in the build environment,
+            rather than the host environment?
+        :param paths: The folders to search for additional wheels.
+        """
+        ...
+
+
+class PipInstaller(Installer):
+    """Install packages with pip, using the wheelhouse.
+
+    Every wheel that is installed is kept in a wheelhouse, and the resolution of
+    each set of packages is recorded; when it is installed again, it is installed
+    from the wheelhouse, without consulting a package index (see
+    ``MOBILE_FORGE_WHEELHOUSE_TTL``). The packages are resolved again if an update is
+    requested, or the local wheels they could be installed from change. Set ``MOBILE_FORGE_WHEELHOUSE_OFF`` to always
+    install from the package indexes.
+    """
+
+    def pip(self, cross_venv, logfile, command, args, build=False):
+        # build-pip is a script; pip is a shim with a hashbang that points
+        # at a python interpreter, which we can't invoke with subprocess.
+        cross_venv.run(
+            logfile,
+            (["build-pip"] if build else ["python", "-m", "pip"])
+            + [command, "--disable-pip-version-check"]
+            # If we're doing a host build, require binary packages.
+            # build environment can use non-binary packages.
+            + ([] if build else ["--only-binary", ":all:"]) + args,
+        )
+
+    def install(self, cross_venv, logfile, packages, update, build, paths):
+        # Include the local wheels paths if provided.
+        find_links = list(
+            itertools.chain(*(["--find-links", str(path)] for path in paths))
+        )
+        # Update packages if requested
+        update_args = ["-U"] if update else []
+
+        if os.getenv("MOBILE_FORGE_WHEELHOUSE_OFF"):
+            self.pip(
+                cross_venv,
+                logfile,
+                "install",
+                update_args + find_links
+                # The package indexes (or their mirrors).
+                + mirror.pip_index_args()
+                # Finally, the list of packages to install.
+                + packages,
+                build=build,
+            )
+            return
+
+        local_args = [
+            "--no-index",
+            "--find-links",
+            str(wheelhouse.cache_path()),
+        ] + find_links
+        key = wheelhouse.pins_key(
+            packages,
+            update,
+            paths,
+            wheelhouse.local_wheels(paths),
+            mirror.pip_index_args(),
+            sys.version,
+            sysconfig.get_platform() if build else cross_venv.tag,
+        )
+        # An update asks the package indexes for newer versions, so a recorded
+        # resolution isn't used.
+        pins = None if update else wheelhouse.load_pins(key)
+        if pins is not None and wheelhouse.available(pins, paths):
+            try:
+                self.pip(
+                    cross_venv,
+                    logfile,
+                    "install",
+                    update_args + local_args + packages + pins,
+                    build=build,
+                )
+                log(logfile, f"Resolved: {' '.join(pins)}")
+                return
+            except subprocess.CalledProcessError:
+                log(logfile, "Unable to install from the wheelhouse; resolving again.")
+
+        # Fetch (or build) a wheel of every package that will be installed, and
+        # keep them in the wheelhouse.
+        wheel_path = wheelhouse.cache_path() / f"download.{os.getpid()}.tmp"
+        shutil.rmtree(wheel_path, ignore_errors=True)
+        try:
+            self.pip(
+                cross_venv,
+                logfile,
+                "wheel",
+                ["--wheel-dir", str(wheel_path)]
+                + find_links
+                + mirror.pip_index_args()
+                + packages,
+                build=build,
+            )
+            wheelhouse.add(wheel_path, paths)
+        finally:
+            shutil.rmtree(wheel_path, ignore_errors=True)
+
+        report_path = wheelhouse.cache_path() / f"report.{os.getpid()}.json"
+        try:
+            self.pip(
+                cross_venv,
+                logfile,
+                "install",
+                update_args + local_args + ["--report", str(report_path)] + packages,
+                build=build,
+            )
+            pins = wheelhouse.save_pins(key, report_path)
+            if pins is not None:
+                log(logfile, f"Resolved: {' '.join(pins)}")
+        finally:
+            report_path.unlink(missing_ok=True)
+
+
+class UvInstaller(Installer):
+    """Install packages with ``uv pip install``.
+
+    uv keeps every package it installs in its own (global) cache, and hardlinks
+    the installed files into each environment, so the wheelhouse isn't used.
+    """
+
+    def uv(self) -> str:
+        """The location of the uv binary.
+
+        :raises: ``RuntimeError`` if uv isn't installed.
+        """
+        try:
+            from uv import find_uv_bin
+
+            return find_uv_bin()
+        except (ImportError, FileNotFoundError):
+            pass
+
+        uv = shutil.which("uv")
+        if uv is None:
+            raise RuntimeError(
+                "uv isn't installed. Install it, or set MOBILE_FORGE_INSTALLER=pip."
+            )
+        return uv
+
+    def install(self, cross_venv, logfile, packages, update, build, paths):
+        python = (
+            cross_venv.venv_path
+            / ("build" if build else "cross")
+            / "bin"
+            / f"python3.{sys.version_info.minor}"
+        )
+
+        # pip's -U only updates the named packages (and whatever they need
+        # updated to be satisfied).
+        update_args = []
+        if update:
+            for package in packages:
+                try:
+                    name = Requirement(package).name
+                except InvalidRequirement:
+                    update_args = ["--upgrade"]
+                    break
+                update_args += ["--upgrade-package", name]
+
+        cross_venv.run(
+            logfile,
+            [
+                self.uv(),
+                "pip",
+                "install",
+                "--python",
+                str(python),
+                "--link-mode",
+                "hardlink",
+                # Like pip, choose the best version from any index, rather than
+                # only considering the first index that has the package.
+                "--index-strategy",
+                "unsafe-best-match",
+            ]
+            # If we're doing a host build, require binary packages.
+            # build environment can use non-binary packages.
+            + ([] if build else ["--only-binary", ":all:"])
+            + update_args
+            + list(itertools.chain(*(["--find-links", str(path)] for path in paths)))
+            # The package indexes (or their mirrors).
+            + mirror.pip_index_args()
+            + (["--offline"] if os.getenv("MOBILE_FORGE_OFFLINE") else [])
+            + packages,
+        )
+
+
+INSTALLERS = {
+    "pip": PipInstaller,
+    "uv": UvInstaller,
+}
+
+
+def installer() -> Installer:
+    """The installer selected by ``MOBILE_FORGE_INSTALLER`` (pip, by default).
+
+    :raises: ``RuntimeError`` if the installer isn't known.
+    """
+    name = os.getenv("MOBILE_FORGE_INSTALLER") or "pip"
+    try:
+        return INSTALLERS[name]()
+    except KeyError:
+        raise RuntimeError(
+            f"Unknown installer {name!r}; choose one of {', '.join(INSTALLERS)}."
+        )
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+# The environment variables used to hand the jobserver to builds, including builds
+# running in worker processes.
+JOBSERVER_ENV = "MOBILE_FORGE_JOBSERVER"
+CPU_COUNT_ENV = "MOBILE_FORGE_CPU_COUNT"
+
+
+class JobServer:
+    """A GNU make jobserver shared by every build that forge runs.
+
+    The jobserver is a FIFO holding one byte for each job slot that is available. A
+    client takes a token from the FIFO before starting a job, and returns it when
+    the job is complete. Every client also has one implicit slot of its own, so the
+    FIFO is seeded with ``limit - builds`` tokens to keep the total close to
+    ``limit`` when ``builds`` top-level builds are running.
+
+    GNU make 4.4+, ninja 1.13+ (and so meson) and cargo can open the FIFO by path.
+    Older versions of make only accept file descriptors; for those, each build
+    process opens the FIFO itself and passes the descriptor to its compile step.
+
+    Recipes that pass an explicit ``-j`` to make opt out of the jobserver; for those,
+    ``CPU_COUNT`` is reduced to an equal share of the limit.
+    """
+
+    def __init__(self, limit: int, builds: int = 1):
+        """
+        :param limit: The total number of compile jobs to allow across all builds.
+        :param builds: The number of builds that will run at the same time.
+        """
+        self.limit = limit
+        self.builds = builds
+        self.directory = Path(tempfile.mkdtemp(prefix="forge-jobserver-"))
+        self.path = self.directory / "fifo"
+        os.mkfifo(self.path)
+
+        # Hold the FIFO open for the lifetime of the jobserver, so that tokens are
+        # retained while no client has it open.
+        self.fd = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self.fd, b"+" * max(limit - builds, 0))
+
+    def start(self):
+        """Make the jobserver available to every build started by this process,
+        and by any worker process it creates."""
+        os.environ[JOBSERVER_ENV] = str(self.path)
+        os.environ[CPU_COUNT_ENV] = str(max(self.limit // self.builds, 1))
+
+    def stop(self):
+        """Withdraw the jobserver, and remove its FIFO."""
+        os.environ.pop(JOBSERVER_ENV, None)
+        os.environ.pop(CPU_COUNT_ENV, None)
+        os.close(self.fd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def cpu_count() -> int:
+    """The number of parallel jobs a single build should request.
+
+    :returns: The build's share of the jobserver limit if a jobserver is active;
+        otherwise, the number of CPUs on the machine.
+    """
+    try:
+        return int(os.environ[CPU_COUNT_ENV])
+    except (KeyError, ValueError):
+        return multiprocessing.cpu_count()
+
+
+@lru_cache(maxsize=None)
+def make_version() -> tuple[int, ...]:
+    """The version of the GNU make on the path.
+
+    :returns: The version as a tuple of integers; ``(0,)`` if make isn't available
+        or its version can't be determined.
+    """
+    try:
+        output = subprocess.check_output(["make", "--version"], encoding="UTF-8")
+        match = re.match(r"GNU Make (\d+)\.(\d+)", output)
+        return (int(match[1]), int(match[2]))
+    except (OSError, subprocess.CalledProcessError, TypeError):
+        return (0,)
+
+
+@lru_cache(maxsize=None)
+def _client_fd() -> int:
+    # A FIFO opened for reading *and* writing can be used as both ends of a
+    # jobserver "pipe".
+    return os.open(os.environ[JOBSERVER_ENV], os.O_RDWR)
+
+
+def pass_fds() -> tuple[int, ...]:
+    """The file descriptors a compile step must inherit to reach the jobserver.
+
+    :returns: The descriptor of this process's handle on the jobserver FIFO, if a
+        jobserver is active and make can't open the FIFO by path; otherwise, an
+        empty tuple.
+    """
+    if JOBSERVER_ENV not in os.environ or make_version() >= (4, 4):
+        return ()
+    return (_client_fd(),)
+
+
+def client_env() -> dict[str, str]:
+    """The environment variables that connect a build's tools to the jobserver.
+
+    :returns: The ``MAKEFLAGS`` and ``CARGO_MAKEFLAGS`` for the active jobserver; or
+        an empty dictionary if no jobserver is active.
+    """
+    try:
+        path = os.environ[JOBSERVER_ENV]
+    except KeyError:
+        return {}
+
+    version = make_version()
+    if version >= (4, 4):
+        auth = f"--jobserver-auth=fifo:{path}"
+    elif version >= (4, 2):
+        auth = f"--jobserver-auth={_client_fd()},{_client_fd()}"
+    else:
+        auth = f"--jobserver-fds={_client_fd()},{_client_fd()}"
+
+    makeflags = f"-j{cpu_count()} {auth}"
+    return {
+        "MAKEFLAGS": makeflags,
+        "CARGO_MAKEFLAGS": makeflags,
+    }
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from copy import deepcopy
+from functools import lru_cache
+from pathlib import Path
+
+import jinja2
+import yaml
+
+# This module must only depend on jinja2 and PyYAML, so that the CI scripts that
+# read recipe metadata can use it without installing forge.
+
+# The metadata that has been rendered by this process, keyed by the hash of the
+# recipe and the render context.
+_rendered = {}
+
+
+def cache_dir() -> Path:
+    """The directory holding the compiled templates and rendered metadata that
+    are shared between processes.
+
+    This can be overridden with ``MOBILE_FORGE_META_CACHE``.
+    """
+    try:
+        return Path(os.environ["MOBILE_FORGE_META_CACHE"])
+    except KeyError:
+        return Path(tempfile.gettempdir()) / f"mobile-forge-meta-{os.getuid()}"
+
+
+def _load_source(name):
+    path = Path(name)
+    mtime = path.stat().st_mtime_ns
+    return (
+        path.read_text(encoding="utf-8"),
+        name,
+        lambda: path.stat().st_mtime_ns == mtime,
+    )
+
+
+@lru_cache(maxsize=None)
+def environment() -> jinja2.Environment:
+    """The Jinja environment used to render every recipe.
+
+    Compiled templates are kept in a bytecode cache, so a template is only compiled
+    once, even across processes.
+    """
+    bytecode_dir = cache_dir() / "bytecode"
+    bytecode_dir.mkdir(parents=True, exist_ok=True)
+    return jinja2.Environment(
+        loader=jinja2.FunctionLoader(_load_source),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(str(bytecode_dir)),
+    )
+
+
+def recipe_digest(path: Path | str) -> str:
+    """The SHA256 hash of the content of a recipe's ``meta.yaml``.
+
+    :param path: The path to the ``meta.yaml`` file.
+    """
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def render_meta(path: Path | str, **context) -> dict:
+    """Render a recipe's ``meta.yaml`` template, and parse the result.
+
+    Renders are memoized on the content of the recipe and the render context, both
+    in this process, and on disk.
+
+    :param path: The path to the ``meta.yaml`` file.
+    :param context: The variables to render the template with (``sdk``,
+        ``sdk_version``, ``arch``, ``version`` and ``py_version``).
+    :returns: The parsed metadata. The caller is free to modify it.
+    """
+    path = Path(path).resolve()
+    key = hashlib.sha256(
+        f"{recipe_digest(path)} {sorted(context.items())!r}".encode()
+    ).hexdigest()
+
+    try:
+        meta = _rendered[key]
+    except KeyError:
+        cache_path = cache_dir() / "meta" / f"{key}.json"
+        try:
+            meta = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            meta = (
+                yaml.safe_load(environment().get_template(str(path)).render(**context))
+                or {}
+            )
+            try:
+                content = json.dumps(meta)
+            except TypeError:
+                content = None
+            # Metadata that doesn't survive a round trip through JSON (e.g., a
+            # mapping with integer keys) isn't cached on disk.
+            if content is not None and json.loads(content) == meta:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_name(f"{key}.{os.getpid()}.tmp")
+                tmp_path.write_text(content, encoding="utf-8")
+                os.replace(tmp_path, cache_path)
+        _rendered[key] = meta
+
+    return deepcopy(meta)
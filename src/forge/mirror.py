@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import os
+import shutil
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+try:
+    import tomllib
+except ModuleNotFoundError:
+    import tomli as tomllib
+
+# The index that forge installs its own published wheels from.
+FLET_INDEX_URL = "https://pypi.flet.dev"
+
+# pip's default package index.
+PYPI_INDEX_URL = "https://pypi.org/simple"
+
+
+def config_path() -> Path:
+    """The location of the mirror configuration.
+
+    This can be overridden with ``MOBILE_FORGE_MIRROR_CONFIG``. The configuration is
+    a TOML file with two (optional) keys: ``location``, the local directory or
+    HTTP(S) URL of a mirror; and ``rewrite``, a table of URL prefixes, each mapped to
+    the prefix it should be replaced with. For example::
+
+        location = "/srv/forge-mirror"
+
+        [rewrite]
+        "https://github.com/" = "http://git-cache.lan/github/"
+        "https://pypi.flet.dev" = "http://devpi.lan/flet/prod"
+    """
+    try:
+        return Path(os.environ["MOBILE_FORGE_MIRROR_CONFIG"])
+    except KeyError:
+        return Path.cwd() / "mirror.toml"
+
+
+@lru_cache(maxsize=None)
+def config() -> dict:
+    """The mirror configuration.
+
+    :returns: A dictionary containing the mirror ``location`` (or None, if there is
+        no mirror), and the ``rewrite`` rules.
+    :raises: ``RuntimeError`` if the configuration file can't be parsed.
+    """
+    try:
+        with config_path().open("rb") as f:
+            content = tomllib.load(f)
+    except FileNotFoundError:
+        content = {}
+    except tomllib.TOMLDecodeError as e:
+        raise RuntimeError(f"Can't parse mirror configuration {config_path()}: {e}")
+
+    return {
+        # MOBILE_FORGE_MIRROR overrides the configured location.
+        "location": (
+            os.getenv("MOBILE_FORGE_MIRROR") or content.get("location") or None
+        ),
+        "rewrite": dict(content.get("rewrite", {})),
+    }
+
+
+def rewrite(url: str) -> str:
+    """Apply the rewrite rules to a URL.
+
+    :param url: The URL to rewrite.
+    :returns: The URL, with the longest matching prefix replaced; or the URL
+        unmodified, if no rule matches.
+    """
+    rules = config()["rewrite"]
+    for prefix in sorted(rules, key=len, reverse=True):
+        if url.startswith(prefix):
+            return rules[prefix] + url[len(prefix) :]
+    return url
+
+
+def mirror_path(url: str) -> str:
+    """The location of a URL's content, relative to the root of a mirror.
+
+    Content is mirrored at ``<host>/<path>``; a URL that names a directory (e.g., a
+    simple API page) is mirrored as the ``index.json`` file in that directory.
+
+    :param url: The URL being mirrored.
+    """
+    parts = urlsplit(url)
+    path = parts.path.lstrip("/")
+    if not path or path.endswith("/"):
+        path += "index.json"
+    return f"{parts.hostname}/{path}"
+
+
+def local_root() -> Path | None:
+    """The root of the mirror, if the mirror is a local directory."""
+    location = config()["location"]
+    if location is None:
+        return None
+    if location.startswith("file:"):
+        return Path(url2pathname(urlsplit(location).path))
+    if "://" in location:
+        return None
+    return Path(location)
+
+
+def local_path(url: str) -> Path | None:
+    """Find the local file that a URL (as returned by :func:`resolve`) refers to.
+
+    :param url: The URL.
+    :returns: The path of the file; or None if the URL isn't a ``file:`` URL.
+    """
+    if url.startswith("file:"):
+        return Path(url2pathname(urlsplit(url).path))
+    return None
+
+
+def resolve(url: str) -> str:
+    """Determine where the content of a URL should be retrieved from.
+
+    A local mirror is used if it holds the content. An HTTP mirror is assumed to
+    hold everything that is requested of it (i.e., it should serve a directory that
+    has been filled with ``forge mirror sync``). Otherwise, the rewrite rules are
+    applied to the URL.
+
+    :param url: The original URL.
+    :returns: The URL to retrieve; a ``file:`` URL if the content is in a local
+        mirror.
+    """
+    location = config()["location"]
+    if location is not None:
+        root = local_root()
+        if root is None:
+            return f"{location.rstrip('/')}/{mirror_path(url)}"
+        path = root / mirror_path(url)
+        if path.is_file():
+            return path.resolve().as_uri()
+    return rewrite(url)
+
+
+def pip_index_args() -> list[str]:
+    """The package index arguments to pass to pip.
+
+    Both PyPI and the Flet index are subject to the rewrite rules. If the mirror has
+    a ``wheels`` directory, it is also searched for wheels; and if
+    ``MOBILE_FORGE_OFFLINE`` is set, that is the only place wheels are found.
+    """
+    args = []
+    location = config()["location"]
+    if location is not None:
+        root = local_root()
+        if root is None:
+            args += ["--find-links", f"{location.rstrip('/')}/wheels/"]
+        elif (root / "wheels").is_dir():
+            args += ["--find-links", str(root / "wheels")]
+
+    if os.getenv("MOBILE_FORGE_OFFLINE"):
+        return ["--no-index"] + args
+
+    if rewrite(PYPI_INDEX_URL) != PYPI_INDEX_URL:
+        args += ["--index-url", rewrite(PYPI_INDEX_URL)]
+    return args + ["--extra-index-url", rewrite(FLET_INDEX_URL)]
+
+
+def add(url: str, content: Path | bytes, replace: bool = False) -> bool:
+    """Copy content into the local mirror.
+
+    :param url: The URL that the content is served from.
+    :param content: The file holding the content, or the content itself.
+    :param replace: Should content already in the mirror be replaced? Content that
+        can change (e.g., a package index page) should be replaced; content that
+        can't (e.g., a source archive) needn't be.
+    :returns: True if the content was added; False if the mirror already held it.
+    :raises: ``RuntimeError`` if the mirror isn't a local directory.
+    """
+    root = local_root()
+    if root is None:
+        raise RuntimeError(
+            "Only a local directory can be synchronized as a mirror; "
+            f"the mirror location is {config()['location']!r}."
+        )
+
+    target = root / mirror_path(url)
+    if target.is_file() and not replace:
+        return False
+
+    # Copy to a temporary file, so that a build using the mirror never sees a
+    # partial file.
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    if isinstance(content, bytes):
+        tmp_path.write_bytes(content)
+    else:
+        shutil.copyfile(content, tmp_path)
+    os.replace(tmp_path, target)
+    return True
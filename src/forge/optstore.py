@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import zipfile
+from email.parser import Parser
+from pathlib import Path
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.tags import Tag
+from packaging.utils import (
+    InvalidWheelFilename,
+    canonicalize_name,
+    parse_wheel_filename,
+)
+
+from forge.logger import log
+
+
+def cache_path() -> Path:
+    """The folder holding the extracted content of every native library wheel."""
+    return Path.cwd() / "build" / "opt-store"
+
+
+def _dist_info(zf: zipfile.ZipFile) -> str | None:
+    # The name of the .dist-info folder of a wheel.
+    for name in zf.namelist():
+        top = name.split("/", 1)[0]
+        if top.endswith(".dist-info"):
+            return top
+    return None
+
+
+def is_native(wheel: Path) -> bool:
+    """Is a wheel a native library wheel?
+
+    A native library wheel (e.g., ``flet-libopenblas``) contains nothing but an
+    ``opt`` tree (headers, libraries and so on) and its metadata.
+
+    :param wheel: The wheel file.
+    """
+    with zipfile.ZipFile(wheel) as zf:
+        dist_info = _dist_info(zf)
+        names = zf.namelist()
+    return (
+        dist_info is not None
+        and any(name.startswith("opt/") for name in names)
+        and all(name.startswith(("opt/", f"{dist_info}/")) for name in names)
+    )
+
+
+def find_wheel(requirement: Requirement, tag: str, paths: list[Path]) -> Path | None:
+    """Find the best local wheel that satisfies a requirement.
+
+    :param requirement: The requirement.
+    :param tag: The platform tag of the cross environment.
+    :param paths: The folders holding wheels.
+    :returns: The wheel with the highest version (and build number) that
+        satisfies the requirement; or None if no wheel does.
+    """
+    name = canonicalize_name(requirement.name)
+    best = None
+    for path in paths:
+        if not path.is_dir():
+            continue
+        for wheel in path.glob("*.whl"):
+            try:
+                wheel_name, version, build, tags = parse_wheel_filename(wheel.name)
+            except InvalidWheelFilename:
+                continue
+            if (
+                wheel_name == name
+                and Tag("py3", "none", tag) in tags
+                and requirement.specifier.contains(version, prereleases=True)
+                and (best is None or (version, build) > best[0])
+            ):
+                best = ((version, build), wheel)
+    return best[1] if best else None
+
+
+def _digest(wheel: Path) -> str:
+    digest = hashlib.sha256()
+    with wheel.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract(wheel: Path) -> Path:
+    """Extract a wheel into the store, if it isn't already there.
+
+    The extracted files are read-only, as they are shared by every environment
+    the wheel is linked into.
+
+    :param wheel: The wheel file.
+    :returns: The location of the extracted wheel.
+    """
+    key = _digest(wheel)
+    path = cache_path() / key
+    if not path.is_dir():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # Another process may have extracted the wheel while we waited.
+            if not path.is_dir():
+                tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                try:
+                    with zipfile.ZipFile(wheel) as zf:
+                        for member in zf.infolist():
+                            target = Path(zf.extract(member, path=tmp_path))
+                            if not member.is_dir():
+                                # Keep the executable bit, as pip does.
+                                mode = member.external_attr >> 16
+                                target.chmod(0o555 if mode & stat.S_IXUSR else 0o444)
+                except BaseException:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    raise
+                os.replace(tmp_path, path)
+    return path
+
+
+def link(logfile, wheel: Path, site_packages: Path) -> list[str]:
+    """Install a native library wheel by linking its files from the store.
+
+    The ``opt`` tree is hardlinked (or, across filesystems, symlinked) from the
+    store. The metadata is copied, and recorded as installed by forge, so pip sees
+    the package as installed (and can uninstall it).
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param wheel: The wheel file.
+    :param site_packages: The site-packages folder to install into.
+    :returns: The requirements of the installed package.
+    """
+    log(logfile, f"Linking {wheel.name} from the native library store...")
+    path = extract(wheel)
+    for root, _, filenames in os.walk(path / "opt"):
+        target_root = site_packages / Path(root).relative_to(path)
+        target_root.mkdir(parents=True, exist_ok=True)
+        for filename in filenames:
+            source = Path(root) / filename
+            target = target_root / filename
+            target.unlink(missing_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                target.symlink_to(source)
+
+    with zipfile.ZipFile(wheel) as zf:
+        dist_info = _dist_info(zf)
+    target = site_packages / dist_info
+    shutil.rmtree(target, ignore_errors=True)
+    shutil.copytree(path / dist_info, target)
+    for file_path in target.iterdir():
+        file_path.chmod(0o644)
+    (target / "INSTALLER").write_text("forge\n", encoding="utf-8")
+    with (target / "RECORD").open("a", encoding="utf-8") as f:
+        f.write(f"{dist_info}/INSTALLER,,\n")
+
+    metadata = Parser().parsestr((target / "METADATA").read_text(encoding="utf-8"))
+    return metadata.get_all("Requires-Dist") or []
+
+
+def link_requirements(
+    logfile, requirements: list[str], tag: str, site_packages: Path, paths: list[Path]
+) -> list[str]:
+    """Link every native library wheel that satisfies a requirement.
+
+    A requirement is satisfied from the store if a native library wheel in one of
+    the given folders satisfies it; the requirements of that wheel are then
+    satisfied in the same way, if they can be.
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param requirements: The requirements being installed.
+    :param tag: The platform tag of the cross environment.
+    :param site_packages: The site-packages folder to install into.
+    :param paths: The folders holding wheels.
+    :returns: The requirements that must still be installed (e.g., by pip).
+    """
+    remaining = []
+    linked = set()
+    pending = list(requirements)
+    while pending:
+        specifier = pending.pop(0)
+        try:
+            requirement = Requirement(specifier)
+        except InvalidRequirement:
+            remaining.append(specifier)
+            continue
+        if canonicalize_name(requirement.name) in linked:
+            continue
+
+        wheel = None
+        if not requirement.extras and not requirement.marker:
+            wheel = find_wheel(requirement, tag, paths)
+        if wheel is None or not is_native(wheel):
+            remaining.append(specifier)
+            continue
+
+        pending += link(logfile, wheel, site_packages)
+        linked.add(canonicalize_name(requirement.name))
+
+    return remaining
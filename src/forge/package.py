@@ -2,14 +2,60 @@ from __future__ import annotations
 
 import sys
 from copy import deepcopy
+from functools import lru_cache
 from pathlib import Path
 
-import jinja2
 import jsonschema
 import yaml
 
 from forge.build import Builder, PythonPackageBuilder, SimplePackageBuilder
 from forge.cross import CrossVEnv
+from forge.meta import recipe_digest, render_meta
+
+# The validated metadata of every package loaded by this process, keyed by the
+# hash of the recipe, the render context and any overrides.
+_metas = {}
+
+
+def with_defaults(validator_cls):
+    """Extend a validator class so that validation also fills in the defaults
+    declared by the schema.
+
+    See http://python-jsonschema.readthedocs.io/en/latest/faq/
+
+    :param validator_cls: The validator class to extend.
+    :returns: The extended validator class.
+    """
+
+    def set_defaults(validator, properties, instance, schema):
+        for name, subschema in properties.items():
+            if "default" in subschema:
+                instance.setdefault(name, deepcopy(subschema["default"]))
+        yield from validator_cls.VALIDATORS["properties"](
+            validator, properties, instance, schema
+        )
+
+    return jsonschema.validators.extend(validator_cls, {"properties": set_defaults})
+
+
+@lru_cache(maxsize=None)
+def meta_validator():
+    """The validator for recipe metadata.
+
+    The schema is loaded and checked once per process, and the validator is shared
+    by every package.
+
+    :returns: A validator that checks metadata against the meta-schema, filling in
+        any defaults.
+    """
+    Validator = jsonschema.Draft4Validator
+    with (Path(__file__).parent / "schema" / "meta-schema.yaml").open(
+        encoding="utf-8"
+    ) as f:
+        schema = yaml.safe_load(f)
+    Validator.check_schema(schema)
+
+    return with_defaults(Validator)(schema)
 
 
 class Package:
@@ -48,33 +94,7 @@ class Package:
         return f"{self.name} {self.version}"
 
     def load_meta(self, override_version, override_build):
-        # http://python-jsonschema.readthedocs.io/en/latest/faq/
-        def with_defaults(validator_cls):
-            def set_defaults(validator, properties, instance, schema):
-                for name, subschema in properties.items():
-                    if "default" in subschema:
-                        instance.setdefault(name, deepcopy(subschema["default"]))
-                yield from validator_cls.VALIDATORS["properties"](
-                    validator, properties, instance, schema
-                )
-
-            return jsonschema.validators.extend(
-                validator_cls, {"properties": set_defaults}
-            )
-
-        # Validate the meta-schema
-        Validator = jsonschema.Draft4Validator
-        with (Path(__file__).parent / "schema" / "meta-schema.yaml").open(
-            encoding="utf-8"
-        ) as f:
-            schema = yaml.safe_load(f)
-        Validator.check_schema(schema)
-
-        with (self.recipe_path / "meta.yaml").open(encoding="utf-8") as f:
-            meta_template = f.read()
-
-        # Render the meta template.
-        meta_str = jinja2.Template(meta_template).render(
+        context = dict(
             sdk=self.sdk,
             sdk_version=self.sdk_version,
             arch=self.arch,
@@ -85,9 +105,19 @@ class Package:
             ),
             py_version=sys.version_info,
         )
+        key = (
+            recipe_digest(self.recipe_path / "meta.yaml"),
+            tuple(sorted(context.items())),
+            override_version,
+            override_build,
+        )
+        try:
+            return deepcopy(_metas[key])
+        except KeyError:
+            pass
 
-        # Parse the rendered meta template
-        meta = yaml.safe_load(meta_str)
+        # Render and parse the meta template.
+        meta = render_meta(self.recipe_path / "meta.yaml", **context)
 
         # If there's a version override, set it in the package metadata.
         # If there's a build number override, set it; otherwise purge
@@ -103,17 +133,24 @@ class Package:
                 pass
 
         # Validate the metadata against the schema.
-        with_defaults(Validator)(schema).validate(meta)
+        meta_validator().validate(meta)
 
-        return meta
+        _metas[key] = meta
+        return deepcopy(meta)
 
-    def builder(self, cross_venv: CrossVEnv) -> Builder:
+    def builder(self, cross_venv: CrossVEnv, isolated=False) -> Builder:
         """Return a builder for this package in the given cross-platform environment.
 
         :param cross_venv: The cross-platform environment to use for the build
+        :param isolated: Should the builder use a source tree that isn't shared with
+            builds for other architectures?
         :returns: A builder for the package.
         """
         if (self.recipe_path / "build.sh").exists():
-            return SimplePackageBuilder(cross_venv=cross_venv, package=self)
+            return SimplePackageBuilder(
+                cross_venv=cross_venv, package=self, isolated=isolated
+            )
         else:
-            return PythonPackageBuilder(cross_venv=cross_venv, package=self)
+            return PythonPackageBuilder(
+                cross_venv=cross_venv, package=self, isolated=isolated
+            )
@@ -0,0 +1,468 @@
+from __future__ import annotations
+
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from forge import archive, git
+from forge.sources import fetch_sources
+
+if TYPE_CHECKING:
+    from forge.build import Builder
+
+# The maximum number of context lines that may be ignored, at the start and end of
+# each hunk, to find where it applies (the equivalent of patch's --fuzz).
+DEFAULT_FUZZ = 2
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Hunk:
+    def __init__(self, old_start: int, new_start: int, lines: list[tuple[str, str]]):
+        """
+        :param old_start: The line number at which the hunk starts in the original
+            file.
+        :param new_start: The line number at which the hunk starts in the patched
+            file.
+        :param lines: The lines of the hunk; each a tuple of the tag (" " for
+            context, "-" for a removed line, "+" for an added line) and the text of
+            the line, including the line ending.
+        """
+        self.old_start = old_start
+        self.new_start = new_start
+        self.lines = lines
+
+    @property
+    def old_lines(self) -> list[str]:
+        return [text for tag, text in self.lines if tag != "+"]
+
+    @property
+    def new_lines(self) -> list[str]:
+        return [text for tag, text in self.lines if tag != "-"]
+
+    def context(self) -> tuple[int, int]:
+        """The number of context lines at the start and end of the hunk."""
+        leading = 0
+        while leading < len(self.lines) and self.lines[leading][0] == " ":
+            leading += 1
+        trailing = 0
+        while (
+            trailing < len(self.lines) - leading and self.lines[-1 - trailing][0] == " "
+        ):
+            trailing += 1
+        return leading, trailing
+
+
+class FilePatch:
+    def __init__(self, old_path: str, new_path: str):
+        """
+        :param old_path: The path of the original file, as named in the patch; or
+            ``/dev/null`` if the patch creates the file.
+        :param new_path: The path of the patched file, as named in the patch; or
+            ``/dev/null`` if the patch deletes the file.
+        """
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+    def target(self, root: Path, strip: int) -> Path:
+        """The file that the patch applies to.
+
+        :param root: The folder the patch is applied in.
+        :param strip: The number of leading path components to strip from the
+            paths in the patch.
+        """
+        candidates = [
+            root / Path(*Path(path).parts[strip:])
+            for path in (self.new_path, self.old_path)
+            if path != "/dev/null" and len(Path(path).parts) > strip
+        ]
+        if not candidates:
+            raise RuntimeError(f"Can't determine the file patched by {self.old_path}")
+        # As with patch, prefer a file that exists.
+        return next((path for path in candidates if path.exists()), candidates[0])
+
+
+class HunkResult:
+    def __init__(self, path: str, number: int, line=None, offset=0, fuzz=0):
+        """
+        :param path: The path of the patched file.
+        :param number: The number of the hunk in the file's patch, from 1.
+        :param line: The line at which the hunk was applied; or None if it couldn't
+            be applied.
+        :param offset: The number of lines between where the hunk said it applied,
+            and where it was applied.
+        :param fuzz: The number of context lines that were ignored to apply the
+            hunk.
+        """
+        self.path = path
+        self.number = number
+        self.line = line
+        self.offset = offset
+        self.fuzz = fuzz
+
+    @property
+    def applied(self) -> bool:
+        return self.line is not None
+
+    @property
+    def clean(self) -> bool:
+        """Did the hunk apply exactly where it said it would?"""
+        return self.applied and not self.offset and not self.fuzz
+
+    def __str__(self):
+        if not self.applied:
+            return f"{self.path}: hunk #{self.number} FAILED"
+        details = []
+        if self.offset:
+            details.append(
+                f"offset {self.offset} line{'s' if abs(self.offset) != 1 else ''}"
+            )
+        if self.fuzz:
+            details.append(f"fuzz {self.fuzz}")
+        return f"{self.path}: hunk #{self.number} succeeded at {self.line}" + (
+            f" ({', '.join(details)})" if details else ""
+        )
+
+
+def parse(text: str) -> list[FilePatch]:
+    """Parse a unified diff.
+
+    Any text before, between or after the file patches (e.g., a description of the
+    patch, or ``diff --git`` headers) is ignored.
+
+    :param text: The content of the diff.
+    :returns: The patches of each file in the diff.
+    :raises: ``RuntimeError`` if a hunk has more lines than its header says.
+    """
+    lines = text.splitlines(keepends=True)
+    patches = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if (
+            line.startswith("--- ")
+            and i + 1 < len(lines)
+            and lines[i + 1].startswith("+++ ")
+        ):
+            # Paths may be followed by a tab, and a timestamp.
+            patches.append(
+                FilePatch(
+                    line[4:].rstrip("\r\n").split("\t")[0],
+                    lines[i + 1][4:].rstrip("\r\n").split("\t")[0],
+                )
+            )
+            i += 2
+            continue
+
+        match = _HUNK_HEADER.match(line)
+        if match and patches:
+            old_count = int(match[2]) if match[2] is not None else 1
+            new_count = int(match[4]) if match[4] is not None else 1
+            hunk_lines = []
+            i += 1
+            while old_count or new_count:
+                text = lines[i] if i < len(lines) else ""
+                # Like patch, accept a hunk that is cut short by the end of the
+                # diff, or by the start of the next hunk or file.
+                if (
+                    not text
+                    or _HUNK_HEADER.match(text)
+                    or (
+                        text.startswith("--- ")
+                        and i + 1 < len(lines)
+                        and lines[i + 1].startswith("+++ ")
+                    )
+                ):
+                    break
+                # Some editors strip the trailing space of an empty context line.
+                tag = text[0] if text[0] in " -+" else " "
+                if text[0] in " -+":
+                    text = text[1:]
+                elif text.strip():
+                    break
+                if tag != "+":
+                    old_count -= 1
+                if tag != "-":
+                    new_count -= 1
+                if old_count < 0 or new_count < 0:
+                    raise RuntimeError(f"Malformed hunk: {line.strip()}")
+                hunk_lines.append((tag, text))
+                i += 1
+                if i < len(lines) and lines[i].startswith("\\"):
+                    # "\ No newline at end of file"
+                    hunk_lines[-1] = (tag, text.rstrip("\r\n"))
+                    i += 1
+            patches[-1].hunks.append(Hunk(int(match[1]), int(match[3]), hunk_lines))
+            continue
+
+        i += 1
+
+    return patches
+
+
+def _normalize(line: str) -> str:
+    # Runs of whitespace are equivalent (the equivalent of --ignore-whitespace).
+    return " ".join(line.split())
+
+
+def _find(lines, pattern, expected, start) -> int | None:
+    # Search outward from the expected position, for an exact match first, then a
+    # match that ignores whitespace.
+    last = len(lines) - len(pattern)
+    expected = min(max(expected, start), max(last, start))
+    for compare in (None, _normalize):
+        if compare is None:
+            candidates, wanted = lines, pattern
+        else:
+            candidates = [compare(line) for line in lines]
+            wanted = [compare(line) for line in pattern]
+        for distance in range(max(expected - start, last - expected) + 1):
+            for position in (expected - distance, expected + distance):
+                if (
+                    start <= position <= last
+                    and (not wanted or candidates[position] == wanted[0])
+                    and candidates[position : position + len(wanted)] == wanted
+                ):
+                    return position
+    return None
+
+
+def _line_ending(lines: list[str]) -> str | None:
+    # The line ending used by a list of lines; or None if no line has one.
+    for line in lines:
+        if line.endswith("\n"):
+            return "\r\n" if line.endswith("\r\n") else "\n"
+    return None
+
+
+def _splice(
+    hunk: Hunk, lines: list[str], position: int, length: int, pre: int, post: int
+):
+    # Replace the lines a hunk matched. Only the added lines come from the hunk;
+    # the context (and removed) lines are those of the file, as they may differ
+    # from the hunk in whitespace, line endings, or a newline at the end of the
+    # file.
+    matched = iter(lines[position : position + length])
+    ending = _line_ending(lines[position : position + length]) or _line_ending(lines)
+    replacement = []
+    for tag, text in hunk.lines[pre : len(hunk.lines) - post]:
+        if tag == "+":
+            # Added lines use the line endings of the file.
+            if ending and text.endswith("\n"):
+                text = text.rstrip("\r\n") + ending
+            replacement.append(text)
+        else:
+            line = next(matched)
+            if tag == " ":
+                replacement.append(line)
+
+    # Only the last line of the file can be missing its newline.
+    for index, line in enumerate(replacement):
+        if not line.endswith("\n") and (
+            index < len(replacement) - 1 or position + length < len(lines)
+        ):
+            replacement[index] = line + (ending or "\n")
+    lines[position : position + length] = replacement
+
+
+def apply_file(
+    file_patch: FilePatch, content: str | None, name: str, fuzz=DEFAULT_FUZZ
+) -> tuple[str | None, list[HunkResult]]:
+    """Apply the patch of a single file.
+
+    :param file_patch: The patch.
+    :param content: The original content of the file; or None if it doesn't exist.
+    :param name: The name of the file, for reporting.
+    :param fuzz: The maximum number of context lines that may be ignored at the
+        start and end of each hunk.
+    :returns: A tuple of the patched content of the file (None if the patch deletes
+        the file), and the result of each hunk.
+    """
+    lines = (content or "").splitlines(keepends=True)
+    results = []
+    # The lines added (or removed) by the hunks that have been applied, and the
+    # offset at which the previous hunk was found; later hunks are expected to be
+    # found at the same offset.
+    growth = 0
+    offset = 0
+    # Hunks are applied in order; a hunk can't apply before the previous one.
+    start = 0
+    for number, hunk in enumerate(file_patch.hunks, start=1):
+        old_lines = hunk.old_lines
+        new_lines = hunk.new_lines
+        leading, trailing = hunk.context()
+        # A hunk that only adds lines says which line it adds them after.
+        base = (hunk.old_start - 1 if old_lines else hunk.old_start) + growth
+        for level in range(fuzz + 1):
+            pre = min(level, leading)
+            post = min(level, trailing)
+            pattern = old_lines[pre : len(old_lines) - post]
+            position = _find(lines, pattern, base + offset + pre, start)
+            if position is not None:
+                _splice(hunk, lines, position, len(pattern), pre, post)
+                offset = position - pre - base
+                results.append(
+                    HunkResult(
+                        name,
+                        number,
+                        line=position - pre + 1,
+                        offset=offset,
+                        fuzz=max(pre, post),
+                    )
+                )
+                growth += len(new_lines) - len(old_lines)
+                start = position + len(new_lines) - pre - post
+                break
+        else:
+            results.append(HunkResult(name, number))
+
+    if file_patch.new_path == "/dev/null" and not "".join(lines):
+        return None, results
+    return "".join(lines), results
+
+
+def apply_patch(
+    patch_path: Path, root: Path, strip=1, dry_run=False, fuzz=DEFAULT_FUZZ
+) -> list[HunkResult]:
+    """Apply a patch to a source tree.
+
+    Files are only modified if every hunk of the patch applies; so a patch that
+    fails leaves the tree as it was.
+
+    :param patch_path: The patch file (a unified diff).
+    :param root: The folder to apply the patch in.
+    :param strip: The number of leading path components to strip from the paths in
+        the patch (the equivalent of patch's ``-p``).
+    :param dry_run: If True, only check whether the patch applies.
+    :param fuzz: The maximum number of context lines that may be ignored at the
+        start and end of each hunk.
+    :returns: The result of each hunk.
+    :raises: ``RuntimeError`` if the patch can't be parsed, or doesn't modify
+        anything.
+    """
+    file_patches = parse(
+        patch_path.read_text(encoding="utf-8", errors="surrogateescape")
+    )
+    if not file_patches:
+        raise RuntimeError(f"{patch_path.name} doesn't contain a unified diff")
+
+    results = []
+    # Several parts of the patch may modify the same file.
+    contents = {}
+    for file_patch in file_patches:
+        target = file_patch.target(root, strip)
+        if target not in contents:
+            contents[target] = (
+                target.read_text(encoding="utf-8", errors="surrogateescape")
+                if target.is_file()
+                else None
+            )
+
+        if file_patch.old_path == "/dev/null" and contents[target]:
+            raise RuntimeError(f"{target.relative_to(root)} already exists")
+        contents[target], file_results = apply_file(
+            file_patch,
+            contents[target],
+            str(target.relative_to(root)),
+            fuzz=fuzz,
+        )
+        results.extend(file_results)
+
+    if not dry_run and all(result.applied for result in results):
+        for target, content in contents.items():
+            if content is None:
+                target.unlink(missing_ok=True)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                # Keep the line endings (and any undecodable bytes) as they are.
+                with target.open(
+                    "w", encoding="utf-8", errors="surrogateescape", newline=""
+                ) as f:
+                    f.write(content)
+
+    return results
+
+
+def _check_source(builder: Builder) -> tuple[list[tuple[str, list[HunkResult]]], str]:
+    """Apply a builder's patches to a scratch copy of its source.
+
+    :param builder: The builder.
+    :returns: A tuple of the results of each patch, and a description of the error
+        that prevented the patches from being checked (or an empty string).
+    """
+    source = builder.package.meta["source"]
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "src"
+        try:
+            if builder.source_type == "archive":
+                if builder.source_archive_path is None:
+                    return [], "The source archive couldn't be downloaded."
+                root.mkdir()
+                archive.extract(
+                    builder.source_archive_path, root, strip=builder.source_strip
+                )
+            elif builder.source_type == "git":
+                git.checkout(None, source["git_url"], source["git_rev"], root)
+            else:
+                shutil.copytree(
+                    builder.package.recipe_path / source["path"], root, symlinks=True
+                )
+        except Exception as e:
+            return [], f"Can't prepare source: {e}"
+
+        results = []
+        for patch in builder.package.meta["patches"]:
+            patchfile = builder.package.recipe_path / "patches" / patch
+            try:
+                results.append((patch, apply_patch(patchfile, root)))
+            except Exception as e:
+                return results, f"Can't apply {patch}: {e}"
+        return results, ""
+
+
+def check_patches(builders: list[Builder], jobs: int | None = None) -> bool:
+    """Check whether the patches of several recipes still apply to their sources.
+
+    The sources are fetched (see :func:`forge.sources.fetch_sources`), then the
+    patches of each recipe are applied, in parallel, to a scratch copy of its
+    source. No build environment is created.
+
+    :param builders: The builders of the recipes to check.
+    :param jobs: The number of recipes to check at the same time. Defaults to the
+        number of CPUs.
+    :returns: True if every patch applies.
+    """
+    builders = [
+        builder
+        for builder in builders
+        if builder.source_type is not None and builder.package.meta["patches"]
+    ]
+    fetch_sources(builders)
+
+    success = True
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for builder, (results, error) in zip(
+            builders, executor.map(_check_source, builders)
+        ):
+            hunks = [result for _, patch_results in results for result in patch_results]
+            failed = error or not all(result.applied for result in hunks)
+            if failed:
+                status = "FAILED"
+            elif all(result.clean for result in hunks):
+                status = "clean"
+            else:
+                status = "drifted"
+            print(f"{builder.package.name} {builder.package.version}: {status}")
+            for patch, patch_results in results:
+                for result in patch_results:
+                    if not result.clean:
+                        print(f"    {patch}: {result}")
+            if error:
+                print(f"    {error}")
+            success = success and not failed
+
+    return success
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+from forge import subprocess
+from forge.logger import log
+
+# Bump this whenever the way sources are unpacked or patched changes, so that
+# stale source trees aren't reused.
+PRISTINE_VERSION = 2
+
+
+def cache_path() -> Path:
+    """The folder holding the unpacked and patched source trees."""
+    return Path.cwd() / "build" / "pristine"
+
+
+def source_key(source: str, strip: int, patches: list[Path]) -> str:
+    """The key identifying an unpacked and patched source tree.
+
+    :param source: A string identifying the source (e.g., the SHA256 of the source
+        archive).
+    :param strip: The number of leading path components stripped when unpacking.
+    :param patches: The patch files applied to the source, in order.
+    """
+    digest = hashlib.sha256(f"{PRISTINE_VERSION} {source} {strip}".encode())
+    for patch in patches:
+        digest.update(b"\0" + patch.name.encode() + b"\0" + patch.read_bytes())
+    return digest.hexdigest()
+
+
+def copy_tree(logfile, source: Path, target: Path):
+    """Copy a source tree, as cheaply as the filesystem allows.
+
+    Files are cloned (a "reflink" copy, which shares the content with the original
+    until either is modified) where the filesystem supports it (e.g., APFS, Btrfs
+    or XFS); otherwise they are copied.
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param source: The tree to copy.
+    :param target: The location of the copy. It must not exist.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if sys.platform == "darwin":
+        command = ["cp", "-c", "-a", str(source), str(target)]
+    else:
+        command = ["cp", "-a", "--reflink=auto", str(source), str(target)]
+
+    try:
+        subprocess.run(logfile, command)
+    except (OSError, subprocess.CalledProcessError):
+        log(logfile, "Cloning isn't available; copying instead.")
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(source, target, symlinks=True)
+
+
+def materialize(logfile, key: str, target: Path, populate):
+    """Create a source tree from the cache, populating the cache if needed.
+
+    The cached tree is created once; every other request for the same key (from
+    this or any other process) copies it.
+
+    :param logfile: An open file handle to which all output will be logged.
+    :param key: The key identifying the source tree (see :func:`source_key`).
+    :param target: The location of the source tree. It must not exist.
+    :param populate: A callable that populates the (empty) folder it is passed with
+        the source tree.
+    :returns: True if the source tree was copied from the cache; False if the cache
+        had to be populated first.
+    """
+    path = cache_path() / key
+    cached = True
+    if not path.is_dir():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # Another process may have populated the cache while we waited.
+            if not path.is_dir():
+                cached = False
+                tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                tmp_path.mkdir()
+                try:
+                    populate(tmp_path)
+                except BaseException:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    raise
+                os.replace(tmp_path, path)
+
+    log(logfile, f"Copying sources from {path.relative_to(Path.cwd())}...")
+    copy_tree(logfile, path, target)
+    return cached
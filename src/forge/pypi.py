@@ -1,24 +1,238 @@
+import asyncio
 import datetime
+import hashlib
 import json
+import os
 import ssl
 import sys
+import time
 from functools import lru_cache
-from urllib.request import urlopen
+from pathlib import Path
+from urllib.parse import urljoin
 
 import certifi
+import httpx
+from packaging.utils import (
+    InvalidSdistFilename,
+    canonicalize_name,
+    parse_sdist_filename,
+)
+from packaging.version import InvalidVersion, Version
+
+from forge import mirror
 
 START_YEAR = datetime.datetime.now().year - 3
 
+# The maximum number of concurrent requests made to the package index when
+# fetching the metadata of several packages.
+DEFAULT_CONCURRENCY = 8
+
+# The number of seconds that cached package index metadata is used without being
+# revalidated.
+DEFAULT_CACHE_TTL = 3600
+
+# The PEP 691 JSON form of the simple repository API.
+SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+
+# The extensions of the files that can be source distributions. The simple API
+# doesn't say which files are sdists, so they are recognized by name.
+SDIST_EXTENSIONS = (
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz",
+    ".tar.xz",
+    ".txz",
+    ".tar.Z",
+    ".tar",
+    ".zip",
+)
+
+# The release metadata and sdist URLs of each package that has been fetched, keyed
+# by name.
+_releases = {}
+_source_urls = {}
+
+# The SHA256 hashes published for each sdist, keyed by URL.
+_source_hashes = {}
+
+
+def pypi_url() -> str:
+    """The base URL of the PyPI JSON API.
+
+    This can be overridden with ``MOBILE_FORGE_PYPI_URL`` (e.g., to use a mirror,
+    or a local server that mimics PyPI).
+    """
+    return os.getenv("MOBILE_FORGE_PYPI_URL", "https://pypi.org").rstrip("/")
+
+
+def simple_url(package_name) -> str:
+    """The URL of a package's page in the PEP 691 JSON simple API.
+
+    :param package_name: The PyPI name of the package.
+    """
+    return f"{pypi_url()}/simple/{canonicalize_name(package_name)}/"
+
+
+def cache_path(url) -> Path:
+    """The location of the on-disk cache of a package index document.
+
+    :param url: The URL of the document.
+    """
+    return (
+        Path.cwd()
+        / "downloads"
+        / "pypi"
+        / f"{hashlib.sha256(url.encode()).hexdigest()[:32]}.json"
+    )
+
 
 @lru_cache
+def ssl_context():
+    # ensure we're using a root certificate that works with PyPI
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+async def _cached_get(client, url, accept, refresh=False):
+    """Get a JSON document from the package index, using the on-disk cache.
+
+    A cached document is used as-is until it is older than
+    ``MOBILE_FORGE_PYPI_CACHE_TTL`` seconds; after that, it is revalidated using
+    its ETag and Last-Modified date, so an unchanged document isn't downloaded
+    again. If ``MOBILE_FORGE_OFFLINE`` is set, cached documents are always used,
+    regardless of age. Documents held by a local mirror are always used, unless
+    the document is being refreshed.
+
+    :param client: The HTTP client to use.
+    :param url: The URL of the document.
+    :param accept: The content type to request.
+    :param refresh: If True, ignore the mirror, and revalidate a cached document
+        with the package index (as named by the rewrite rules), regardless of its
+        age.
+    :returns: The parsed JSON document.
+    :raises: ``RuntimeError`` if offline, and the document isn't cached.
+    """
+    if refresh:
+        source = mirror.rewrite(url)
+    else:
+        source = mirror.resolve(url)
+        if local_path := mirror.local_path(source):
+            return json.loads(local_path.read_text(encoding="utf-8"))
+
+    path = cache_path(url)
+    try:
+        cached = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        cached = None
+
+    ttl = int(os.getenv("MOBILE_FORGE_PYPI_CACHE_TTL", DEFAULT_CACHE_TTL))
+    if os.getenv("MOBILE_FORGE_OFFLINE"):
+        if cached is None:
+            raise RuntimeError(f"{url} isn't cached, and MOBILE_FORGE_OFFLINE is set.")
+        return cached["data"]
+    if not refresh and cached is not None and time.time() - cached["fetched"] < ttl:
+        return cached["data"]
+
+    headers = {"Accept": accept}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await client.get(source, headers=headers)
+    if cached is not None and response.status_code == 304:
+        cached["fetched"] = time.time()
+    else:
+        response.raise_for_status()
+        cached = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched": time.time(),
+            "data": response.json(),
+        }
+
+    # Write to a temporary file, so concurrent builds never read a partial
+    # document.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(cached), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+    return cached["data"]
+
+
+async def _fetch_all(urls, accept, concurrency, refresh):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(
+        verify=ssl_context(),
+        limits=httpx.Limits(max_connections=concurrency),
+        timeout=30,
+        follow_redirects=True,
+    ) as client:
+
+        async def fetch(url):
+            async with semaphore:
+                return await _cached_get(client, url, accept, refresh=refresh)
+
+        return await asyncio.gather(*(fetch(url) for url in urls))
+
+
+def fetch_json(urls, accept="application/json", concurrency=None, refresh=False):
+    """Get several JSON documents from the package index.
+
+    Every document is requested concurrently, over a single pool of connections,
+    through the on-disk cache.
+
+    :param urls: The URLs of the documents.
+    :param accept: The content type to request.
+    :param concurrency: The maximum number of requests to make at the same time.
+        Defaults to ``MOBILE_FORGE_PYPI_CONCURRENCY``, or 8.
+    :param refresh: If True, get the documents from the package index itself,
+        rather than the mirror or the cache (see :func:`_cached_get`).
+    :returns: The parsed JSON documents, in the same order as ``urls``.
+    """
+    if concurrency is None:
+        concurrency = int(
+            os.getenv("MOBILE_FORGE_PYPI_CONCURRENCY", DEFAULT_CONCURRENCY)
+        )
+    return asyncio.run(_fetch_all(urls, accept, max(concurrency, 1), refresh))
+
+
 def get_pypi_releases(package_name):
-    url = f"https://pypi.org/pypi/{package_name}/json"
+    """Get the release metadata for a PyPI package.
 
-    # ensure we're using a root certificate that works with PyPI
-    context = ssl.create_default_context(cafile=certifi.where())
-    releases = json.load(urlopen(url, context=context))["releases"]
+    :param package_name: The PyPI name of the package to query.
+    :returns: The ``releases`` of the package's PyPI JSON metadata.
+    """
+    try:
+        return _releases[package_name]
+    except KeyError:
+        return fetch_pypi_releases([package_name])[package_name]
 
-    return releases
+
+def fetch_pypi_releases(package_names, concurrency=None):
+    """Get the release metadata for several PyPI packages.
+
+    The metadata of every package that hasn't already been fetched in this process
+    is requested concurrently.
+
+    :param package_names: The PyPI names of the packages to query.
+    :param concurrency: The maximum number of requests to make at the same time.
+    :returns: A dictionary of release metadata, keyed by package name.
+    """
+    missing = [name for name in dict.fromkeys(package_names) if name not in _releases]
+    if missing:
+        documents = fetch_json(
+            [f"{pypi_url()}/pypi/{name}/json" for name in missing],
+            concurrency=concurrency,
+        )
+        _releases.update(
+            (name, document["releases"]) for name, document in zip(missing, documents)
+        )
+
+    return {name: _releases[name] for name in package_names}
 
 
 def get_pypi_versions(package_name, year=START_YEAR):
@@ -48,20 +262,154 @@ def get_pypi_versions(package_name, year=START_YEAR):
     return sorted(versions)
 
 
-@lru_cache
+def get_all_pypi_versions(package_names, year=START_YEAR):
+    """Return 'all versions' for each of several packages.
+
+    The metadata of the packages is fetched concurrently; see
+    :func:`get_pypi_versions` for the versions that are included.
+
+    :param package_names: The PyPI names of the packages to query.
+    :returns: A dictionary of sorted version lists, keyed by package name.
+    """
+    fetch_pypi_releases(package_names)
+    return {name: get_pypi_versions(name, year=year) for name in package_names}
+
+
 def get_pypi_source_urls(package_name):
     """Get the download source URLs for a PyPI package.
 
+    This uses the (much smaller) PEP 691 JSON simple API, rather than the full
+    release metadata of the project.
+
     :param name: The PyPI name of the package to query.
     :returns: a dictionary URLs for of all non-yanked source distributions for the
         project, keyed by version number.
     """
-    releases = get_pypi_releases(package_name)
+    try:
+        return _source_urls[package_name]
+    except KeyError:
+        return fetch_pypi_source_urls([package_name])[package_name]
+
+
+def _sdist_version(package_name, stem, releases):
+    # The release an sdist belongs to, given its filename without the extension.
+    # The name and version are separated by the first dash after which the name
+    # matches the project name, as some versions contain a dash (e.g.,
+    # regex-2013-10-21). Releases are keyed by their version string and (if it is
+    # valid) their parsed version.
+    project = canonicalize_name(package_name)
+    for index, char in enumerate(stem):
+        if char == "-" and canonicalize_name(stem[:index]) == project:
+            version = stem[index + 1 :]
+            if version in releases:
+                return releases[version]
+            try:
+                version = Version(version)
+            except InvalidVersion:
+                return None
+            break
+    else:
+        # The filename doesn't start with the project name.
+        try:
+            _, version = parse_sdist_filename(f"{stem}.tar.gz")
+        except InvalidSdistFilename:
+            return None
+
+    return releases.get(version, str(version))
+
+
+def _parse_source_urls(name, page_url, index):
+    """Record the sdist URLs (and hashes) listed by a package's simple index page.
+
+    :param name: The PyPI name of the package.
+    :param page_url: The URL of the page.
+    :param index: The page, as a PEP 691 JSON document.
+    """
+    # The releases of the package (PEP 700).
+    releases = {}
+    for release in index.get("versions", []):
+        releases[release] = release
+        try:
+            releases.setdefault(Version(release), release)
+        except InvalidVersion:
+            pass
 
     urls = {}
-    for version, release in releases.items():
-        for package in release:
-            if package["packagetype"] == "sdist" and not package["yanked"]:
-                urls[version] = package["url"]
+    ranks = {}
+    for file in index["files"]:
+        filename = file["filename"]
+        extension = next(
+            (ext for ext in SDIST_EXTENSIONS if filename.endswith(ext)), None
+        )
+        if extension is None or file.get("yanked"):
+            continue
+        version = _sdist_version(name, filename[: -len(extension)], releases)
+        if version is None:
+            continue
+
+        # If a release has several sdists, prefer the first extension.
+        rank = SDIST_EXTENSIONS.index(extension)
+        if ranks.get(version, rank) < rank:
+            continue
+        ranks[version] = rank
+
+        # File URLs may be relative to the page.
+        url = urljoin(page_url, file["url"])
+        urls[version] = url
+        if file.get("hashes", {}).get("sha256"):
+            _source_hashes[url] = file["hashes"]["sha256"]
+    _source_urls[name] = urls
+
+
+def fetch_pypi_source_urls(package_names, concurrency=None):
+    """Get the download source URLs for several PyPI packages.
+
+    The simple index of every package that hasn't already been fetched in this
+    process is requested concurrently.
+
+    :param package_names: The PyPI names of the packages to query.
+    :param concurrency: The maximum number of requests to make at the same time.
+    :returns: A dictionary, keyed by package name, of the source URLs of each
+        package (as returned by :func:`get_pypi_source_urls`).
+    """
+    missing = [
+        name for name in dict.fromkeys(package_names) if name not in _source_urls
+    ]
+    if missing:
+        page_urls = [simple_url(name) for name in missing]
+        documents = fetch_json(page_urls, accept=SIMPLE_JSON, concurrency=concurrency)
+        for name, page_url, index in zip(missing, page_urls, documents):
+            _parse_source_urls(name, page_url, index)
+
+    return {name: _source_urls[name] for name in package_names}
+
+
+def refresh_pypi_index_pages(package_names, concurrency=None):
+    """Get the latest simple index pages of several PyPI packages.
+
+    The pages are requested from the package index itself, bypassing the mirror and
+    the age limit of the cache. The source URLs they list replace any that have
+    already been found in this process.
 
-    return urls
+    :param package_names: The PyPI names of the packages to query.
+    :param concurrency: The maximum number of requests to make at the same time.
+    :returns: A dictionary, keyed by page URL, of the parsed pages.
+    """
+    names = list(dict.fromkeys(package_names))
+    page_urls = [simple_url(name) for name in names]
+    documents = fetch_json(
+        page_urls, accept=SIMPLE_JSON, concurrency=concurrency, refresh=True
+    )
+    for name, page_url, index in zip(names, page_urls, documents):
+        _parse_source_urls(name, page_url, index)
+    return dict(zip(page_urls, documents))
+
+
+def get_pypi_source_sha256(url):
+    """Get the SHA256 hash published by the package index for an sdist.
+
+    :param url: The download URL of the sdist, as returned by
+        :func:`get_pypi_source_urls`.
+    :returns: The hex digest of the sdist; or None if the URL isn't a known sdist.
+    """
+    return _source_hashes.get(url)
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import heapq
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import redirect_stdout
+from typing import TYPE_CHECKING
+
+from packaging.utils import canonicalize_name
+
+if TYPE_CHECKING:
+    from forge.build import Builder
+    from forge.package import Package
+
+# The requirement targets that must be satisfied by wheels in dist/ before a build
+# can start.
+DEPENDENCY_TARGETS = ("host", "host_build")
+
+# The possible outcomes of a scheduled build.
+SUCCESS = "success"
+CACHED = "cached"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def requirement_names(package: Package) -> set[str]:
+    """The canonical names of the packages a build installs from dist/.
+
+    :param package: The package whose requirements should be inspected.
+    :returns: The set of canonical package names listed in the package's ``host``
+        and ``host_build`` requirements.
+    """
+    names = set()
+    for target in DEPENDENCY_TARGETS:
+        for requirement in package.meta["requirements"][target]:
+            # Requirements are "<name> <version spec>" or a bare PEP 508 specifier.
+            match = re.match(r"[A-Za-z0-9._-]+", requirement.strip())
+            if match:
+                names.add(canonicalize_name(match[0]))
+    return names
+
+
+def build_dependencies(builders: list[Builder]) -> list[set[int]]:
+    """Compute the dependency graph of a list of builds.
+
+    A build depends on every other build in the list that produces one of its host
+    requirements for the same platform tag. Requirements that aren't being built
+    are assumed to be available already (in dist/, or on a package index).
+
+    :param builders: The builders in the build plan.
+    :returns: A list, parallel to ``builders``, of the indices that each build
+        depends on.
+    """
+    producers = {}
+    for index, builder in enumerate(builders):
+        key = (canonicalize_name(builder.package.name), builder.cross_venv.tag)
+        producers.setdefault(key, set()).add(index)
+
+    return [
+        set().union(
+            *(
+                producers.get((name, builder.cross_venv.tag), set())
+                for name in requirement_names(builder.package)
+            )
+        )
+        - {index}
+        for index, builder in enumerate(builders)
+    ]
+
+
+def critical_paths(dependencies: list[set[int]], labels: list[str]) -> list[int]:
+    """Compute the length of the longest chain of builds that waits on each build.
+
+    :param dependencies: The dependency graph, as returned by
+        :func:`build_dependencies`.
+    :param labels: A description of each build, used to report cycles.
+    :returns: A list, parallel to ``dependencies``, of the number of builds on the
+        longest path from each build to the end of the plan (including itself).
+    :raises: ``RuntimeError`` if the dependency graph contains a cycle.
+    """
+    dependents = [set() for _ in dependencies]
+    for index, requires in enumerate(dependencies):
+        for dependency in requires:
+            dependents[dependency].add(index)
+
+    # Kahn's algorithm, from the end of the plan back to its start.
+    remaining = [len(d) for d in dependents]
+    order = [index for index, count in enumerate(remaining) if count == 0]
+    lengths = [1] * len(dependencies)
+    for index in order:
+        for dependency in dependencies[index]:
+            lengths[dependency] = max(lengths[dependency], lengths[index] + 1)
+            remaining[dependency] -= 1
+            if remaining[dependency] == 0:
+                order.append(dependency)
+
+    if len(order) != len(dependencies):
+        raise RuntimeError(
+            "Build plan contains a dependency cycle between: "
+            + ", ".join(
+                labels[index] for index, count in enumerate(remaining) if count != 0
+            )
+        )
+
+    return lengths
+
+
+def run_build(builder: Builder, force: bool) -> str:
+    """Run a single build.
+
+    :param builder: The builder to run.
+    :param force: Should the package be built even if it is up to date?
+    :returns: The outcome of the build; one of SUCCESS, CACHED or FAILED.
+    """
+    if not builder.build(clean=True, force=force):
+        return FAILED
+    return CACHED if builder.cached else SUCCESS
+
+
+def _build_in_worker(builder: Builder, force: bool) -> str:
+    """Run a single build in a worker process.
+
+    The console output of several concurrent builds would be interleaved beyond
+    legibility, so it is discarded; everything of interest is also written to the
+    build's own log file.
+
+    :param builder: The builder to run.
+    :param force: Should the package be built even if it is up to date?
+    :returns: The outcome of the build.
+    """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return run_build(builder, force)
+
+
+class _SerialExecutor:
+    """An executor that runs each function in this process, as soon as it is
+    submitted."""
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        pass
+
+
+def build_graph(builders: list[Builder], jobs: int, force=False) -> list[str]:
+    """Run a list of builds in dependency order.
+
+    Builds whose host requirements are produced by other builds in the list wait
+    for those builds to complete. Builds that are ready to run are started in order
+    of the length of the chain of builds waiting on them, so the critical path of
+    the plan is started as early as possible. If a build fails, every build that
+    depends on it (directly or indirectly) is cancelled; unrelated builds continue.
+
+    If more than one job is requested, each build runs in a worker process, so
+    every builder must be isolated (i.e., it must not share a build path with any
+    other builder in the list).
+
+    :param builders: The builders to run.
+    :param jobs: The maximum number of builds to run at the same time.
+    :param force: Should packages be built even if they are up to date?
+    :returns: The outcome of each build, in the same order as ``builders``; one of
+        SUCCESS, CACHED, FAILED or CANCELLED.
+    """
+    dependencies = build_dependencies(builders)
+    priorities = critical_paths(
+        dependencies,
+        [f"{builder.package} ({builder.cross_venv.tag})" for builder in builders],
+    )
+    dependents = [set() for _ in builders]
+    for index, requires in enumerate(dependencies):
+        for dependency in requires:
+            dependents[dependency].add(index)
+
+    waiting = [set(requires) for requires in dependencies]
+    ready = [
+        (-priorities[index], index)
+        for index, requires in enumerate(waiting)
+        if not requires
+    ]
+    heapq.heapify(ready)
+
+    results = {}
+    running = {}
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        target = _build_in_worker
+    else:
+        executor = _SerialExecutor()
+        target = run_build
+    try:
+        while ready or running:
+            while ready and len(running) < jobs:
+                _, index = heapq.heappop(ready)
+                builder = builders[index]
+                print(f"Starting {builder.package} for {builder.cross_venv.tag}")
+                running[executor.submit(target, builder, force)] = index
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                builder = builders[index]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    print(
+                        f"Error building {builder.package} ({builder.cross_venv.tag}): {e}"
+                    )
+                    results[index] = FAILED
+
+                if results[index] != FAILED:
+                    print(
+                        f"{'Built' if results[index] == SUCCESS else 'Up to date:'} "
+                        f"{builder.package} for {builder.cross_venv.tag} "
+                        f"(log: {builder.log_file_path})"
+                    )
+                    for dependent in dependents[index]:
+                        waiting[dependent].discard(index)
+                        if not waiting[dependent] and dependent not in results:
+                            heapq.heappush(ready, (-priorities[dependent], dependent))
+                else:
+                    print(
+                        f"Failed {builder.package} for {builder.cross_venv.tag} "
+                        f"(log: {builder.error_log_file_path})"
+                    )
+                    # Cancel everything downstream of the failed build.
+                    cancelled = list(dependents[index])
+                    while cancelled:
+                        dependent = cancelled.pop()
+                        if dependent not in results:
+                            results[dependent] = CANCELLED
+                            print(
+                                f"Cancelled {builders[dependent].package} for "
+                                f"{builders[dependent].cross_venv.tag}: "
+                                f"depends on {builder.package}"
+                            )
+                            cancelled.extend(dependents[dependent])
+    finally:
+        executor.shutdown()
+
+    return [results[index] for index in range(len(builders))]
@@ -0,0 +1,389 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+import httpx
+
+from forge import git, mirror, store
+from forge.pypi import fetch_pypi_source_urls, refresh_pypi_index_pages, ssl_context
+from forge.timing import phase
+
+if TYPE_CHECKING:
+    from forge.build import Builder
+
+# The maximum number of downloads from a single host at the same time.
+DEFAULT_PER_HOST = 4
+
+# The maximum number of downloads at the same time, across all hosts.
+MAX_DOWNLOADS = 16
+
+# The number of times a failed download is retried, and the delay before the first
+# retry (which doubles on each attempt, up to a maximum), in seconds.
+DEFAULT_RETRIES = 5
+BACKOFF = 1
+MAX_BACKOFF = 30
+
+
+def plan_downloads(
+    builders: list[Builder],
+) -> tuple[dict[str, str | None], list[str]]:
+    """Resolve the source archive that each build in a plan needs.
+
+    :param builders: The builders in the build plan.
+    :returns: A tuple of a dictionary of the archives that aren't in the download
+        store yet (the expected SHA256 of the archive, if known, keyed by URL); and
+        a list of descriptions of the builds whose source couldn't be resolved.
+    """
+    builders = [builder for builder in builders if builder.source_type == "archive"]
+
+    # Resolve the sdists of every PyPI package at once.
+    try:
+        fetch_pypi_source_urls(
+            [
+                builder.package.name
+                for builder in builders
+                if builder.package.meta["source"] == "pypi"
+            ]
+        )
+    except Exception:
+        # Resolve each package individually, so only the affected builds fail.
+        pass
+
+    downloads = {}
+    errors = []
+    for builder in builders:
+        try:
+            if builder.source_archive_path is None:
+                # Recipes that share an archive share the download.
+                url = builder.download_source_url()
+                downloads[url] = downloads.get(url) or builder.source_sha256()
+        except Exception as e:
+            errors.append(f"{builder.package} ({builder.cross_venv.tag}): {e}")
+
+    return downloads, errors
+
+
+class _IncompleteDownload(Exception):
+    pass
+
+
+def _validator(response: httpx.Response) -> str | None:
+    # A validator that can be sent with If-Range to resume the response (a weak
+    # ETag can't be).
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _content_range(response: httpx.Response) -> tuple[int, int | None]:
+    # The offset of a partial response, and the total length of the file (or None,
+    # if the server doesn't know it).
+    range_, _, total = response.headers.get("Content-Range", "").rpartition("/")
+    try:
+        start = int(range_.split()[-1].partition("-")[0])
+    except (IndexError, ValueError):
+        raise _IncompleteDownload(
+            f"invalid Content-Range: {response.headers.get('Content-Range')}"
+        )
+    return start, int(total) if total.isdigit() else None
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        verify=ssl_context(),
+        limits=httpx.Limits(max_connections=MAX_DOWNLOADS),
+        timeout=httpx.Timeout(30, read=300),
+        follow_redirects=True,
+    )
+
+
+async def download(
+    client: httpx.AsyncClient,
+    url: str,
+    sha256: str | None = None,
+    progress=None,
+    sink=None,
+) -> Path:
+    """Download an archive into the store.
+
+    The download is written to a partial file. If the connection fails, the
+    download is retried (up to ``MOBILE_FORGE_DOWNLOAD_RETRIES`` times; 5 by
+    default) with exponential backoff, resuming from the end of the partial file
+    with an HTTP ``Range`` request. A partial file left by an earlier run is
+    resumed the same way. A download is only resumed if the server can confirm
+    (with ``If-Range``) that the file hasn't changed, or the expected hash of the
+    archive is known; otherwise it is started again. The archive is only added to the store once its length
+    matches the length reported by the server, and its content matches the
+    expected hash (if there is one).
+
+    The archive is retrieved from the mirror, if one is configured (see
+    :func:`forge.mirror.resolve`).
+
+    :param client: The HTTP client to use.
+    :param url: The URL to download.
+    :param sha256: The expected SHA256 hash of the archive, if it is known.
+    :param progress: An optional callable, invoked with the number of bytes
+        downloaded and the total length (or None, if it isn't known) as each chunk
+        of the download is received.
+    :param sink: An optional callable, invoked with the offset and content of each
+        chunk of the download as it is received (e.g., to extract the archive while
+        it is downloaded). A download that is resumed, or restarted, passes an
+        offset other than the end of the previous chunk.
+    :returns: The path of the archive in the store.
+    """
+    retries = int(os.getenv("MOBILE_FORGE_DOWNLOAD_RETRIES", DEFAULT_RETRIES))
+
+    if path := store.lookup(url, sha256):
+        return path
+
+    with store.PartialDownload(url) as partial:
+        # Another process may have completed the download while we waited.
+        if path := store.lookup(url, sha256):
+            return path
+
+        source = mirror.resolve(url)
+        if local_path := mirror.local_path(source):
+            partial.reset()
+            with local_path.open("rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    if sink:
+                        sink(partial.size, chunk)
+                    partial.write(chunk)
+                    if progress:
+                        progress(partial.size, None)
+            return partial.commit(sha256)
+
+        attempt = 0
+        while True:
+            try:
+                if partial.size and partial.validator is None and sha256 is None:
+                    # Nothing can confirm that the partial content is from the
+                    # same file the server would send now.
+                    partial.reset()
+                headers = {}
+                if partial.size:
+                    headers["Range"] = f"bytes={partial.size}-"
+                    if partial.validator:
+                        headers["If-Range"] = partial.validator
+                async with client.stream("GET", source, headers=headers) as response:
+                    if response.status_code == 416:
+                        # The partial file is at least as long as the file. It is
+                        # only the whole archive if it matches the expected hash;
+                        # otherwise, start again.
+                        if (
+                            sha256 is None
+                            or partial.digest.hexdigest() != sha256.lower()
+                        ):
+                            partial.reset()
+                            raise _IncompleteDownload(
+                                "the partial download doesn't match the file"
+                            )
+                        length = partial.size
+                    else:
+                        response.raise_for_status()
+                        if response.status_code == 206:
+                            start, length = _content_range(response)
+                            if start != partial.size:
+                                partial.reset()
+                                raise _IncompleteDownload(
+                                    f"received a range starting at {start}"
+                                )
+                        else:
+                            # The server doesn't support ranges, or the file has
+                            # changed; start again.
+                            partial.reset()
+                            partial.set_validator(_validator(response))
+                            length = response.headers.get("Content-Length")
+                            length = int(length) if length else None
+
+                        async for chunk in response.aiter_bytes():
+                            if sink:
+                                sink(partial.size, chunk)
+                            partial.write(chunk)
+                            if progress:
+                                progress(partial.size, length)
+
+                if length is not None and partial.size != length:
+                    if partial.size > length:
+                        partial.reset()
+                    raise _IncompleteDownload(
+                        f"received {partial.size} of {length} bytes"
+                    )
+                return partial.commit(sha256)
+            except (httpx.UnsupportedProtocol, httpx.InvalidURL):
+                raise
+            except (httpx.TransportError, _IncompleteDownload) as e:
+                error = e
+            except httpx.HTTPStatusError as e:
+                # Only server errors are worth retrying.
+                if e.response.status_code < 500:
+                    raise
+                error = e
+
+            attempt += 1
+            if attempt > retries:
+                raise RuntimeError(
+                    f"Download of {url} failed after {attempt} attempts: {error}"
+                )
+            await asyncio.sleep(min(BACKOFF * 2 ** (attempt - 1), MAX_BACKOFF))
+
+
+def download_archive(
+    url: str, sha256: str | None = None, progress=None, sink=None
+) -> Path:
+    """Download a single archive into the store.
+
+    See :func:`download` for details.
+
+    :param url: The URL to download.
+    :param sha256: The expected SHA256 hash of the archive, if it is known.
+    :param progress: An optional callable, invoked as each chunk is received.
+    :param sink: An optional callable, passed the content of each chunk as it is
+        received.
+    :returns: The path of the archive in the store.
+    """
+
+    async def _download():
+        async with _client() as client:
+            return await download(client, url, sha256, progress=progress, sink=sink)
+
+    return asyncio.run(_download())
+
+
+async def _download_all(downloads, per_host):
+    # One semaphore per host, so no single server is asked for too many archives
+    # at once.
+    semaphores = {}
+    async with _client() as client:
+
+        async def fetch(url, sha256):
+            host = urlsplit(url).hostname
+            semaphore = semaphores.setdefault(host, asyncio.Semaphore(per_host))
+            try:
+                async with semaphore:
+                    size = (await download(client, url, sha256)).stat().st_size
+            except Exception as e:
+                print(f"Failed to download {url}: {str(e).splitlines()[0]}")
+                return None
+            print(f"Downloaded {url.split('/')[-1]} ({size / 1024 / 1024:.1f} MB)")
+            return size
+
+        return await asyncio.gather(
+            *(fetch(url, sha256) for url, sha256 in downloads.items())
+        )
+
+
+def fetch_sources(builders: list[Builder], per_host: int | None = None) -> bool:
+    """Download the source archives needed by a build plan, concurrently, and
+    fetch its Git sources.
+
+    Archives that have already been downloaded are skipped. A build whose source
+    couldn't be fetched isn't prevented from running; it will try (and report)
+    the download itself.
+
+    :param builders: The builders in the build plan.
+    :param per_host: The maximum number of downloads from a single host at the
+        same time. Defaults to ``MOBILE_FORGE_DOWNLOADS_PER_HOST``, or 4.
+    :returns: True if every source archive is now available.
+    """
+    if per_host is None:
+        per_host = int(os.getenv("MOBILE_FORGE_DOWNLOADS_PER_HOST", DEFAULT_PER_HOST))
+
+    start = time.time()
+    with phase("fetch sources"):
+        downloads, errors = plan_downloads(builders)
+        for error in errors:
+            print(f"Can't resolve the source of {error}")
+
+        if downloads:
+            print(f"Downloading {len(downloads)} source archives...")
+            sizes = asyncio.run(_download_all(downloads, max(per_host, 1)))
+        else:
+            sizes = []
+
+        # Fetch each revision of a Git source once, rather than in every build
+        # that uses it.
+        for url, rev in dict.fromkeys(
+            (
+                builder.package.meta["source"]["git_url"],
+                str(builder.package.meta["source"]["git_rev"]),
+            )
+            for builder in builders
+            if builder.source_type == "git"
+        ):
+            try:
+                git.resolve(None, url, rev)
+            except Exception as e:
+                print(f"Failed to fetch {rev} from {url}: {e}")
+                errors.append(url)
+
+    fetched = [size for size in sizes if size is not None]
+    failed = len(sizes) - len(fetched) + len(errors)
+    print(
+        f"Fetched {len(fetched)} source archives "
+        f"({sum(fetched) / 1024 / 1024:.1f} MB) in {time.time() - start:.1f}s"
+        + (f"; {failed} failed" if failed else "")
+    )
+    return not failed
+
+
+def sync_mirror(builders: list[Builder]) -> bool:
+    """Fill the local mirror with everything a build plan needs to download.
+
+    The source archive of every build is added to the mirror, along with the
+    package index pages used to find the sdists of Python packages. Once a mirror
+    has been synchronized, the plan can be built without access to the internet.
+
+    :param builders: The builders in the build plan.
+    :returns: True if everything the plan needs is now in the mirror.
+    :raises: ``RuntimeError`` if the mirror isn't a local directory.
+    """
+    if mirror.local_root() is None:
+        raise RuntimeError(
+            "forge mirror sync needs a local mirror directory; set "
+            "MOBILE_FORGE_MIRROR, or the location in the mirror configuration."
+        )
+
+    pypi_names = sorted(
+        {
+            builder.package.name
+            for builder in builders
+            if builder.package.meta.get("source") == "pypi"
+        }
+    )
+    # Get the latest index pages from the package index (rather than the mirror
+    # being synchronized) before planning the downloads, so that the mirror, and
+    # the plan, see new releases.
+    with phase("refresh index pages"):
+        pages = refresh_pypi_index_pages(pypi_names)
+
+    success = fetch_sources(builders)
+
+    with phase("sync mirror"):
+        added = 0
+        for url, document in pages.items():
+            added += mirror.add(url, json.dumps(document).encode(), replace=True)
+
+        for builder in builders:
+            if builder.source_type != "archive":
+                continue
+            try:
+                url = builder.download_source_url()
+                path = store.lookup(url, builder.source_sha256())
+            except Exception:
+                path = None
+            if path is None:
+                # fetch_sources has already reported the failure.
+                success = False
+                continue
+            added += mirror.add(url, path)
+
+    print(f"Added {added} files to the mirror at {mirror.local_root()}")
+    return success
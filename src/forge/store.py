@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+
+
+def store_path() -> Path:
+    """The content-addressed store of downloaded source archives.
+
+    Each archive is stored as ``downloads/sha256/<hash>``, so archives with the
+    same name but different content never collide, and recipes that use the same
+    archive share a single copy.
+    """
+    return Path.cwd() / "downloads" / "sha256"
+
+
+def _url_index_path(url: str) -> Path:
+    # The index maps each URL to the hash of the content it last served. There's one
+    # file per URL, so concurrent downloads never contend for the index.
+    return store_path() / "urls" / hashlib.sha256(url.encode()).hexdigest()
+
+
+def lookup(url: str, sha256: str | None = None) -> Path | None:
+    """Find a source archive in the store.
+
+    :param url: The URL the archive is downloaded from.
+    :param sha256: The expected SHA256 hash of the archive, if it is known.
+    :returns: The path of the archive in the store; or None if it hasn't been
+        downloaded.
+    """
+    if sha256 is None:
+        try:
+            sha256 = _url_index_path(url).read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+
+    # Archives are stored under the lowercase hex digest.
+    path = store_path() / sha256.lower()
+    return path if path.is_file() else None
+
+
+class PartialDownload:
+    """An archive that is being downloaded into the store.
+
+    The content is written to ``downloads/sha256/partial/<url hash>.part``, which
+    is kept between runs, so an interrupted download can be resumed. The partial
+    file is locked while it is open, so only one process downloads a given URL at
+    a time. Only once the content is complete (and matches the expected hash, if
+    there is one) is it renamed into the store.
+
+    The validator (ETag or Last-Modified) of the response the content came from is
+    kept next to the partial file, so a resumed download can check that it is
+    continuing the same file.
+    """
+
+    def __init__(self, url: str):
+        """
+        :param url: The URL the archive is being downloaded from.
+        """
+        self.url = url
+        self.path = (
+            store_path()
+            / "partial"
+            / f"{hashlib.sha256(url.encode()).hexdigest()}.part"
+        )
+        self.validator_path = self.path.with_suffix(".validator")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        while True:
+            self.file = self.path.open("a+b")
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+            # If another process completed the download while we waited for the
+            # lock, the file we locked has been moved into the store.
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self.file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            self.file.close()
+
+        # Hash any content retained from an earlier attempt.
+        self.digest = hashlib.sha256()
+        self.file.seek(0)
+        for chunk in iter(lambda: self.file.read(1024 * 1024), b""):
+            self.digest.update(chunk)
+        self.size = self.file.tell()
+
+        try:
+            self.validator = self.validator_path.read_text(encoding="utf-8")
+        except OSError:
+            self.validator = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the partial file, retaining its content."""
+        self.file.close()
+
+    def write(self, data: bytes):
+        """Append content to the partial file.
+
+        :param data: The content to append.
+        """
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def reset(self):
+        """Discard the content of the partial file."""
+        self.file.truncate(0)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.set_validator(None)
+
+    def set_validator(self, validator: str | None):
+        """Record the validator of the response the content is coming from.
+
+        :param validator: The ETag or Last-Modified header of the response; or None
+            if it didn't have one.
+        """
+        self.validator = validator
+        if validator is None:
+            self.validator_path.unlink(missing_ok=True)
+        else:
+            self.validator_path.write_text(validator, encoding="utf-8")
+
+    def commit(self, sha256: str | None = None) -> Path:
+        """Move the completed download into the store.
+
+        :param sha256: The expected SHA256 hash of the archive, if it is known.
+        :returns: The path of the archive in the store.
+        :raises: ``RuntimeError`` if the content doesn't match the expected hash. The
+            partial content is discarded.
+        """
+        self.file.flush()
+        actual = self.digest.hexdigest()
+        if sha256 is not None and actual != sha256.lower():
+            self.reset()
+            raise RuntimeError(
+                f"Download of {self.url} has SHA256 {actual}; expected {sha256}"
+            )
+
+        path = store_path() / actual
+        os.replace(self.path, path)
+        self.validator_path.unlink(missing_ok=True)
+
+        index_path = _url_index_path(self.url)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(actual, encoding="utf-8")
+        os.replace(tmp_path, index_path)
+
+        return path
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import shlex
 import subprocess as stdlib_subprocess
+from pathlib import Path
 
 from forge.logger import log
+from forge.timing import phase
 
 # Pass through check_output without logging
 check_output = stdlib_subprocess.check_output
@@ -36,14 +38,18 @@ def run(logfile, *args, **kwargs):
         log(logfile, f"    {key}={shlex.quote(value)}", debug=True)
     log(logfile, "-" * 80, debug=True)
 
-    with stdlib_subprocess.Popen(*args, **kwargs) as process:
-        while (return_code := process.poll()) is None:
-            output = process.stdout.readline()
-            if output:
-                log(logfile, output.strip())
-
-        log(logfile, "-" * 80, debug=True)
-        log(logfile, f"<<< Return code: {return_code}", debug=True)
+    # Subprocesses are timed under the name of the command, and its first arguments
+    # (e.g., "python -m pip"), so similar commands are totalled together.
+    name = " ".join(Path(str(arg)).name for arg in args[0][:3])
+    with phase(name, category="subprocess", command=shlex.join(map(str, args[0]))):
+        with stdlib_subprocess.Popen(*args, **kwargs) as process:
+            while (return_code := process.poll()) is None:
+                output = process.stdout.readline()
+                if output:
+                    log(logfile, output.strip())
+
+            log(logfile, "-" * 80, debug=True)
+            log(logfile, f"<<< Return code: {return_code}", debug=True)
 
     if return_code:
         raise stdlib_subprocess.CalledProcessError(return_code, args)
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# The directory that each process writes its timing events to. If it isn't set in
+# the environment, timing is disabled.
+TRACE_DIR_ENV = "MOBILE_FORGE_TRACE_DIR"
+
+# The build labels of the phases currently in progress in this process.
+_builds = []
+
+
+def _cpu_times() -> tuple[float, float]:
+    times = os.times()
+    return (times.user + times.system, times.children_user + times.children_system)
+
+
+@contextmanager
+def phase(name: str, category: str = "phase", **args):
+    """Record the wall clock and CPU time spent in a phase of the build.
+
+    Phases can be nested; a ``build`` argument (a description of the package build
+    the phase belongs to) is inherited by all the phases nested inside it.
+
+    :param name: The name of the phase.
+    :param category: The kind of phase; ``phase`` for steps of a build, and
+        ``subprocess`` for external commands.
+    :param args: Any additional detail to record with the phase.
+    """
+    trace_dir = os.environ.get(TRACE_DIR_ENV)
+    if not trace_dir:
+        yield
+        return
+
+    pushed = "build" in args
+    if pushed:
+        _builds.append(args["build"])
+    elif _builds:
+        args["build"] = _builds[-1]
+
+    start = time.time()
+    start_cpu, start_child_cpu = _cpu_times()
+    try:
+        yield
+    finally:
+        end = time.time()
+        end_cpu, end_child_cpu = _cpu_times()
+        if pushed:
+            _builds.pop()
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": int((end - start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": {
+                **args,
+                "cpu_s": round(end_cpu - start_cpu, 3),
+                "child_cpu_s": round(end_child_cpu - start_child_cpu, 3),
+            },
+        }
+        with (Path(trace_dir) / f"{os.getpid()}.jsonl").open(
+            "a", encoding="utf-8"
+        ) as f:
+            f.write(json.dumps(event, default=str) + "\n")
+
+
+class Trace:
+    """A collection of timing events from this process, and any worker processes
+    it starts."""
+
+    def start(self):
+        """Start recording timing events."""
+        self.directory = Path(tempfile.mkdtemp(prefix="forge-trace-"))
+        os.environ[TRACE_DIR_ENV] = str(self.directory)
+
+    def events(self) -> list[dict]:
+        """The timing events that have been recorded, in order of start time."""
+        events = []
+        for path in self.directory.glob("*.jsonl"):
+            with path.open(encoding="utf-8") as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+        return sorted(events, key=lambda event: event["ts"])
+
+    def finish(self, path: Path):
+        """Stop recording, write a Chrome trace of the recorded events, and print a
+        summary of where the time went.
+
+        The trace can be loaded into ``chrome://tracing``, or
+        https://ui.perfetto.dev.
+
+        :param path: The file to write the trace to.
+        """
+        os.environ.pop(TRACE_DIR_ENV, None)
+        events = self.events()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+        # Total each phase by name. CPU time is that of forge itself, plus any
+        # subprocess that completed during the phase.
+        totals = {}
+        for event in events:
+            count, wall, cpu = totals.get((event["cat"], event["name"]), (0, 0, 0))
+            totals[(event["cat"], event["name"])] = (
+                count + 1,
+                wall + event["dur"] / 1_000_000,
+                cpu + event["args"]["cpu_s"] + event["args"]["child_cpu_s"],
+            )
+
+        print()
+        print(f"Build timings (trace written to {path}):")
+        print(f"    {'Phase':<50} {'Count':>6} {'Wall (s)':>10} {'CPU (s)':>10}")
+        for (category, name), (count, wall, cpu) in sorted(
+            totals.items(), key=lambda item: -item[1][1]
+        ):
+            label = f"$ {name}" if category == "subprocess" else name
+            print(f"    {label[:50]:<50} {count:>6} {wall:>10.1f} {cpu:>10.1f}")
+        print()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from packaging.utils import (
+    InvalidWheelFilename,
+    canonicalize_name,
+    parse_wheel_filename,
+)
+from packaging.version import Version
+
+# The number of seconds that the resolution of a set of requirements is reused
+# before pip is asked to resolve it again.
+DEFAULT_PINS_TTL = 24 * 3600
+
+
+def cache_path() -> Path:
+    """The folder holding every wheel that has been installed in a cross
+    environment."""
+    return Path.cwd() / "downloads" / "wheelhouse"
+
+
+def pins_key(*parts) -> str:
+    """The key identifying a resolution of a set of requirements.
+
+    :param parts: Everything that the resolution depends on (e.g., the
+        requirements, the environment they are installed in, and the indexes they
+        are installed from).
+    """
+    return hashlib.sha256(
+        json.dumps([str(part) for part in parts]).encode()
+    ).hexdigest()
+
+
+def local_wheels(paths: list[Path]) -> list[tuple[str, int]]:
+    """Identify the wheels in folders other than the wheelhouse.
+
+    A resolution that could use these wheels depends on them, so they should be
+    part of its key: when a wheel is added (e.g., a new version is built) or
+    replaced, the requirements are resolved again.
+
+    :param paths: The folders holding wheels.
+    :returns: The file name (which includes the name and version) and modification
+        time of every wheel, sorted by file name.
+    """
+    return sorted(
+        (wheel.name, wheel.stat().st_mtime_ns)
+        for path in paths
+        if path.is_dir()
+        for wheel in path.glob("*.whl")
+    )
+
+
+def _pins_path(key: str) -> Path:
+    return cache_path() / "pins" / f"{key}.json"
+
+
+def load_pins(key: str) -> list[str] | None:
+    """Retrieve the resolution of a set of requirements.
+
+    A resolution is used for ``MOBILE_FORGE_WHEELHOUSE_TTL`` seconds (a day, by
+    default); or forever, if ``MOBILE_FORGE_OFFLINE`` is set.
+
+    :param key: The key identifying the resolution (see :func:`pins_key`).
+    :returns: A list of ``name==version`` pins for every package that was
+        installed; or None, if there is no current resolution.
+    """
+    try:
+        pins = json.loads(_pins_path(key).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+    ttl = int(os.getenv("MOBILE_FORGE_WHEELHOUSE_TTL", DEFAULT_PINS_TTL))
+    if os.getenv("MOBILE_FORGE_OFFLINE") or time.time() - pins["resolved"] < ttl:
+        return pins["pins"]
+    return None
+
+
+def save_pins(key: str, report_path: Path) -> list[str] | None:
+    """Store the resolution of a set of requirements.
+
+    :param key: The key identifying the resolution (see :func:`pins_key`).
+    :param report_path: The installation report written by ``pip install
+        --report``.
+    :returns: The pins that were stored; or None if the report couldn't be read.
+    """
+    try:
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        pins = [
+            f"{item['metadata']['name']}=={item['metadata']['version']}"
+            for item in report["install"]
+        ]
+    except (OSError, ValueError, KeyError):
+        return None
+
+    path = _pins_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(
+        json.dumps({"pins": pins, "resolved": time.time()}), encoding="utf-8"
+    )
+    os.replace(tmp_path, path)
+    return pins
+
+
+def _wheels(paths: list[Path]) -> set[tuple[str, Version]]:
+    # The name and version of every wheel in the given folders.
+    wheels = set()
+    for path in paths:
+        if path.is_dir():
+            for wheel in path.glob("*.whl"):
+                try:
+                    name, version, _, _ = parse_wheel_filename(wheel.name)
+                except InvalidWheelFilename:
+                    continue
+                wheels.add((name, version))
+    return wheels
+
+
+def available(pins: list[str], paths: list[Path]) -> bool:
+    """Can a set of pins be installed without consulting a package index?
+
+    :param pins: A list of ``name==version`` pins.
+    :param paths: The folders (other than the wheelhouse) that hold wheels.
+    """
+    wheels = _wheels([cache_path()] + paths)
+    for pin in pins:
+        name, _, version = pin.partition("==")
+        if (canonicalize_name(name), Version(version)) not in wheels:
+            return False
+    return True
+
+
+def add(path: Path, paths: list[Path]):
+    """Move wheels into the wheelhouse.
+
+    :param path: The folder holding the wheels.
+    :param paths: Other folders that hold wheels. Their wheels (e.g., those built by
+        forge, which can be rebuilt) aren't added to the wheelhouse.
+    """
+    excluded = {wheel.name for other in paths for wheel in other.glob("*.whl")}
+    cache_path().mkdir(parents=True, exist_ok=True)
+    for wheel in path.glob("*.whl"):
+        if wheel.name not in excluded:
+            # Builds that are installing from the wheelhouse never see a partial
+            # wheel.
+            os.replace(wheel, cache_path() / wheel.name)
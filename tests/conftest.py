@@ -0,0 +1,119 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from forge import mirror
+
+
+class FileServer(ThreadingHTTPServer):
+    """A local stand-in for a download server.
+
+    Files are served with an ETag (unless ``etags`` is False), and support
+    conditional requests (``If-None-Match``) and range requests (honoring
+    ``If-Range``). The next response for a path can be cut short by setting
+    ``drop[path]`` to the number of bytes to send before closing the connection.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.files = {}
+        self.etags = True
+        self.unknown_length = False
+        self.drop = {}
+        self.delay = 0
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def etag(self, path):
+        return f'"{hash(self.files[path]) & 0xFFFFFFFF:x}"'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            self.respond(server)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, server):
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        content = server.files[self.path]
+        etag = server.etag(self.path)
+        if server.etags and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        start = 0
+        range_ = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_ and (if_range is None or if_range == etag):
+            start = int(range_.split("=")[1].split("-")[0])
+            if start >= len(content):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            total = "*" if server.unknown_length else len(content)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(content) - 1}/{total}"
+            )
+        else:
+            self.send_response(200)
+        if server.etags:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.end_headers()
+
+        body = content[start:]
+        drop = server.drop.pop(self.path, None)
+        if drop is not None:
+            self.wfile.write(body[:drop])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A clean working directory (holding the download store), with no mirror."""
+    monkeypatch.chdir(tmp_path)
+    for name in ["MOBILE_FORGE_MIRROR", "MOBILE_FORGE_MIRROR_CONFIG"]:
+        monkeypatch.delenv(name, raising=False)
+    mirror.config.cache_clear()
+    yield tmp_path
+    mirror.config.cache_clear()
+
+
+@pytest.fixture
+def file_server():
+    """A local HTTP server (see :class:`FileServer`)."""
+    server = FileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -5,7 +5,7 @@ Usage:
     read_meta_list.py <meta.yaml> <dotted.key>
 
 e.g. `extract_packages` or `test.requires`. The meta is rendered
-Jinja-then-YAML the way forge loads it (`forge/package.py`), so a
+Jinja-then-YAML by forge's own `forge/meta.py`, so a
 version-templated meta still parses. A missing key (at any level) or a non-list
 value prints nothing. Run hermetically so jinja2/pyyaml are present regardless of
 the caller's environment::
@@ -14,24 +14,25 @@ the caller's environment::
 """
 
 import sys
+from pathlib import Path
 
-import jinja2
-import yaml
+# Render with forge's own meta module (jinja2 + pyyaml only), so compiled templates
+# and rendered metas are shared with forge and the CI scripts.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+from forge.meta import render_meta  # noqa: E402
 
 meta_path, dotted_key = sys.argv[1], sys.argv[2]
-text = open(meta_path, encoding="utf-8").read()
 
 # Same render inputs forge uses; the fields we read are SDK-independent, but pass
 # a concrete context so metas that Jinja-branch on sdk/arch/version still render.
-rendered = jinja2.Template(text).render(
+node = render_meta(
+    meta_path,
     sdk="android",
     sdk_version="24",
     arch="arm64-v8a",
     version=None,
     py_version=sys.version_info,
 )
-
-node = yaml.safe_load(rendered) or {}
 for key in dotted_key.split("."):
     node = node.get(key) if isinstance(node, dict) else None
 
@@ -0,0 +1,47 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+from forge.archive import extract_tar
+
+
+def make_archive():
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode="w:gz") as tar:
+        for name, data in [("demo-1.0/a.txt", b"a\n"), ("demo-1.0/lib/b.txt", b"b\n")]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        # A hard link, in another folder, followed by more content.
+        link = tarfile.TarInfo("demo-1.0/bin/a.txt")
+        link.type = tarfile.LNKTYPE
+        link.linkname = "demo-1.0/a.txt"
+        tar.addfile(link)
+        info = tarfile.TarInfo("demo-1.0/z.txt")
+        info.size = 2
+        tar.addfile(info, io.BytesIO(b"z\n"))
+    content.seek(0)
+    return content
+
+
+@pytest.mark.parametrize("hard_links", [True, False])
+def test_hard_link(tmp_path, monkeypatch, hard_links):
+    if not hard_links:
+        # A file system that can't make hard links.
+        def link(src, dst):
+            raise OSError("Operation not permitted")
+
+        monkeypatch.setattr(os, "link", link)
+
+    extract_tar(make_archive(), tmp_path)
+
+    assert sorted(
+        str(path.relative_to(tmp_path)) for path in tmp_path.rglob("*.txt")
+    ) == ["a.txt", "bin/a.txt", "lib/b.txt", "z.txt"]
+    assert (tmp_path / "bin" / "a.txt").read_bytes() == b"a\n"
+    assert (tmp_path / "z.txt").read_bytes() == b"z\n"
+    assert (
+        os.path.samefile(tmp_path / "a.txt", tmp_path / "bin" / "a.txt") is hard_links
+    )
@@ -0,0 +1,95 @@
+import hashlib
+import io
+import tarfile
+from types import SimpleNamespace
+
+import pytest
+
+from forge import sources, store
+from forge.build import SimplePackageBuilder
+
+PATCH = """\
+--- a/hello.c
++++ b/hello.c
+@@ -1,3 +1,3 @@
+ int main() {
+-    return 1;
++    return 0;
+ }
+"""
+
+
+def make_archive():
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode="w:gz") as tar:
+        for name, data in [
+            ("demo-1.0/hello.c", b"int main() {\n    return 1;\n}\n"),
+            ("demo-1.0/README", b"demo\n" * 10000),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return content.getvalue()
+
+
+@pytest.fixture
+def builder(workdir, file_server, monkeypatch):
+    monkeypatch.setattr(sources, "BACKOFF", 0)
+    monkeypatch.delenv("MOBILE_FORGE_CACHE_DOWNLOADS_OFF", raising=False)
+
+    archive = make_archive()
+    file_server.files["/demo-1.0.tar.gz"] = archive
+
+    recipe_path = workdir / "recipes" / "demo"
+    (recipe_path / "patches").mkdir(parents=True)
+    (recipe_path / "patches" / "fix.patch").write_text(PATCH)
+    sysconfig = workdir / "_sysconfigdata.py"
+    sysconfig.write_text("build_time_vars = {}\n")
+
+    builder = SimplePackageBuilder(
+        SimpleNamespace(
+            sdk="android",
+            arch="arm64_v8a",
+            tag="android_24_arm64_v8a",
+            host_python_home=workdir / "python",
+            find_host_sysconfig=lambda: sysconfig,
+        ),
+        SimpleNamespace(
+            name="demo",
+            version="1.0",
+            recipe_path=recipe_path,
+            meta={
+                "package": {"name": "demo", "version": "1.0"},
+                "build": {"number": 0},
+                "source": {
+                    "url": f"{file_server.url}/demo-{{version}}.tar.gz",
+                    "sha256": hashlib.sha256(archive).hexdigest(),
+                },
+                "patches": ["fix.patch"],
+            },
+        ),
+    )
+    with (workdir / "build.log").open("w") as builder.log_file:
+        yield builder
+
+
+def test_fingerprint_doesnt_download_a_pinned_source(builder, file_server):
+    builder.fingerprint()
+
+    assert file_server.requests == []
+    assert builder.source_archive_path is None
+
+
+def test_cold_store_unpacks_while_downloading(builder, file_server, capsys):
+    fingerprint = builder.fingerprint()
+
+    builder.prepare_source()
+
+    assert len(file_server.requests) == 1
+    assert "Unpacked while downloading." in capsys.readouterr().out
+    assert (builder.build_path / "hello.c").read_text() == (
+        "int main() {\n    return 0;\n}\n"
+    )
+    assert builder.source_archive_path == store.store_path() / builder.source_sha256()
+    # The fingerprint doesn't depend on whether the archive has been downloaded.
+    assert builder.fingerprint() == fingerprint
@@ -0,0 +1,42 @@
+import pytest
+
+from forge.index import select_recipes
+
+
+def entry(name, builder="python", platforms=None, smoke=False, dependencies=()):
+    return {
+        "builder": builder,
+        "name": name,
+        "platforms": platforms,
+        "excluded_arches": [],
+        "smoke": smoke,
+        "dependencies": list(dependencies),
+    }
+
+
+INDEX = {
+    "flet-libfoo": entry("flet-libfoo", builder="simple"),
+    "flet-libios": entry("flet-libios", builder="simple", platforms=["ios"]),
+    "foo": entry("foo", smoke=True, dependencies=["flet-libfoo", "numpy"]),
+    "android-only": entry("android-only", platforms=["android"]),
+    "ios-only": entry("ios-only", platforms=["ios"]),
+    "broken": {"builder": "python", "error": "invalid recipe"},
+}
+
+
+@pytest.mark.parametrize(
+    "subset, expected",
+    [
+        ("non-py", ["flet-libfoo"]),
+        ("py-all-platforms", ["foo"]),
+        ("py", ["android-only", "foo"]),
+        ("smoke", ["flet-libfoo", "foo"]),
+        ("smoke-non-py", ["flet-libfoo"]),
+        ("smoke-py", ["foo"]),
+        ("non-smoke", ["android-only"]),
+        ("all", ["android-only", "flet-libfoo", "foo"]),
+    ],
+)
+def test_select_recipes(subset, expected, capsys):
+    assert select_recipes(INDEX, subset, "Android") == expected
+    assert "Skipping broken: can't read recipe" in capsys.readouterr().out
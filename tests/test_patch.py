@@ -0,0 +1,136 @@
+from forge.patch import apply_file, apply_patch, parse
+
+
+def apply(diff, content):
+    (file_patch,) = parse(diff)
+    patched, results = apply_file(file_patch, content, "file.c")
+    assert all(result.applied for result in results)
+    return patched
+
+
+def test_exact_match():
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,3 +1,4 @@\n"
+        " one\n"
+        " two\n"
+        "+added\n"
+        " three\n"
+    )
+    assert apply(diff, "one\ntwo\nthree\n") == "one\ntwo\nadded\nthree\n"
+
+
+def test_whitespace_only_match_keeps_file_context():
+    # The context only matches if whitespace is ignored; the file's own context
+    # lines are kept, and only the added line comes from the patch.
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,3 +1,3 @@\n"
+        " int x;\n"
+        "-int y;\n"
+        "+long y;\n"
+        " int z;\n"
+    )
+    content = "int  x;\n\tint y;\nint z;  \n"
+    assert apply(diff, content) == "int  x;\nlong y;\nint z;  \n"
+
+
+def test_crlf_file_keeps_line_endings():
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,2 +1,3 @@\n"
+        " one\n"
+        "+added\n"
+        " two\n"
+    )
+    assert apply(diff, "one\r\ntwo\r\n") == "one\r\nadded\r\ntwo\r\n"
+
+
+def test_no_newline_context_keeps_newline():
+    # The patch was made against a file without a newline at the end, but the
+    # file has one (and more content after it).
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,2 +1,3 @@\n"
+        " one\n"
+        "+added\n"
+        " }\n"
+        "\\ No newline at end of file\n"
+    )
+    assert apply(diff, "one\n}\nmore\n") == "one\nadded\n}\nmore\n"
+
+
+def test_no_newline_at_end_of_file():
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,2 +1,2 @@\n"
+        " one\n"
+        "-two\n"
+        "+TWO\n"
+        "\\ No newline at end of file\n"
+    )
+    assert apply(diff, "one\ntwo\n") == "one\nTWO"
+
+
+def test_added_newline_at_end_of_file():
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,2 +1,2 @@\n"
+        " one\n"
+        "-two\n"
+        "\\ No newline at end of file\n"
+        "+two\n"
+    )
+    assert apply(diff, "one\ntwo") == "one\ntwo\n"
+
+
+def test_offset_and_fuzz():
+    diff = (
+        "--- a/file.c\n"
+        "+++ b/file.c\n"
+        "@@ -1,5 +1,6 @@\n"
+        " stale\n"
+        " one\n"
+        " two\n"
+        "+added\n"
+        " three\n"
+        " four\n"
+    )
+    (file_patch,) = parse(diff)
+    patched, (result,) = apply_file(
+        file_patch, "header\nnew\none\ntwo\nthree\nfour\n", "file.c"
+    )
+    assert patched == "header\nnew\none\ntwo\nadded\nthree\nfour\n"
+    assert result.line == 2
+    assert result.offset == 1
+    assert result.fuzz == 1
+
+
+def test_failed_patch_leaves_tree_unchanged(tmp_path):
+    (tmp_path / "a.c").write_text("one\n")
+    (tmp_path / "b.c").write_text("two\n")
+    patch = tmp_path / "change.patch"
+    patch.write_text(
+        "--- a/a.c\n"
+        "+++ b/a.c\n"
+        "@@ -1 +1 @@\n"
+        "-one\n"
+        "+ONE\n"
+        "--- a/b.c\n"
+        "+++ b/b.c\n"
+        "@@ -1 +1 @@\n"
+        "-missing\n"
+        "+MISSING\n"
+    )
+
+    results = apply_patch(patch, tmp_path)
+
+    assert [result.applied for result in results] == [True, False]
+    assert (tmp_path / "a.c").read_text() == "one\n"
+    assert (tmp_path / "b.c").read_text() == "two\n"
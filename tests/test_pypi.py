@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+
+import pytest
+
+from forge import pypi
+
+DOCUMENT = {"info": {"name": "demo"}, "releases": {}}
+
+
+@pytest.fixture
+def index(workdir, file_server, monkeypatch):
+    """A package index serving one JSON document, with an empty cache."""
+    for name in ["MOBILE_FORGE_OFFLINE", "MOBILE_FORGE_PYPI_CACHE_TTL"]:
+        monkeypatch.delenv(name, raising=False)
+    file_server.files["/pypi/demo/json"] = json.dumps(DOCUMENT).encode()
+    return f"{file_server.url}/pypi/demo/json"
+
+
+def test_cached_document_is_used_until_it_expires(index, file_server):
+    assert pypi.fetch_json([index]) == [DOCUMENT]
+    assert pypi.fetch_json([index]) == [DOCUMENT]
+    assert len(file_server.requests) == 1
+
+    # Once the cached document is older than the TTL, it is revalidated.
+    path = pypi.cache_path(index)
+    cached = json.loads(path.read_text())
+    cached["fetched"] -= pypi.DEFAULT_CACHE_TTL
+    path.write_text(json.dumps(cached))
+
+    assert pypi.fetch_json([index]) == [DOCUMENT]
+    assert len(file_server.requests) == 2
+
+
+def test_unchanged_document_is_revalidated(index, file_server, monkeypatch):
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_CACHE_TTL", "0")
+    pypi.fetch_json([index])
+    # The server would send a different document, if it were asked for it.
+    etag = file_server.etag("/pypi/demo/json")
+    file_server.files["/pypi/demo/json"] = b"{}"
+    monkeypatch.setattr(file_server, "etag", lambda path: etag)
+
+    assert pypi.fetch_json([index]) == [DOCUMENT]
+
+    (_, first), (_, second) = file_server.requests
+    assert "If-None-Match" not in first
+    assert second["If-None-Match"] == etag
+
+
+def test_offline_uses_cached_documents(index, file_server, monkeypatch):
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_CACHE_TTL", "0")
+    pypi.fetch_json([index])
+    monkeypatch.setenv("MOBILE_FORGE_OFFLINE", "1")
+
+    assert pypi.fetch_json([index]) == [DOCUMENT]
+    with pytest.raises(RuntimeError, match="isn't cached"):
+        pypi.fetch_json([f"{file_server.url}/pypi/other/json"])
+    assert len(file_server.requests) == 1
+
+
+def test_cache_entry_is_replaced_atomically(index, file_server, monkeypatch):
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_CACHE_TTL", "0")
+    pypi.fetch_json([index])
+    path = pypi.cache_path(index)
+    entry = path.read_text()
+
+    # The new entry is written in full before it replaces the old one.
+    def replace(src, dst):
+        assert json.loads(open(src).read())["data"] == {}
+        assert open(dst).read() == entry
+        raise OSError("interrupted")
+
+    file_server.files["/pypi/demo/json"] = b"{}"
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(OSError, match="interrupted"):
+        pypi.fetch_json([index])
+
+    assert path.read_text() == entry
+
+
+def wheel(version, platform="macosx_11_0_arm64", year=2024):
+    python = f"cp3{sys.version_info.minor}"
+    return {
+        "packagetype": "bdist_wheel",
+        "filename": f"demo-{version}-{python}-{python}-{platform}.whl",
+        "upload_time": f"{year}-01-01T00:00:00",
+        "python_version": python,
+    }
+
+
+def releases(name):
+    return {
+        "1.0": [wheel("1.0")],
+        # Not a macOS wheel.
+        "1.1": [wheel("1.1", platform="manylinux2014_x86_64")],
+        # Too old.
+        "1.2": [wheel("1.2", year=2000)],
+        # A pre-release.
+        "2.0b1": [wheel("2.0b1")],
+        f"4.{len(name)}": [wheel(f"4.{len(name)}")],
+        "3.0": [
+            {"packagetype": "sdist", "filename": "demo-3.0.tar.gz"},
+            wheel("3.0"),
+        ],
+    }
+
+
+def test_versions_are_fetched_concurrently(workdir, file_server, monkeypatch):
+    monkeypatch.delenv("MOBILE_FORGE_OFFLINE", raising=False)
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_URL", file_server.url)
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_CONCURRENCY", "2")
+    monkeypatch.setattr(pypi, "_releases", {})
+    names = ["a", "bb", "cccc", "ddddd", "eeeeee"]
+    for name in names:
+        file_server.files[f"/pypi/{name}/json"] = json.dumps(
+            {"info": {"name": name}, "releases": releases(name)}
+        ).encode()
+    file_server.delay = 0.2
+
+    versions = pypi.get_all_pypi_versions(names, year=2020)
+
+    assert versions == {name: ["1.0", "3.0", f"4.{len(name)}"] for name in names}
+    assert sorted(path for path, _ in file_server.requests) == [
+        f"/pypi/{name}/json" for name in names
+    ]
+    assert file_server.max_active == 2
+
+    # The releases are only fetched once per process.
+    assert pypi.fetch_pypi_releases(["a"]) == {"a": releases("a")}
+    assert len(file_server.requests) == len(names)
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from forge import mirror, pypi, sources, store
+
+CONTENT = bytes(range(256)) * 400
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(sources, "BACKOFF", 0)
+
+
+def test_resume_after_dropped_connection(workdir, file_server):
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+    url = f"{file_server.url}/a.tar.gz"
+
+    path = sources.download_archive(url)
+
+    assert path.read_bytes() == CONTENT
+    (_, first), (_, second) = file_server.requests
+    assert "Range" not in first
+    assert second["Range"] == "bytes=1000-"
+    assert second["If-Range"] == file_server.etag("/a.tar.gz")
+
+
+def test_changed_file_is_downloaded_again(workdir, file_server, monkeypatch):
+    # An earlier run left a partial download.
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+    url = f"{file_server.url}/a.tar.gz"
+    monkeypatch.setenv("MOBILE_FORGE_DOWNLOAD_RETRIES", "0")
+    with pytest.raises(RuntimeError, match="failed after 1 attempts"):
+        sources.download_archive(url)
+
+    # The file changes before the download is resumed.
+    file_server.files["/a.tar.gz"] = CONTENT[::-1]
+    path = sources.download_archive(url)
+
+    assert path.read_bytes() == CONTENT[::-1]
+    _, resumed = file_server.requests[-1]
+    assert resumed["Range"] == "bytes=1000-"
+
+
+def test_unvalidated_partial_is_discarded(workdir, file_server, monkeypatch):
+    # Without a validator or an expected hash, a partial download can't be
+    # resumed safely.
+    file_server.etags = False
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+    url = f"{file_server.url}/a.tar.gz"
+    monkeypatch.setenv("MOBILE_FORGE_DOWNLOAD_RETRIES", "0")
+    with pytest.raises(RuntimeError):
+        sources.download_archive(url)
+
+    file_server.files["/a.tar.gz"] = CONTENT[::-1]
+    path = sources.download_archive(url)
+
+    assert path.read_bytes() == CONTENT[::-1]
+    _, restarted = file_server.requests[-1]
+    assert "Range" not in restarted
+
+
+def test_partial_with_known_hash_is_resumed(workdir, file_server, monkeypatch):
+    file_server.etags = False
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+    url = f"{file_server.url}/a.tar.gz"
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    monkeypatch.setenv("MOBILE_FORGE_DOWNLOAD_RETRIES", "0")
+    with pytest.raises(RuntimeError):
+        sources.download_archive(url, sha256)
+
+    path = sources.download_archive(url, sha256)
+
+    assert path == store.store_path() / sha256
+    _, resumed = file_server.requests[-1]
+    assert resumed["Range"] == "bytes=1000-"
+    assert "If-Range" not in resumed
+
+
+def test_unknown_total_length(workdir, file_server):
+    file_server.unknown_length = True
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+
+    path = sources.download_archive(f"{file_server.url}/a.tar.gz")
+
+    assert path.read_bytes() == CONTENT
+
+
+class FakeBuilder:
+    def __init__(self, url, name="pkg"):
+        self.url = url
+        self.source_type = "archive"
+        self.package = SimpleNamespace(name=name, meta={"source": {"url": url}})
+        self.cross_venv = SimpleNamespace(tag="android_24_arm64_v8a")
+
+    @property
+    def source_archive_path(self):
+        return store.lookup(self.url)
+
+    def download_source_url(self):
+        return self.url
+
+    def source_sha256(self):
+        return None
+
+
+def test_downloads_per_host_are_limited(workdir, file_server):
+    file_server.delay = 0.3
+    urls = {}
+    for index in range(4):
+        file_server.files[f"/{index}.tar.gz"] = CONTENT[index:]
+        # The same server, under two host names.
+        for host in ["127.0.0.1", "localhost"]:
+            urls[f"http://{host}:{file_server.server_port}/{index}.tar.gz"] = None
+
+    sizes = asyncio.run(sources._download_all(urls, per_host=2))
+
+    assert sizes == [len(CONTENT) - index for index in range(4) for _ in range(2)]
+    # Two downloads from each host at a time.
+    assert file_server.max_active == 4
+
+
+def test_fetch_sources_reports_failures(workdir, file_server, capsys):
+    file_server.files["/good.tar.gz"] = CONTENT
+    builders = [
+        FakeBuilder(f"{file_server.url}/good.tar.gz"),
+        FakeBuilder(f"{file_server.url}/missing.tar.gz"),
+    ]
+
+    assert not sources.fetch_sources(builders)
+
+    output = capsys.readouterr().out
+    assert "Downloaded good.tar.gz" in output
+    assert f"Failed to download {file_server.url}/missing.tar.gz" in output
+    assert "404" in output
+    assert "Fetched 1 source archives" in output
+    assert "; 1 failed" in output
+    assert builders[0].source_archive_path.read_bytes() == CONTENT
+
+    # Only the failed download is attempted again.
+    file_server.requests.clear()
+    assert not sources.fetch_sources(builders)
+    assert [path for path, _ in file_server.requests] == ["/missing.tar.gz"]
+
+
+def test_pinned_uppercase_hash(workdir, file_server):
+    file_server.files["/a.tar.gz"] = CONTENT
+    url = f"{file_server.url}/a.tar.gz"
+    sha256 = hashlib.sha256(CONTENT).hexdigest().upper()
+
+    path = sources.download_archive(url, sha256)
+
+    assert path == store.store_path() / sha256.lower()
+    assert store.lookup(url, sha256) == path
+    # The archive is found in the store, rather than downloaded again.
+    assert sources.download_archive(url, sha256) == path
+    assert len(file_server.requests) == 1
+
+
+def test_unpinned_partial_is_not_committed_on_416(workdir, file_server, monkeypatch):
+    # The server (wrongly) reports the file as unchanged.
+    monkeypatch.setattr(file_server, "etag", lambda path: '"unchanged"')
+    # An earlier run left a partial download...
+    file_server.files["/a.tar.gz"] = CONTENT
+    file_server.drop["/a.tar.gz"] = 1000
+    url = f"{file_server.url}/a.tar.gz"
+    monkeypatch.setenv("MOBILE_FORGE_DOWNLOAD_RETRIES", "0")
+    with pytest.raises(RuntimeError):
+        sources.download_archive(url)
+
+    # ... of a file that is now shorter.
+    file_server.files["/a.tar.gz"] = CONTENT[:500]
+    monkeypatch.setenv("MOBILE_FORGE_DOWNLOAD_RETRIES", "1")
+    path = sources.download_archive(url)
+
+    assert path.read_bytes() == CONTENT[:500]
+    (_, resumed), (_, restarted) = file_server.requests[-2:]
+    assert resumed["Range"] == "bytes=1000-"
+    assert "Range" not in restarted
+
+
+def test_pinned_partial_is_committed_on_416(workdir, file_server):
+    file_server.files["/a.tar.gz"] = CONTENT
+    url = f"{file_server.url}/a.tar.gz"
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    # An earlier run received the whole archive, but didn't commit it.
+    with store.PartialDownload(url) as partial:
+        partial.write(CONTENT)
+
+    path = sources.download_archive(url, sha256)
+
+    assert path.read_bytes() == CONTENT
+    assert len(file_server.requests) == 1
+
+
+class FakePyPIBuilder(FakeBuilder):
+    def __init__(self, name, version):
+        super().__init__(None, name=name)
+        self.package.meta = {"source": "pypi"}
+        self.package.version = version
+
+    @property
+    def source_archive_path(self):
+        return store.lookup(self.download_source_url())
+
+    def download_source_url(self):
+        return pypi.get_pypi_source_urls(self.package.name)[self.package.version]
+
+
+def index_page(*versions):
+    return json.dumps(
+        {
+            "versions": list(versions),
+            "files": [
+                {"filename": f"demo-{version}.tar.gz", "url": f"demo-{version}.tar.gz"}
+                for version in versions
+            ],
+        }
+    ).encode()
+
+
+def test_sync_mirror_refreshes_index_pages(workdir, file_server, monkeypatch):
+    monkeypatch.setenv("MOBILE_FORGE_PYPI_URL", file_server.url)
+    monkeypatch.setenv("MOBILE_FORGE_MIRROR", str(workdir / "mirror"))
+    mirror.config.cache_clear()
+    monkeypatch.setattr(pypi, "_source_urls", {})
+    monkeypatch.setattr(pypi, "_source_hashes", {})
+    file_server.files["/simple/demo/"] = index_page("1.0")
+    file_server.files["/simple/demo/demo-1.0.tar.gz"] = CONTENT
+    assert sources.sync_mirror([FakePyPIBuilder("demo", "1.0")])
+
+    # A new release is published.
+    file_server.files["/simple/demo/"] = index_page("1.0", "1.1")
+    file_server.files["/simple/demo/demo-1.1.tar.gz"] = CONTENT[::-1]
+    assert sources.sync_mirror([FakePyPIBuilder("demo", "1.1")])
+
+    host = workdir / "mirror" / "127.0.0.1" / "simple" / "demo"
+    page = json.loads((host / "index.json").read_text())
+    assert page["versions"] == ["1.0", "1.1"]
+    assert (host / "demo-1.1.tar.gz").read_bytes() == CONTENT[::-1]
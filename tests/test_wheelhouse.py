@@ -0,0 +1,83 @@
+import json
+import os
+
+import pytest
+
+from forge import wheelhouse
+
+
+@pytest.fixture
+def wheels(workdir, monkeypatch):
+    """A folder of local wheels."""
+    for name in ["MOBILE_FORGE_OFFLINE", "MOBILE_FORGE_WHEELHOUSE_TTL"]:
+        monkeypatch.delenv(name, raising=False)
+    path = workdir / "dist"
+    path.mkdir()
+    return path
+
+
+def write_report(path, *pins):
+    path.write_text(
+        json.dumps(
+            {
+                "install": [
+                    {"metadata": {"name": name, "version": version}}
+                    for name, version in (pin.split("==") for pin in pins)
+                ]
+            }
+        )
+    )
+
+
+def test_pins_are_saved_and_loaded(wheels, workdir, monkeypatch):
+    write_report(workdir / "report.json", "Demo==1.0", "other==2.0")
+
+    assert wheelhouse.save_pins("key", workdir / "report.json") == [
+        "Demo==1.0",
+        "other==2.0",
+    ]
+    assert wheelhouse.load_pins("key") == ["Demo==1.0", "other==2.0"]
+    assert wheelhouse.load_pins("other") is None
+
+    # Pins expire, unless offline.
+    monkeypatch.setenv("MOBILE_FORGE_WHEELHOUSE_TTL", "0")
+    assert wheelhouse.load_pins("key") is None
+    monkeypatch.setenv("MOBILE_FORGE_OFFLINE", "1")
+    assert wheelhouse.load_pins("key") == ["Demo==1.0", "other==2.0"]
+
+
+def test_unreadable_report_isnt_saved(wheels, workdir):
+    (workdir / "report.json").write_text("{}")
+
+    assert wheelhouse.save_pins("key", workdir / "report.json") is None
+    assert wheelhouse.load_pins("key") is None
+
+
+def test_available(wheels):
+    wheelhouse.cache_path().mkdir(parents=True)
+    (wheelhouse.cache_path() / "other-2.0-py3-none-any.whl").touch()
+    (wheels / "demo-1.0-cp312-cp312-android_24_arm64_v8a.whl").touch()
+
+    assert wheelhouse.available(["Demo==1.0", "other==2.0"], [wheels])
+    assert wheelhouse.available(["other==2.0.0"], [])
+    assert not wheelhouse.available(["Demo==1.0"], [])
+    assert not wheelhouse.available(["demo==1.1"], [wheels])
+
+
+def test_key_depends_on_local_wheels(wheels):
+    def key():
+        return wheelhouse.pins_key(["demo"], wheelhouse.local_wheels([wheels]))
+
+    wheel = wheels / "demo-1.0-cp312-cp312-android_24_arm64_v8a.whl"
+    wheel.touch()
+    first = key()
+    assert key() == first
+
+    # A new version is built.
+    (wheels / "demo-1.1-cp312-cp312-android_24_arm64_v8a.whl").touch()
+    second = key()
+    assert second != first
+
+    # A wheel is rebuilt.
+    os.utime(wheel, ns=(0, 0))
+    assert key() not in {first, second}